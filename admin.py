@@ -1,25 +1,34 @@
+import asyncio
 import html
 import logging
 import os
+import shutil
+import tempfile
 import time
 import re
+from datetime import datetime, timedelta
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton 
-from telegram.ext import ContextTypes, CallbackQueryHandler, CommandHandler, MessageHandler, filters
+from telegram.ext import ContextTypes
 
 from data_tools import (
-    is_admin, ADMIN_STATE, WAITING_PROMO, load_products, save_products, 
-    get_product, get_all_purchases_flat, reset_db, fmt_dt, validate_text_length,
+    is_admin, ADMIN_STATE, WAITING_PROMO, reset_db, fmt_dt, validate_text_length,
     MAX_ID_LENGTH, MAX_TITLE_LENGTH, MAX_DESCRIPTION_LENGTH, MAX_DELIVER_TEXT_LENGTH,
     MAX_DELIVER_URL_LENGTH, MAX_PRICE_STARS, MIN_PRICE_STARS, MAX_PRICE_RUB, MIN_PRICE_RUB,
-    Product, YOOKASSA_PAYMENTS_FILE, check_rate_limit, ADMIN_IDS
+    Product, YOOKASSA_PAYMENTS_FILE, check_rate_limit
 )
-from keyboards import admin_menu_kb, edit_select_product_kb
-from payments import load_yookassa_payments, get_yookassa_payment
+from keyboards import ADMIN_PAGE_SIZE, admin_menu_kb, clamp_page, page_count
+from render_cache import edit_select_markup
+from payments import get_yookassa_payment
+from backup import create_backup
+import admin_reports
+from router import parse_callback
+import catalog
+import tenants
 
 logger = logging.getLogger(__name__)
 
 # Словарь для защиты от CSRF (простейшая реализация)
-ADMIN_CSRF_TOKENS = {}
+ADMIN_CSRF_TOKENS = tenants.TenantDict()
 
 
 def generate_csrf_token(user_id: int) -> str:
@@ -49,17 +58,9 @@ def verify_csrf_token(user_id: int, token: str) -> bool:
 
 
 def extract_admin_action_and_csrf(data: str) -> tuple:
-    """Извлекает действие и CSRF токен из callback_data"""
-    if ":" not in data:
-        return data, None
-    
-    parts = data.split(":", 2)
-    if len(parts) == 3 and parts[0] == "admin":
-        return f"admin:{parts[1]}", parts[2]
-    elif len(parts) == 2 and parts[0] == "admin":
-        return data, None
-    
-    return data, None
+    """Извлекает действие и CSRF токен из callback_data ("admin:<action>[:<token>]")"""
+    route = parse_callback(data)
+    return route.action, (route.args[0] if route.args else None)
 
 
 # ---------- КОМАНДЫ АДМИНИСТРАТОРА ----------
@@ -88,7 +89,7 @@ async def admin(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     await update.message.reply_text(
         f"🔧 <b>Панель администратора</b>\n\n"
         f"🆔 Ваш ID: <code>{uid}</code>\n"
-        f"👥 Админов в системе: {len(ADMIN_IDS)}\n\n"
+        f"👥 Админов в системе: {len(tenants.current().admin_ids)}\n\n"
         f"<i>Токен безопасности: {csrf_token[:8]}...</i>",
         reply_markup=admin_menu_kb(csrf_token),
         parse_mode="HTML"
@@ -127,59 +128,32 @@ async def on_admin_click(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     WAITING_PROMO.pop(uid, None)
     
     # Обработка действий
-    if action == "admin:products":
-        await handle_admin_products(query, uid)
-        return
-        
-    if action == "admin:stats":
-        await handle_admin_stats(query, uid)
-        return
-        
-    if action == "admin:last_purchases":
-        await handle_admin_last_purchases(query, uid)
-        return
-        
-    if action == "admin:yookassa_payments":
-        await handle_admin_yookassa_payments(query, uid)
-        return
-        
-    if action == "admin:reset_stats":
-        await handle_admin_reset_stats(query, uid)
-        return
-        
-    if action == "admin:add_product":
-        await handle_admin_add_product(query, uid)
-        return
-        
-    if action == "admin:delete_product":
-        await handle_admin_delete_product(query, uid)
-        return
-        
-    if action == "admin:edit_product":
-        await handle_admin_edit_product(query, uid)
-        return
-        
-    if action == "admin:back":
-        csrf_token = generate_csrf_token(uid)
-        try:
-            await query.edit_message_text(
-                f"🔧 <b>Панель администратора</b>\n\n"
-                f"🆔 Ваш ID: <code>{uid}</code>",
-                reply_markup=admin_menu_kb(csrf_token),
-                parse_mode="HTML"
-            )
-        except Exception as e:
-            logger.error(f"Ошибка в admin:back: {e}")
-            await query.message.reply_text(
-                f"🔧 Панель администратора (ID: {uid})",
-                reply_markup=admin_menu_kb(csrf_token)
-            )
-        return
+    handler = ADMIN_ACTIONS.get(action)
+    if handler:
+        await handler(query, uid)
+
+
+async def handle_admin_back(query, uid):
+    """Возврат в главное меню админ-панели"""
+    csrf_token = generate_csrf_token(uid)
+    try:
+        await query.edit_message_text(
+            f"🔧 <b>Панель администратора</b>\n\n"
+            f"🆔 Ваш ID: <code>{uid}</code>",
+            reply_markup=admin_menu_kb(csrf_token),
+            parse_mode="HTML"
+        )
+    except Exception as e:
+        logger.error(f"Ошибка в admin:back: {e}")
+        await query.message.reply_text(
+            f"🔧 Панель администратора (ID: {uid})",
+            reply_markup=admin_menu_kb(csrf_token)
+        )
 
 
 async def handle_admin_products(query, uid):
     """Обработчик просмотра товаров"""
-    products = load_products()
+    products = catalog.get_catalog().products
     if not products:
         try:
             await query.edit_message_text(
@@ -222,30 +196,26 @@ async def handle_admin_products(query, uid):
 
 async def handle_admin_stats(query, uid):
     """Обработчик статистики"""
-    allp = get_all_purchases_flat()
+    # Чтение идёт из снимка только на чтение в отдельном потоке
+    await asyncio.to_thread(admin_reports.refresh_snapshot)
+    stats = await asyncio.to_thread(admin_reports.purchase_stats)
     
-    total_orders = len(allp)
-    total_stars = sum(int(it.get("stars", 0)) for _, it in allp)
-    total_rub = sum(int(it.get("rub", it.get("stars", 0) * 10)) for _, it in allp)
-    
-    # Статистика по методам оплаты
-    payment_methods = {}
-    for _, it in allp:
-        method = it.get("payment_method", "stars")
-        payment_methods[method] = payment_methods.get(method, 0) + 1
+    total_orders = stats["orders"]
+    total_stars = stats["stars"]
+    total_rub = stats["rub"]
     
     payment_stats_lines = []
-    for method, count in payment_methods.items():
+    for method, count in stats["methods"]:
         method_name = "⭐ Stars" if method == "stars" else "💰 ЮКасса" if method == "yookassa" else method
         payment_stats_lines.append(f"• {method_name}: {count}")
     
     payment_stats = "\n".join(payment_stats_lines) if payment_stats_lines else "• Нет данных"
     
     # Статистика по ЮКассе
-    yookassa_payments_data = load_yookassa_payments()
-    successful_yookassa = sum(1 for p in yookassa_payments_data.values() if p.get("status") == "succeeded")
-    pending_yookassa = sum(1 for p in yookassa_payments_data.values() if p.get("status") in ["pending", "waiting_for_capture"])
-    total_yookassa_amount = sum(p.get("amount", 0) for p in yookassa_payments_data.values() if p.get("status") == "succeeded")
+    yookassa = await asyncio.to_thread(admin_reports.yookassa_summary)
+    successful_yookassa = yookassa["succeeded"]
+    pending_yookassa = yookassa["pending"]
+    total_yookassa_amount = yookassa["amount"]
     
     text = (
         "📊 <b>Статистика магазина</b>\n\n"
@@ -278,8 +248,9 @@ async def handle_admin_stats(query, uid):
 
 async def handle_admin_last_purchases(query, uid):
     """Обработчик последних покупок"""
-    allp = get_all_purchases_flat()
-    if not allp:
+    await asyncio.to_thread(admin_reports.refresh_snapshot)
+    last, total_purchases = await asyncio.to_thread(admin_reports.last_purchases, 20)
+    if not last:
         try:
             await query.edit_message_text(
                 "📜 <b>Покупок пока нет</b>\n\n"
@@ -295,7 +266,6 @@ async def handle_admin_last_purchases(query, uid):
             )
         return
     
-    last = allp[-20:]  # Последние 20 покупок
     lines = ["📜 <b>Последние покупки (20):</b>"]
     
     for user_id_str, it in last:
@@ -317,7 +287,7 @@ async def handle_admin_last_purchases(query, uid):
             f"{method_icon} {title} — {it.get('stars')}⭐ / {it.get('rub', it.get('stars', 0)*10)}₽{yookassa_id_short}"
         )
     
-    lines.append(f"\n<b>Всего покупок в истории:</b> {len(allp)}")
+    lines.append(f"\n<b>Всего покупок в истории:</b> {total_purchases}")
     
     try:
         await query.edit_message_text(
@@ -336,8 +306,9 @@ async def handle_admin_last_purchases(query, uid):
 
 async def handle_admin_yookassa_payments(query, uid):
     """Обработчик платежей ЮКассы"""
-    payments = load_yookassa_payments()
-    if not payments:
+    await asyncio.to_thread(admin_reports.refresh_snapshot)
+    recent = await asyncio.to_thread(admin_reports.recent_yookassa_payments, 20)
+    if not recent:
         try:
             await query.edit_message_text(
                 "💳 <b>Платежей ЮКассы пока нет</b>\n\n"
@@ -361,40 +332,28 @@ async def handle_admin_yookassa_payments(query, uid):
         "canceled": "❌"
     }
     
-    # Сортируем по времени создания
-    sorted_payments = sorted(payments.items(), key=lambda x: x[1].get('created_at', 0), reverse=True)
-    
-    for payment_id, p in sorted_payments[:20]:
-        status = p.get("status", "unknown")
+    for p in recent:
+        payment_id = p["payment_id"]
+        status = p.get("status") or "unknown"
         icon = status_icons.get(status, "❓")
         
-        product = get_product(load_products(), p.get("product_id", ""))
-        if product:
-            product_title = html.escape(product.title[:20])
-        else:
-            product_title = html.escape(p.get("product_id", "?")[:20])
+        product_title = html.escape((p.get("product_title") or p.get("product_id") or "?")[:20])
         
         user_id = p.get('user_id', '?')
-        amount = p.get('amount', 0)
-        created_at = fmt_dt(p.get('created_at', 0))
+        amount = p.get('amount') or 0
+        created_at = fmt_dt(int(p.get('created_at') or 0))
         
         lines.append(
             f"• {icon} {created_at} | 👤 {user_id} | "
             f"{product_title} | {amount}₽ | {status} | ID: {payment_id[:8]}..."
         )
     
-    lines.append(f"\n<b>Всего платежей:</b> {len(payments)}")
-    
-    successful = sum(1 for p in payments.values() if p.get("status") == "succeeded")
-    pending = sum(1 for p in payments.values() if p.get("status") in ["pending", "waiting_for_capture"])
-    canceled = sum(1 for p in payments.values() if p.get("status") == "canceled")
-    
-    lines.append(f"✅ <b>Успешных:</b> {successful}")
-    lines.append(f"⏳ <b>В ожидании:</b> {pending}")
-    lines.append(f"❌ <b>Отменено:</b> {canceled}")
-    
-    total_amount = sum(p.get("amount", 0) for p in payments.values() if p.get("status") == "succeeded")
-    lines.append(f"💰 <b>Общая сумма:</b> {total_amount:.2f}₽")
+    summary = await asyncio.to_thread(admin_reports.yookassa_summary)
+    lines.append(f"\n<b>Всего платежей:</b> {summary['total']}")
+    lines.append(f"✅ <b>Успешных:</b> {summary['succeeded']}")
+    lines.append(f"⏳ <b>В ожидании:</b> {summary['pending']}")
+    lines.append(f"❌ <b>Отменено:</b> {summary['canceled']}")
+    lines.append(f"💰 <b>Общая сумма:</b> {summary['amount']:.2f}₽")
     
     try:
         await query.edit_message_text(
@@ -411,6 +370,53 @@ async def handle_admin_yookassa_payments(query, uid):
         )
 
 
+async def handle_admin_export(query, uid):
+    """Обработчик экспорта покупок и платежей"""
+    csrf_token = generate_csrf_token(uid)
+    ADMIN_STATE[uid] = {"mode": "export", "csrf_token": csrf_token}
+    
+    text = (
+        "📤 <b>Экспорт покупок и платежей ЮКассы</b>\n\n"
+        "Отправьте период и формат:\n"
+        "• <code>все csv</code>\n"
+        "• <code>01.01.2025-31.01.2025 csv</code>\n"
+        "• <code>01.01.2025-31.01.2025 jsonl</code> (gzip JSONL)\n\n"
+        "❌ Для отмены отправьте 'отмена'"
+    )
+    try:
+        await query.edit_message_text(
+            text,
+            reply_markup=InlineKeyboardMarkup([
+                [InlineKeyboardButton("❌ Отмена", callback_data=f"admin:back:{csrf_token}")],
+            ]),
+            parse_mode="HTML"
+        )
+    except Exception as e:
+        logger.error(f"Ошибка в admin:export: {e}")
+        await query.message.reply_text(text, parse_mode="HTML")
+
+
+def parse_export_request(text: str) -> tuple:
+    """Разбирает '<период> <формат>'. Возвращает (since, until, fmt) или None"""
+    parts = text.lower().split()
+    if not parts or len(parts) > 2:
+        return None
+    fmt = parts[1] if len(parts) == 2 else "csv"
+    if fmt not in admin_reports.EXPORT_FORMATS:
+        return None
+    if parts[0] in ("все", "all"):
+        return 0, 2 ** 62, fmt
+    try:
+        start_str, end_str = parts[0].split("-", 1)
+        start = datetime.strptime(start_str, "%d.%m.%Y")
+        end = datetime.strptime(end_str, "%d.%m.%Y") + timedelta(days=1)
+    except ValueError:
+        return None
+    if end <= start:
+        return None
+    return int(start.timestamp()), int(end.timestamp()), fmt
+
+
 async def handle_admin_reset_stats(query, uid):
     """Обработчик сброса статистики"""
     # Дополнительная проверка для опасных действий
@@ -507,7 +513,7 @@ async def handle_admin_delete_product(query, uid):
         "📋 <b>Список товаров:</b>\n"
     )
     
-    products = load_products()
+    products = catalog.get_catalog().products
     if products:
         for p in products[:10]:  # Показываем первые 10 товаров
             text += f"• <code>{html.escape(p.id)}</code> — {html.escape(p.title[:20])}\n"
@@ -535,7 +541,7 @@ async def handle_admin_delete_product(query, uid):
 
 async def handle_admin_edit_product(query, uid):
     """Обработчик редактирования товара"""
-    products = load_products()
+    products = catalog.get_catalog().products
     if not products:
         csrf_token = generate_csrf_token(uid)
         try:
@@ -557,18 +563,74 @@ async def handle_admin_edit_product(query, uid):
     
     try:
         await query.edit_message_text(
-            "✏️ <b>Выберите товар для редактирования:</b>",
-            reply_markup=edit_select_product_kb(products, csrf_token),
+            edit_select_text(len(products), 0),
+            reply_markup=edit_select_markup(csrf_token),
             parse_mode="HTML"
         )
     except Exception as e:
         logger.error(f"Ошибка в admin:edit_product (edit): {e}")
         await query.message.reply_text(
             "✏️ Выберите товар для редактирования:",
-            reply_markup=edit_select_product_kb(products, csrf_token)
+            reply_markup=edit_select_markup(csrf_token)
         )
 
 
+def edit_select_text(total: int, page: int) -> str:
+    pages = page_count(total, ADMIN_PAGE_SIZE)
+    text = "✏️ <b>Выберите товар для редактирования:</b>"
+    if pages > 1:
+        text += f"\n\n<i>Страница {page + 1} из {pages}, всего товаров: {total}</i>"
+    return text
+
+
+async def on_edit_page(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Листание списка выбора товара ("edit_page:<страница>:<csrf>")"""
+    query = update.callback_query
+    await query.answer()
+    
+    uid = query.from_user.id
+    if not is_admin(uid):
+        await query.answer("Нет доступа", show_alert=True)
+        return
+    
+    route = parse_callback(query.data)
+    csrf_token = route.args[0] if route.args else ""
+    if not verify_csrf_token(uid, csrf_token):
+        await query.answer("Ошибка безопасности", show_alert=True)
+        return
+    try:
+        page = int(route.action)
+    except ValueError:
+        page = 0
+    
+    # Токен не перевыпускается; раскладка страниц берётся из кэша экранов каталога
+    products = catalog.get_catalog().products
+    page = clamp_page(page, len(products), ADMIN_PAGE_SIZE)
+    try:
+        await query.edit_message_text(
+            edit_select_text(len(products), page),
+            reply_markup=edit_select_markup(csrf_token, page),
+            parse_mode="HTML"
+        )
+    except Exception as e:
+        logger.warning(f"Не удалось переключить страницу выбора товара: {e}")
+
+
+# Действия кнопок "admin:<action>[:<csrf>]"
+ADMIN_ACTIONS = {
+    "products": handle_admin_products,
+    "stats": handle_admin_stats,
+    "last_purchases": handle_admin_last_purchases,
+    "yookassa_payments": handle_admin_yookassa_payments,
+    "reset_stats": handle_admin_reset_stats,
+    "export": handle_admin_export,
+    "add_product": handle_admin_add_product,
+    "delete_product": handle_admin_delete_product,
+    "edit_product": handle_admin_edit_product,
+    "back": handle_admin_back,
+}
+
+
 async def on_edit_select(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Защищенный обработчик выбора товара для редактирования"""
     query = update.callback_query
@@ -588,8 +650,7 @@ async def on_edit_select(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await query.answer("Ошибка: неверный формат данных", show_alert=True)
         return
     
-    products = load_products()
-    product = get_product(products, pid)
+    product = catalog.get_product(pid)
     
     if not product:
         await query.answer("Товар не найден", show_alert=True)
@@ -601,7 +662,7 @@ async def on_edit_select(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     ADMIN_STATE[uid] = {
         "mode": "edit_product",
         "step": "id",
-        "data": product.__dict__.copy(),
+        "data": product.to_dict(),
         "original_id": pid,
         "csrf_token": new_csrf_token
     }
@@ -669,551 +730,633 @@ async def on_admin_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     if not st:
         return
     
-    # --- CONFIRM RESET MODE ---
-    if st.get("mode") == "confirm_reset":
-        if text.upper() == "ПОДТВЕРЖДАЮ СБРОС":
-            reset_db()
-            # Также очищаем платежи ЮКассы с созданием резервной копии
-            if os.path.exists(YOOKASSA_PAYMENTS_FILE):
-                try:
-                    backup_name = f"{YOOKASSA_PAYMENTS_FILE}.backup.{int(time.time())}"
-                    os.rename(YOOKASSA_PAYMENTS_FILE, backup_name)
-                    logger.info(f"Создана резервная копия платежей: {backup_name}")
-                except Exception as e:
-                    logger.error(f"Ошибка создания бэкапа платежей: {e}")
-            
-            logger.warning(f"Статистика сброшена администратором user_id={uid}")
-            
+    handler = ADMIN_TEXT_STEPS.get((st.get("mode"), st.get("step")))
+    if handler:
+        await handler(update, uid, st, text)
+
+
+# ---------- ВВОД ТЕКСТА В АДМИНКЕ ----------
+# Шаги диалогов админки: (mode, step) -> обработчик текста.
+# Обработчик проверяет ввод, сохраняет его в st["data"] и переводит st["step"] дальше.
+ADMIN_TEXT_STEPS = {}
+
+
+def admin_text_step(mode: str, step: str = None):
+    """Регистрирует обработчик текста для шага диалога"""
+    def decorator(func):
+        ADMIN_TEXT_STEPS[(mode, step)] = func
+        return func
+    return decorator
+
+
+@admin_text_step("confirm_reset")
+async def _text_confirm_reset(update: Update, uid: int, st: dict, text: str) -> None:
+    """Подтверждение сброса статистики"""
+    if text.upper() == "ПОДТВЕРЖДАЮ СБРОС":
+        # Перед сбросом снимаем полную резервную копию (база и JSON-хранилища)
+        try:
+            snapshot = await asyncio.to_thread(create_backup, label="reset")
+            logger.info(f"Создана резервная копия перед сбросом: {snapshot}")
+        except Exception as e:
+            logger.error(f"Ошибка создания резервной копии: {e}")
+            await update.message.reply_text("❌ Не удалось создать резервную копию, сброс отменён.")
+            return
+        
+        reset_db()
+        # Также очищаем платежи ЮКассы
+        payments_file = tenants.path(YOOKASSA_PAYMENTS_FILE)
+        if os.path.exists(payments_file):
+            try:
+                os.remove(payments_file)
+            except Exception as e:
+                logger.error(f"Ошибка очистки платежей ЮКассы: {e}")
+        
+        logger.warning(f"Статистика сброшена администратором user_id={uid}")
+        
+        csrf_token = generate_csrf_token(uid)
+        ADMIN_STATE.pop(uid, None)
+        
+        await update.message.reply_text(
+            "✅ <b>Статистика успешно сброшена!</b>\n\n"
+            "🗑️ <b>Удалено:</b>\n"
+            "• Все истории покупок\n"
+            "• Статистика платежей\n"
+            "• История платежей ЮКассы\n\n"
+            "💾 <b>Создана резервная копия данных</b> (python backup.py list).",
+            reply_markup=admin_menu_kb(csrf_token),
+            parse_mode="HTML"
+        )
+    else:
+        st["attempts"] = st.get("attempts", 0) + 1
+        if st["attempts"] >= 3:
             csrf_token = generate_csrf_token(uid)
             ADMIN_STATE.pop(uid, None)
-            
             await update.message.reply_text(
-                "✅ <b>Статистика успешно сброшена!</b>\n\n"
-                "🗑️ <b>Удалено:</b>\n"
-                "• Все истории покупок\n"
-                "• Статистика платежей\n"
-                "• История платежей ЮКассы\n\n"
-                "💾 <b>Создана резервная копия файла платежей.</b>",
-                reply_markup=admin_menu_kb(csrf_token),
-                parse_mode="HTML"
+                "❌ Слишком много неудачных попыток. Действие отменено.",
+                reply_markup=admin_menu_kb(csrf_token)
             )
         else:
-            st["attempts"] = st.get("attempts", 0) + 1
-            if st["attempts"] >= 3:
-                csrf_token = generate_csrf_token(uid)
-                ADMIN_STATE.pop(uid, None)
-                await update.message.reply_text(
-                    "❌ Слишком много неудачных попыток. Действие отменено.",
-                    reply_markup=admin_menu_kb(csrf_token)
-                )
-            else:
-                await update.message.reply_text(
-                    f"⚠️ <b>Неправильное подтверждение</b>\n\n"
-                    f"Для подтверждения сброса статистики введите точно:\n"
-                    f"<code>ПОДТВЕРЖДАЮ СБРОС</code>\n\n"
-                    f"Попыток: {st['attempts']}/3\n"
-                    f"❌ Для отмены отправьте 'отмена'",
-                    parse_mode="HTML"
-                )
+            await update.message.reply_text(
+                f"⚠️ <b>Неправильное подтверждение</b>\n\n"
+                f"Для подтверждения сброса статистики введите точно:\n"
+                f"<code>ПОДТВЕРЖДАЮ СБРОС</code>\n\n"
+                f"Попыток: {st['attempts']}/3\n"
+                f"❌ Для отмены отправьте 'отмена'",
+                parse_mode="HTML"
+            )
+
+
+@admin_text_step("export")
+async def _text_export(update: Update, uid: int, st: dict, text: str) -> None:
+    """Период и формат выгрузки"""
+    parsed = parse_export_request(text)
+    if not parsed:
+        await update.message.reply_text(
+            "⚠️ Не удалось разобрать запрос. Пример: <code>01.01.2025-31.01.2025 csv</code>",
+            parse_mode="HTML"
+        )
         return
+    since, until, fmt = parsed
+    ADMIN_STATE.pop(uid, None)
+    await update.message.reply_text("⏳ Готовлю выгрузку...")
     
-    # --- DELETE PRODUCT MODE ---
-    if st.get("mode") == "delete_product":
-        pid = text
-        
-        error = validate_text_length(pid, "ID товара", MAX_ID_LENGTH)
-        if error:
-            await update.message.reply_text(error)
-            return
-            
-        products = load_products()
-        before = len(products)
-        products = [p for p in products if p.id != pid]
-        after = len(products)
-        
-        ADMIN_STATE.pop(uid, None)
-        
-        if after == before:
-            csrf_token = generate_csrf_token(uid)
-            await update.message.reply_text(
-                f"❌ Товар с ID <code>{html.escape(pid)}</code> не найден.",
-                reply_markup=admin_menu_kb(csrf_token),
-                parse_mode="HTML",
+    # Выгрузка пишется потоково из снимка во временную папку и удаляется после отправки
+    workdir = tempfile.mkdtemp(prefix="export_")
+    try:
+        await asyncio.to_thread(admin_reports.refresh_snapshot)
+        for kind, caption in (("purchases", "🛒 Покупки"), ("yookassa", "💳 Платежи ЮКассы")):
+            paths, count = await asyncio.to_thread(
+                admin_reports.write_export, kind, fmt, workdir, since, until
             )
-            return
-        
-        save_products(products)
-        logger.info(f"Товар {pid} удален администратором user_id={uid}")
+            if not count:
+                await update.message.reply_text(f"{caption}: за период записей нет")
+                continue
+            for i, path in enumerate(paths, 1):
+                part = f" (часть {i}/{len(paths)})" if len(paths) > 1 else ""
+                with open(path, "rb") as f:
+                    await update.message.reply_document(
+                        document=f,
+                        filename=os.path.basename(path),
+                        caption=f"{caption}: {count} записей{part}"
+                    )
+        logger.info(f"Экспорт ({fmt}) выполнен администратором user_id={uid}")
+    except Exception as e:
+        logger.error(f"Ошибка экспорта: {e}", exc_info=True)
+        await update.message.reply_text("❌ Ошибка при формировании выгрузки")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    
+    await update.message.reply_text(
+        "✅ Экспорт завершён",
+        reply_markup=admin_menu_kb(generate_csrf_token(uid))
+    )
+
+
+@admin_text_step("delete_product", "id")
+async def _text_delete_product(update: Update, uid: int, st: dict, text: str) -> None:
+    """ID удаляемого товара"""
+    pid = text
+    
+    error = validate_text_length(pid, "ID товара", MAX_ID_LENGTH)
+    if error:
+        await update.message.reply_text(error)
+        return
         
+    deleted = catalog.delete_product(pid)
+    
+    ADMIN_STATE.pop(uid, None)
+    
+    if not deleted:
         csrf_token = generate_csrf_token(uid)
         await update.message.reply_text(
-            f"✅ Товар <code>{html.escape(pid)}</code> успешно удалён.",
+            f"❌ Товар с ID <code>{html.escape(pid)}</code> не найден.",
             reply_markup=admin_menu_kb(csrf_token),
             parse_mode="HTML",
         )
         return
     
-    # --- ADD PRODUCT MODE ---
-    if st.get("mode") == "add_product":
-        step = st.get("step")
-        data = st.setdefault("data", {})
-        csrf_token = st.get("csrf_token", generate_csrf_token(uid))
+    logger.info(f"Товар {pid} удален администратором user_id={uid}")
+    
+    csrf_token = generate_csrf_token(uid)
+    await update.message.reply_text(
+        f"✅ Товар <code>{html.escape(pid)}</code> успешно удалён.",
+        reply_markup=admin_menu_kb(csrf_token),
+        parse_mode="HTML",
+    )
+
+
+@admin_text_step("add_product", "id")
+async def _text_add_id(update: Update, uid: int, st: dict, text: str) -> None:
+    """Добавление товара: ID"""
+    data = st.setdefault("data", {})
+    
+    error = validate_text_length(text, "ID товара", MAX_ID_LENGTH)
+    if error:
+        await update.message.reply_text(error)
+        return
         
-        if step == "id":
-            error = validate_text_length(text, "ID товара", MAX_ID_LENGTH)
-            if error:
-                await update.message.reply_text(error)
-                return
-                
-            # Проверка на допустимые символы
-            if not re.match(r'^[a-zA-Z0-9_\-]+$', text):
-                await update.message.reply_text("❌ ID может содержать только латинские буквы, цифры, _ и -")
-                return
-                
-            products = load_products()
-            if get_product(products, text):
-                await update.message.reply_text("❌ Такой ID уже существует. Пришлите другой ID.")
-                return
-                
-            data["id"] = text
-            st["step"] = "title"
-            await update.message.reply_text(
-                f"<b>Шаг 2/7:</b> отправьте название товара (title)\n\n"
-                f"<b>❕ Ограничения:</b>\n"
-                f"• Максимум {MAX_TITLE_LENGTH} символов\n"
-                "• Можно использовать русские и английские буквы, цифры, пробелы и знаки препинания\n\n"
-                f"❌ <b>Отмена:</b> отправьте 'отмена'",
-                parse_mode="HTML"
-            )
-            return
+    # Проверка на допустимые символы
+    if not re.match(r'^[a-zA-Z0-9_\-]+$', text):
+        await update.message.reply_text("❌ ID может содержать только латинские буквы, цифры, _ и -")
+        return
+        
+    if catalog.get_product(text):
+        await update.message.reply_text("❌ Такой ID уже существует. Пришлите другой ID.")
+        return
+        
+    data["id"] = text
+    st["step"] = "title"
+    await update.message.reply_text(
+        f"<b>Шаг 2/7:</b> отправьте название товара (title)\n\n"
+        f"<b>❕ Ограничения:</b>\n"
+        f"• Максимум {MAX_TITLE_LENGTH} символов\n"
+        "• Можно использовать русские и английские буквы, цифры, пробелы и знаки препинания\n\n"
+        f"❌ <b>Отмена:</b> отправьте 'отмена'",
+        parse_mode="HTML"
+    )
 
-        if step == "title":
-            error = validate_text_length(text, "название товара", MAX_TITLE_LENGTH)
-            if error:
-                await update.message.reply_text(error)
-                return
-                
-            data["title"] = text
-            st["step"] = "description"
-            await update.message.reply_text(
-                f"<b>Шаг 3/7:</b> отправьте описание товара (description)\n\n"
-                f"<b>❕ Ограничения:</b>\n"
-                f"• Максимум {MAX_DESCRIPTION_LENGTH} символов\n"
-                "• Можно использовать любое форматирование\n"
-                "• Поддерживаются переносы строк\n\n"
-                f"❌ <b>Отмена:</b> отправьте 'отмена'",
-                parse_mode="HTML"
-            )
+
+@admin_text_step("add_product", "title")
+async def _text_add_title(update: Update, uid: int, st: dict, text: str) -> None:
+    """Добавление товара: название"""
+    data = st.setdefault("data", {})
+    
+    error = validate_text_length(text, "название товара", MAX_TITLE_LENGTH)
+    if error:
+        await update.message.reply_text(error)
+        return
+        
+    data["title"] = text
+    st["step"] = "description"
+    await update.message.reply_text(
+        f"<b>Шаг 3/7:</b> отправьте описание товара (description)\n\n"
+        f"<b>❕ Ограничения:</b>\n"
+        f"• Максимум {MAX_DESCRIPTION_LENGTH} символов\n"
+        "• Можно использовать любое форматирование\n"
+        "• Поддерживаются переносы строк\n\n"
+        f"❌ <b>Отмена:</b> отправьте 'отмена'",
+        parse_mode="HTML"
+    )
+
+
+@admin_text_step("add_product", "description")
+async def _text_add_description(update: Update, uid: int, st: dict, text: str) -> None:
+    """Добавление товара: описание"""
+    data = st.setdefault("data", {})
+    
+    error = validate_text_length(text, "описание товара", MAX_DESCRIPTION_LENGTH)
+    if error:
+        await update.message.reply_text(error)
+        return
+        
+    data["description"] = text
+    st["step"] = "price_stars"
+    await update.message.reply_text(
+        f"<b>Шаг 4/7:</b> отправьте цену в ⭐ (только число)\n\n"
+        f"<b>❕ Ограничения:</b>\n"
+        f"• Минимум {MIN_PRICE_STARS} звезда\n"
+        f"• Максимум {MAX_PRICE_STARS} звезд\n"
+        "• Пример: 25, 100, 500\n\n"
+        f"❌ <b>Отмена:</b> отправьте 'отмена'",
+        parse_mode="HTML"
+    )
+
+
+@admin_text_step("add_product", "price_stars")
+async def _text_add_price_stars(update: Update, uid: int, st: dict, text: str) -> None:
+    """Добавление товара: цена в звёздах"""
+    data = st.setdefault("data", {})
+    
+    try:
+        price = int(text)
+        if price < MIN_PRICE_STARS:
+            await update.message.reply_text(f"❌ Цена должна быть не меньше {MIN_PRICE_STARS}. Пример: 25")
+            return
+        if price > MAX_PRICE_STARS:
+            await update.message.reply_text(f"❌ Цена слишком большая. Максимум {MAX_PRICE_STARS} звезд.")
             return
+    except ValueError:
+        await update.message.reply_text("❌ Цена должна быть целым числом > 0. Пример: 25")
+        return
+        
+    data["price_stars"] = price
+    st["step"] = "price_rub"
+    await update.message.reply_text(
+        f"<b>Шаг 5/7:</b> отправьте цену в ₽ (только число)\n\n"
+        f"📊 <b>Авто-расчет:</b> {price}⭐ = {price * 10}₽\n"
+        f"Для использования авто-расчета отправьте <code>-</code>\n\n"
+        f"<b>❕ Ограничения:</b>\n"
+        f"• Минимум {MIN_PRICE_RUB} рубль\n"
+        f"• Максимум {MAX_PRICE_RUB} рублей\n\n"
+        f"❌ <b>Отмена:</b> отправьте 'отмена'",
+        parse_mode="HTML"
+    )
 
-        if step == "description":
-            error = validate_text_length(text, "описание товара", MAX_DESCRIPTION_LENGTH)
-            if error:
-                await update.message.reply_text(error)
+
+@admin_text_step("add_product", "price_rub")
+async def _text_add_price_rub(update: Update, uid: int, st: dict, text: str) -> None:
+    """Добавление товара: цена в рублях"""
+    data = st.setdefault("data", {})
+    
+    if text == "-":
+        # Используем авто-расчет: 1 звезда = 10 рублей
+        data["price_rub"] = data["price_stars"] * 10
+    else:
+        try:
+            price_rub = int(text)
+            if price_rub < MIN_PRICE_RUB:
+                await update.message.reply_text(f"❌ Цена должна быть не меньше {MIN_PRICE_RUB} рублей.")
                 return
-                
-            data["description"] = text
-            st["step"] = "price_stars"
-            await update.message.reply_text(
-                f"<b>Шаг 4/7:</b> отправьте цену в ⭐ (только число)\n\n"
-                f"<b>❕ Ограничения:</b>\n"
-                f"• Минимум {MIN_PRICE_STARS} звезда\n"
-                f"• Максимум {MAX_PRICE_STARS} звезд\n"
-                "• Пример: 25, 100, 500\n\n"
-                f"❌ <b>Отмена:</b> отправьте 'отмена'",
-                parse_mode="HTML"
-            )
+            if price_rub > MAX_PRICE_RUB:
+                await update.message.reply_text(f"❌ Цена слишком большая. Максимум {MAX_PRICE_RUB} рублей.")
+                return
+            data["price_rub"] = price_rub
+        except ValueError:
+            await update.message.reply_text("❌ Цена должна быть целым числом > 0. Пример: 250")
             return
+    
+    st["step"] = "deliver_text"
+    await update.message.reply_text(
+        f"<b>Шаг 6/7:</b> отправьте текст выдачи (deliver_text)\n\n"
+        f"<b>❕ Ограничения:</b>\n"
+        f"• Максимум {MAX_DELIVER_TEXT_LENGTH} символов\n"
+        "• Если не нужен — отправьте просто: -\n"
+        "• Это текст, который получит пользователь после оплаты\n\n"
+        f"❌ <b>Отмена:</b> отправьте 'отмена'",
+        parse_mode="HTML"
+    )
 
-        if step == "price_stars":
-            try:
-                price = int(text)
-                if price < MIN_PRICE_STARS:
-                    await update.message.reply_text(f"❌ Цена должна быть не меньше {MIN_PRICE_STARS}. Пример: 25")
-                    return
-                if price > MAX_PRICE_STARS:
-                    await update.message.reply_text(f"❌ Цена слишком большая. Максимум {MAX_PRICE_STARS} звезд.")
-                    return
-            except ValueError:
-                await update.message.reply_text("❌ Цена должна быть целым числом > 0. Пример: 25")
-                return
-                
-            data["price_stars"] = price
-            st["step"] = "price_rub"
-            await update.message.reply_text(
-                f"<b>Шаг 5/7:</b> отправьте цену в ₽ (только число)\n\n"
-                f"📊 <b>Авто-расчет:</b> {price}⭐ = {price * 10}₽\n"
-                f"Для использования авто-расчета отправьте <code>-</code>\n\n"
-                f"<b>❕ Ограничения:</b>\n"
-                f"• Минимум {MIN_PRICE_RUB} рубль\n"
-                f"• Максимум {MAX_PRICE_RUB} рублей\n\n"
-                f"❌ <b>Отмена:</b> отправьте 'отмена'",
-                parse_mode="HTML"
-            )
+
+@admin_text_step("add_product", "deliver_text")
+async def _text_add_deliver_text(update: Update, uid: int, st: dict, text: str) -> None:
+    """Добавление товара: текст выдачи"""
+    data = st.setdefault("data", {})
+    
+    if text != "-":
+        error = validate_text_length(text, "текст выдачи", MAX_DELIVER_TEXT_LENGTH)
+        if error:
+            await update.message.reply_text(error)
             return
+            
+    data["deliver_text"] = "" if text == "-" else text
+    st["step"] = "deliver_url"
+    await update.message.reply_text(
+        f"<b>Шаг 7/7:</b> отправьте ссылку (deliver_url)\n\n"
+        f"<b>❕ Ограничения:</b>\n"
+        f"• Максимум {MAX_DELIVER_URL_LENGTH} символов\n"
+        "• Если не нужна — отправьте просто: -\n"
+        "• Должна начинаться с http:// или https://\n"
+        "• Это ссылка, которая будет отправлена пользователю после оплаты\n\n"
+        f"❌ <b>Отмена:</b> отправьте 'отмена'",
+        parse_mode="HTML"
+    )
+
 
-        if step == "price_rub":
-            if text == "-":
-                # Используем авто-расчет: 1 звезда = 10 рублей
-                data["price_rub"] = data["price_stars"] * 10
-            else:
-                try:
-                    price_rub = int(text)
-                    if price_rub < MIN_PRICE_RUB:
-                        await update.message.reply_text(f"❌ Цена должна быть не меньше {MIN_PRICE_RUB} рублей.")
-                        return
-                    if price_rub > MAX_PRICE_RUB:
-                        await update.message.reply_text(f"❌ Цена слишком большая. Максимум {MAX_PRICE_RUB} рублей.")
-                        return
-                    data["price_rub"] = price_rub
-                except ValueError:
-                    await update.message.reply_text("❌ Цена должна быть целым числом > 0. Пример: 250")
-                    return
+@admin_text_step("add_product", "deliver_url")
+async def _text_add_deliver_url(update: Update, uid: int, st: dict, text: str) -> None:
+    """Добавление товара: ссылка выдачи"""
+    data = st.setdefault("data", {})
+    csrf_token = st.get("csrf_token") or generate_csrf_token(uid)
+    
+    if text != "-":
+        error = validate_text_length(text, "ссылка", MAX_DELIVER_URL_LENGTH)
+        if error:
+            await update.message.reply_text(error)
+            return
             
-            st["step"] = "deliver_text"
+        if not text.startswith(("http://", "https://")):
             await update.message.reply_text(
-                f"<b>Шаг 6/7:</b> отправьте текст выдачи (deliver_text)\n\n"
-                f"<b>❕ Ограничения:</b>\n"
-                f"• Максимум {MAX_DELIVER_TEXT_LENGTH} символов\n"
-                "• Если не нужен — отправьте просто: -\n"
-                "• Это текст, который получит пользователь после оплаты\n\n"
-                f"❌ <b>Отмена:</b> отправьте 'отмена'",
-                parse_mode="HTML"
+                "❌ Ссылка должна начинаться с http:// или https://"
             )
             return
 
-        if step == "deliver_text":
-            if text != "-":
-                error = validate_text_length(text, "текст выдачи", MAX_DELIVER_TEXT_LENGTH)
-                if error:
-                    await update.message.reply_text(error)
-                    return
-                    
-            data["deliver_text"] = "" if text == "-" else text
-            st["step"] = "deliver_url"
-            await update.message.reply_text(
-                f"<b>Шаг 7/7:</b> отправьте ссылку (deliver_url)\n\n"
-                f"<b>❕ Ограничения:</b>\n"
-                f"• Максимум {MAX_DELIVER_URL_LENGTH} символов\n"
-                "• Если не нужна — отправьте просто: -\n"
-                "• Должна начинаться с http:// или https://\n"
-                "• Это ссылка, которая будет отправлена пользователю после оплаты\n\n"
-                f"❌ <b>Отмена:</b> отправьте 'отмена'",
-                parse_mode="HTML"
-            )
-            return
+    data["deliver_url"] = "" if text == "-" else text
 
-        if step == "deliver_url":
-            if text != "-":
-                error = validate_text_length(text, "ссылка", MAX_DELIVER_URL_LENGTH)
-                if error:
-                    await update.message.reply_text(error)
-                    return
-                    
-                if not text.startswith(("http://", "https://")):
-                    await update.message.reply_text(
-                        "❌ Ссылка должна начинаться с http:// или https://"
-                    )
-                    return
+    try:
+        newp = Product(
+            id=str(data["id"]),
+            title=str(data["title"]),
+            description=str(data["description"]),
+            price_stars=int(data["price_stars"]),
+            price_rub=int(data.get("price_rub", data["price_stars"] * 10)),
+            deliver_text=str(data.get("deliver_text", "")),
+            deliver_url=str(data.get("deliver_url", "")),
+        )
+        if catalog.get_product(newp.id):
+            raise ValueError("товар с таким ID уже существует")
+        catalog.save_product(newp)
+        
+        logger.info(f"Товар добавлен администратором user_id={uid}: {newp.id} - {newp.title}")
+        
+    except Exception as e:
+        await update.message.reply_text(f"❌ Не удалось сохранить товар: {e}")
+        ADMIN_STATE.pop(uid, None)
+        return
 
-            data["deliver_url"] = "" if text == "-" else text
+    ADMIN_STATE.pop(uid, None)
+    
+    await update.message.reply_text(
+        f"✅ <b>Товар успешно добавлен!</b>\n\n"
+        f"🆔 <b>ID:</b> <code>{newp.id}</code>\n"
+        f"📦 <b>Название:</b> {newp.title}\n"
+        f"💰 <b>Цена:</b> {newp.price_stars}⭐ / {newp.price_rub}₽\n"
+        f"📝 <b>Описание:</b> {len(newp.description)} символов\n"
+        f"🎁 <b>Текст выдачи:</b> {'есть' if newp.deliver_text else 'нет'}\n"
+        f"🔗 <b>Ссылка:</b> {'есть' if newp.deliver_url else 'нет'}",
+        reply_markup=admin_menu_kb(csrf_token),
+        parse_mode="HTML",
+    )
 
-            try:
-                newp = Product(
-                    id=str(data["id"]),
-                    title=str(data["title"]),
-                    description=str(data["description"]),
-                    price_stars=int(data["price_stars"]),
-                    price_rub=int(data.get("price_rub", data["price_stars"] * 10)),
-                    deliver_text=str(data.get("deliver_text", "")),
-                    deliver_url=str(data.get("deliver_url", "")),
-                )
-                products = load_products()
-                products.append(newp)
-                save_products(products)
-                
-                logger.info(f"Товар добавлен администратором user_id={uid}: {newp.id} - {newp.title}")
-                
-            except Exception as e:
-                await update.message.reply_text(f"❌ Не удалось сохранить товар: {e}")
-                ADMIN_STATE.pop(uid, None)
-                return
 
-            ADMIN_STATE.pop(uid, None)
+@admin_text_step("edit_product", "id")
+async def _text_edit_id(update: Update, uid: int, st: dict, text: str) -> None:
+    """Редактирование товара: ID"""
+    data = st.setdefault("data", {})
+    original_id = st.get("original_id")
+    
+    if text == "-":
+        data["id"] = original_id
+    else:
+        error = validate_text_length(text, "ID товара", MAX_ID_LENGTH)
+        if error:
+            await update.message.reply_text(error)
+            return
             
-            await update.message.reply_text(
-                f"✅ <b>Товар успешно добавлен!</b>\n\n"
-                f"🆔 <b>ID:</b> <code>{newp.id}</code>\n"
-                f"📦 <b>Название:</b> {newp.title}\n"
-                f"💰 <b>Цена:</b> {newp.price_stars}⭐ / {newp.price_rub}₽\n"
-                f"📝 <b>Описание:</b> {len(newp.description)} символов\n"
-                f"🎁 <b>Текст выдачи:</b> {'есть' if newp.deliver_text else 'нет'}\n"
-                f"🔗 <b>Ссылка:</b> {'есть' if newp.deliver_url else 'нет'}",
-                reply_markup=admin_menu_kb(csrf_token),
-                parse_mode="HTML",
-            )
+        # Проверка на допустимые символы
+        if not re.match(r'^[a-zA-Z0-9_\-]+$', text):
+            await update.message.reply_text("❌ ID может содержать только латинские буквы, цифры, _ и -")
             return
-
-    # --- EDIT PRODUCT MODE ---
-    if st.get("mode") == "edit_product":
-        step = st.get("step")
-        data = st.setdefault("data", {})
-        original_id = st.get("original_id")
-        csrf_token = st.get("csrf_token", generate_csrf_token(uid))
-        
-        if step == "id":
-            if text == "-":
-                data["id"] = original_id
-            else:
-                error = validate_text_length(text, "ID товара", MAX_ID_LENGTH)
-                if error:
-                    await update.message.reply_text(error)
-                    return
-                    
-                # Проверка на допустимые символы
-                if not re.match(r'^[a-zA-Z0-9_\-]+$', text):
-                    await update.message.reply_text("❌ ID может содержать только латинские буквы, цифры, _ и -")
-                    return
-                    
-                products = load_products()
-                existing_product = get_product(products, text)
-                if existing_product and existing_product.id != original_id:
-                    await update.message.reply_text(
-                        f"❌ Товар с ID <code>{html.escape(text)}</code> уже существует. Пришлите другой ID."
-                    )
-                    return
-                data["id"] = text
             
-            st["step"] = "title"
+        existing_product = catalog.get_product(text)
+        if existing_product and existing_product.id != original_id:
             await update.message.reply_text(
-                f"<b>Шаг 2/8:</b> отправьте новое название товара (title)\n"
-                f"📝 <b>Текущее:</b> {html.escape(data.get('title', ''))}\n"
-                f"Для сохранения текущего значения отправьте <code>-</code>\n\n"
-                f"<b>❕ Ограничения:</b>\n"
-                f"• Максимум {MAX_TITLE_LENGTH} символов\n\n"
-                f"❌ <b>Отмена:</b> отправьте 'отмена'",
-                parse_mode="HTML"
+                f"❌ Товар с ID <code>{html.escape(text)}</code> уже существует. Пришлите другой ID."
             )
             return
+        data["id"] = text
+    
+    st["step"] = "title"
+    await update.message.reply_text(
+        f"<b>Шаг 2/8:</b> отправьте новое название товара (title)\n"
+        f"📝 <b>Текущее:</b> {html.escape(data.get('title', ''))}\n"
+        f"Для сохранения текущего значения отправьте <code>-</code>\n\n"
+        f"<b>❕ Ограничения:</b>\n"
+        f"• Максимум {MAX_TITLE_LENGTH} символов\n\n"
+        f"❌ <b>Отмена:</b> отправьте 'отмена'",
+        parse_mode="HTML"
+    )
 
-        if step == "title":
-            if text == "-":
-                pass
-            else:
-                error = validate_text_length(text, "название товара", MAX_TITLE_LENGTH)
-                if error:
-                    await update.message.reply_text(error)
-                    return
-                data["title"] = text
-                
-            st["step"] = "description"
-            await update.message.reply_text(
-                f"<b>Шаг 3/8:</b> отправьте новое описание товара (description)\n"
-                f"📝 <b>Текущее:</b> {html.escape(data.get('description', ''))}\n"
-                f"Для сохранения текущего значения отправьте <code>-</code>\n\n"
-                f"<b>❕ Ограничения:</b>\n"
-                f"• Максимум {MAX_DESCRIPTION_LENGTH} символов\n\n"
-                f"❌ <b>Отмена:</b> отправьте 'отмена'",
-                parse_mode="HTML"
-            )
-            return
 
-        if step == "description":
-            if text == "-":
-                pass
-            else:
-                error = validate_text_length(text, "описание товара", MAX_DESCRIPTION_LENGTH)
-                if error:
-                    await update.message.reply_text(error)
-                    return
-                data["description"] = text
-                
-            st["step"] = "price_stars"
-            await update.message.reply_text(
-                f"<b>Шаг 4/8:</b> отправьте новую цену в ⭐ (только число)\n"
-                f"💰 <b>Текущая:</b> {data.get('price_stars', '')}\n"
-                f"Для сохранения текущего значения отправьте <code>-</code>\n\n"
-                f"<b>❕ Ограничения:</b>\n"
-                f"• Минимум {MIN_PRICE_STARS} звезда\n"
-                f"• Максимум {MAX_PRICE_STARS} звезд\n\n"
-                f"❌ <b>Отмена:</b> отправьте 'отмена'",
-                parse_mode="HTML"
-            )
+@admin_text_step("edit_product", "title")
+async def _text_edit_title(update: Update, uid: int, st: dict, text: str) -> None:
+    """Редактирование товара: название"""
+    data = st.setdefault("data", {})
+    
+    if text == "-":
+        pass
+    else:
+        error = validate_text_length(text, "название товара", MAX_TITLE_LENGTH)
+        if error:
+            await update.message.reply_text(error)
             return
+        data["title"] = text
+        
+    st["step"] = "description"
+    await update.message.reply_text(
+        f"<b>Шаг 3/8:</b> отправьте новое описание товара (description)\n"
+        f"📝 <b>Текущее:</b> {html.escape(data.get('description', ''))}\n"
+        f"Для сохранения текущего значения отправьте <code>-</code>\n\n"
+        f"<b>❕ Ограничения:</b>\n"
+        f"• Максимум {MAX_DESCRIPTION_LENGTH} символов\n\n"
+        f"❌ <b>Отмена:</b> отправьте 'отмена'",
+        parse_mode="HTML"
+    )
 
-        if step == "price_stars":
-            if text == "-":
-                if "price_stars" not in data:
-                    await update.message.reply_text("❌ Ошибка: цена в звездах не найдена")
-                    return
-            else:
-                try:
-                    price = int(text)
-                    if price < MIN_PRICE_STARS:
-                        await update.message.reply_text(f"❌ Цена должна быть не меньше {MIN_PRICE_STARS}.")
-                        return
-                    if price > MAX_PRICE_STARS:
-                        await update.message.reply_text(f"❌ Цена слишком большая. Максимум {MAX_PRICE_STARS} звезд.")
-                        return
-                    data["price_stars"] = price
-                except ValueError:
-                    await update.message.reply_text("❌ Цена должна быть целым числом > 0. Пример: 25")
-                    return
-            
-            st["step"] = "price_rub"
-            await update.message.reply_text(
-                f"<b>Шаг 5/8:</b> отправьте новую цену в ₽ (только число)\n"
-                f"💰 <b>Текущая:</b> {data.get('price_rub', data.get('price_stars', 0) * 10)}\n"
-                f"Для сохранения текущего значения отправьте <code>-</code>\n\n"
-                f"<b>❕ Ограничения:</b>\n"
-                f"• Минимум {MIN_PRICE_RUB} рубль\n"
-                f"• Максимум {MAX_PRICE_RUB} рублей\n\n"
-                f"❌ <b>Отмена:</b> отправьте 'отмена'",
-                parse_mode="HTML"
-            )
-            return
 
-        if step == "price_rub":
-            if text == "-":
-                if "price_rub" not in data and "price_stars" in data:
-                    # Авто-расчет из звезд
-                    data["price_rub"] = data["price_stars"] * 10
-            else:
-                try:
-                    price_rub = int(text)
-                    if price_rub < MIN_PRICE_RUB:
-                        await update.message.reply_text(f"❌ Цена должна быть не меньше {MIN_PRICE_RUB} рублей.")
-                        return
-                    if price_rub > MAX_PRICE_RUB:
-                        await update.message.reply_text(f"❌ Цена слишком большая. Максимум {MAX_PRICE_RUB} рублей.")
-                        return
-                    data["price_rub"] = price_rub
-                except ValueError:
-                    await update.message.reply_text("❌ Цена должна быть целым числом > 0. Пример: 250")
-                    return
-            
-            st["step"] = "deliver_text"
-            await update.message.reply_text(
-                f"<b>Шаг 6/8:</b> отправьте новый текст выдачи (deliver_text)\n"
-                f"📝 <b>Текущий:</b> {html.escape(data.get('deliver_text', ''))}\n"
-                f"Для сохранения текущего значения отправьте <code>-</code>\n"
-                f"Для очистки отправьте <code>clear</code>\n\n"
-                f"<b>❕ Ограничения:</b>\n"
-                f"• Максимум {MAX_DELIVER_TEXT_LENGTH} символов\n\n"
-                f"❌ <b>Отмена:</b> отправьте 'отмена'",
-                parse_mode="HTML"
-            )
+@admin_text_step("edit_product", "description")
+async def _text_edit_description(update: Update, uid: int, st: dict, text: str) -> None:
+    """Редактирование товара: описание"""
+    data = st.setdefault("data", {})
+    
+    if text == "-":
+        pass
+    else:
+        error = validate_text_length(text, "описание товара", MAX_DESCRIPTION_LENGTH)
+        if error:
+            await update.message.reply_text(error)
             return
+        data["description"] = text
+        
+    st["step"] = "price_stars"
+    await update.message.reply_text(
+        f"<b>Шаг 4/8:</b> отправьте новую цену в ⭐ (только число)\n"
+        f"💰 <b>Текущая:</b> {data.get('price_stars', '')}\n"
+        f"Для сохранения текущего значения отправьте <code>-</code>\n\n"
+        f"<b>❕ Ограничения:</b>\n"
+        f"• Минимум {MIN_PRICE_STARS} звезда\n"
+        f"• Максимум {MAX_PRICE_STARS} звезд\n\n"
+        f"❌ <b>Отмена:</b> отправьте 'отмена'",
+        parse_mode="HTML"
+    )
 
-        if step == "deliver_text":
-            if text == "-":
-                pass
-            elif text.lower() == "clear":
-                data["deliver_text"] = ""
-            else:
-                error = validate_text_length(text, "текст выдачи", MAX_DELIVER_TEXT_LENGTH)
-                if error:
-                    await update.message.reply_text(error)
-                    return
-                data["deliver_text"] = text
-            
-            st["step"] = "deliver_url"
-            await update.message.reply_text(
-                f"<b>Шаг 7/8:</b> отправьте новую ссылку (deliver_url)\n"
-                f"🔗 <b>Текущая:</b> {html.escape(data.get('deliver_url', ''))}\n"
-                f"Для сохранения текущего значения отправьте <code>-</code>\n"
-                f"Для очистки отправьте <code>clear</code>\n\n"
-                f"<b>❕ Ограничения:</b>\n"
-                f"• Максимум {MAX_DELIVER_URL_LENGTH} символов\n"
-                "• Должна начинаться с http:// или https://\n\n"
-                f"❌ <b>Отмена:</b> отправьте 'отмена'",
-                parse_mode="HTML"
-            )
+
+@admin_text_step("edit_product", "price_stars")
+async def _text_edit_price_stars(update: Update, uid: int, st: dict, text: str) -> None:
+    """Редактирование товара: цена в звёздах"""
+    data = st.setdefault("data", {})
+    
+    if text == "-":
+        if "price_stars" not in data:
+            await update.message.reply_text("❌ Ошибка: цена в звездах не найдена")
             return
+    else:
+        try:
+            price = int(text)
+            if price < MIN_PRICE_STARS:
+                await update.message.reply_text(f"❌ Цена должна быть не меньше {MIN_PRICE_STARS}.")
+                return
+            if price > MAX_PRICE_STARS:
+                await update.message.reply_text(f"❌ Цена слишком большая. Максимум {MAX_PRICE_STARS} звезд.")
+                return
+            data["price_stars"] = price
+        except ValueError:
+            await update.message.reply_text("❌ Цена должна быть целым числом > 0. Пример: 25")
+            return
+    
+    st["step"] = "price_rub"
+    await update.message.reply_text(
+        f"<b>Шаг 5/8:</b> отправьте новую цену в ₽ (только число)\n"
+        f"💰 <b>Текущая:</b> {data.get('price_rub', data.get('price_stars', 0) * 10)}\n"
+        f"Для сохранения текущего значения отправьте <code>-</code>\n\n"
+        f"<b>❕ Ограничения:</b>\n"
+        f"• Минимум {MIN_PRICE_RUB} рубль\n"
+        f"• Максимум {MAX_PRICE_RUB} рублей\n\n"
+        f"❌ <b>Отмена:</b> отправьте 'отмена'",
+        parse_mode="HTML"
+    )
 
-        if step == "deliver_url":
-            if text == "-":
-                pass
-            elif text.lower() == "clear":
-                data["deliver_url"] = ""
-            else:
-                error = validate_text_length(text, "ссылка", MAX_DELIVER_URL_LENGTH)
-                if error:
-                    await update.message.reply_text(error)
-                    return
-                    
-                if not text.startswith(("http://", "https://")):
-                    await update.message.reply_text(
-                        "❌ Ссылка должна начинаться с http:// или https://"
-                    )
-                    return
-                    
-                data["deliver_url"] = text
 
-            try:
-                products = load_products()
-                
-                new_id = str(data["id"])
-                if original_id != new_id:
-                    # Удаляем старый товар если ID изменился
-                    products = [p for p in products if p.id != original_id]
-                
-                product_found = False
-                for i, p in enumerate(products):
-                    if p.id == new_id:
-                        products[i] = Product(
-                            id=new_id,
-                            title=str(data["title"]),
-                            description=str(data["description"]),
-                            price_stars=int(data["price_stars"]),
-                            price_rub=int(data.get("price_rub", data["price_stars"] * 10)),
-                            deliver_text=str(data.get("deliver_text", "")),
-                            deliver_url=str(data.get("deliver_url", "")),
-                        )
-                        product_found = True
-                        break
-                
-                if not product_found:
-                    products.append(Product(
-                        id=new_id,
-                        title=str(data["title"]),
-                        description=str(data["description"]),
-                        price_stars=int(data["price_stars"]),
-                        price_rub=int(data.get("price_rub", data["price_stars"] * 10)),
-                        deliver_text=str(data.get("deliver_text", "")),
-                        deliver_url=str(data.get("deliver_url", "")),
-                    ))
-                
-                save_products(products)
-                
-                logger.info(f"Товар отредактирован администратором user_id={uid}: {original_id} -> {new_id}")
-                
-            except Exception as e:
-                await update.message.reply_text(f"❌ Не удалось сохранить изменения: {e}")
-                ADMIN_STATE.pop(uid, None)
+@admin_text_step("edit_product", "price_rub")
+async def _text_edit_price_rub(update: Update, uid: int, st: dict, text: str) -> None:
+    """Редактирование товара: цена в рублях"""
+    data = st.setdefault("data", {})
+    
+    if text == "-":
+        if "price_rub" not in data and "price_stars" in data:
+            # Авто-расчет из звезд
+            data["price_rub"] = data["price_stars"] * 10
+    else:
+        try:
+            price_rub = int(text)
+            if price_rub < MIN_PRICE_RUB:
+                await update.message.reply_text(f"❌ Цена должна быть не меньше {MIN_PRICE_RUB} рублей.")
                 return
+            if price_rub > MAX_PRICE_RUB:
+                await update.message.reply_text(f"❌ Цена слишком большая. Максимум {MAX_PRICE_RUB} рублей.")
+                return
+            data["price_rub"] = price_rub
+        except ValueError:
+            await update.message.reply_text("❌ Цена должна быть целым числом > 0. Пример: 250")
+            return
+    
+    st["step"] = "deliver_text"
+    await update.message.reply_text(
+        f"<b>Шаг 6/8:</b> отправьте новый текст выдачи (deliver_text)\n"
+        f"📝 <b>Текущий:</b> {html.escape(data.get('deliver_text', ''))}\n"
+        f"Для сохранения текущего значения отправьте <code>-</code>\n"
+        f"Для очистки отправьте <code>clear</code>\n\n"
+        f"<b>❕ Ограничения:</b>\n"
+        f"• Максимум {MAX_DELIVER_TEXT_LENGTH} символов\n\n"
+        f"❌ <b>Отмена:</b> отправьте 'отмена'",
+        parse_mode="HTML"
+    )
 
-            ADMIN_STATE.pop(uid, None)
+
+@admin_text_step("edit_product", "deliver_text")
+async def _text_edit_deliver_text(update: Update, uid: int, st: dict, text: str) -> None:
+    """Редактирование товара: текст выдачи"""
+    data = st.setdefault("data", {})
+    
+    if text == "-":
+        pass
+    elif text.lower() == "clear":
+        data["deliver_text"] = ""
+    else:
+        error = validate_text_length(text, "текст выдачи", MAX_DELIVER_TEXT_LENGTH)
+        if error:
+            await update.message.reply_text(error)
+            return
+        data["deliver_text"] = text
+    
+    st["step"] = "deliver_url"
+    await update.message.reply_text(
+        f"<b>Шаг 7/8:</b> отправьте новую ссылку (deliver_url)\n"
+        f"🔗 <b>Текущая:</b> {html.escape(data.get('deliver_url', ''))}\n"
+        f"Для сохранения текущего значения отправьте <code>-</code>\n"
+        f"Для очистки отправьте <code>clear</code>\n\n"
+        f"<b>❕ Ограничения:</b>\n"
+        f"• Максимум {MAX_DELIVER_URL_LENGTH} символов\n"
+        "• Должна начинаться с http:// или https://\n\n"
+        f"❌ <b>Отмена:</b> отправьте 'отмена'",
+        parse_mode="HTML"
+    )
+
+
+@admin_text_step("edit_product", "deliver_url")
+async def _text_edit_deliver_url(update: Update, uid: int, st: dict, text: str) -> None:
+    """Редактирование товара: ссылка выдачи"""
+    data = st.setdefault("data", {})
+    original_id = st.get("original_id")
+    csrf_token = st.get("csrf_token") or generate_csrf_token(uid)
+    
+    if text == "-":
+        pass
+    elif text.lower() == "clear":
+        data["deliver_url"] = ""
+    else:
+        error = validate_text_length(text, "ссылка", MAX_DELIVER_URL_LENGTH)
+        if error:
+            await update.message.reply_text(error)
+            return
+            
+        if not text.startswith(("http://", "https://")):
             await update.message.reply_text(
-                f"✅ <b>Товар успешно обновлен!</b>\n\n"
-                f"🆔 <b>ID:</b> {data['id']}\n"
-                f"📦 <b>Название:</b> {data['title']}\n"
-                f"💰 <b>Цена:</b> {data['price_stars']}⭐ / {data.get('price_rub', data['price_stars'] * 10)}₽\n"
-                f"📝 <b>Описание:</b> {len(data['description'])} символов\n"
-                f"🎁 <b>Текст выдачи:</b> {'есть' if data.get('deliver_text') else 'нет'}\n"
-                f"🔗 <b>Ссылка:</b> {'есть' if data.get('deliver_url') else 'нет'}",
-                reply_markup=admin_menu_kb(csrf_token),
-                parse_mode="HTML",
+                "❌ Ссылка должна начинаться с http:// или https://"
             )
             return
+            
+        data["deliver_url"] = text
 
+    try:
+        new_id = str(data["id"])
+        # Одна строка в базе: при смене ID старая запись удаляется в той же транзакции
+        catalog.save_product(Product(
+            id=new_id,
+            title=str(data["title"]),
+            description=str(data["description"]),
+            price_stars=int(data["price_stars"]),
+            price_rub=int(data.get("price_rub", data["price_stars"] * 10)),
+            deliver_text=str(data.get("deliver_text", "")),
+            deliver_url=str(data.get("deliver_url", "")),
+            days=int(data.get("days") or 0),
+        ), original_id=original_id)
+        
+        logger.info(f"Товар отредактирован администратором user_id={uid}: {original_id} -> {new_id}")
+        
+    except Exception as e:
+        await update.message.reply_text(f"❌ Не удалось сохранить изменения: {e}")
+        ADMIN_STATE.pop(uid, None)
+        return
 
-# Функции для регистрации обработчиков
-def get_admin_handlers():
-    """Возвращает защищенные обработчики для админ-панели"""
-    return [
-        CommandHandler("admin", admin),
-        CallbackQueryHandler(on_admin_click, pattern=r"^admin:"),
-        CallbackQueryHandler(on_edit_select, pattern=r"^edit_select:"),
-        MessageHandler(filters.TEXT & ~filters.COMMAND, on_admin_text),
-    ]
\ No newline at end of file
+    ADMIN_STATE.pop(uid, None)
+    await update.message.reply_text(
+        f"✅ <b>Товар успешно обновлен!</b>\n\n"
+        f"🆔 <b>ID:</b> {data['id']}\n"
+        f"📦 <b>Название:</b> {data['title']}\n"
+        f"💰 <b>Цена:</b> {data['price_stars']}⭐ / {data.get('price_rub', data['price_stars'] * 10)}₽\n"
+        f"📝 <b>Описание:</b> {len(data['description'])} символов\n"
+        f"🎁 <b>Текст выдачи:</b> {'есть' if data.get('deliver_text') else 'нет'}\n"
+        f"🔗 <b>Ссылка:</b> {'есть' if data.get('deliver_url') else 'нет'}",
+        reply_markup=admin_menu_kb(csrf_token),
+        parse_mode="HTML",
+    )
@@ -0,0 +1,359 @@
+# admin_reports.py - Чтение данных для админ-панели из снимка
+#
+# Статистика, списки покупок и платежей строятся по отдельной базе
+# admin_snapshot.db, которая открывается только на чтение. Снимок собирается
+# в рабочей базе admin_snapshot.db.build: потоковый загрузчик migrate_json
+# перечитывает только изменившиеся JSON-файлы, из архива платежей ЮКассы
+# (payments_archive) добавляются новые сегменты, товары копируются из таблицы
+# products базы бота. Готовая рабочая база копируется в снимок.
+# У каждого магазина свой снимок в его каталоге данных.
+# Долгие аналитические запросы не держат блокировок на файлах, в которые
+# пишут add_purchase и обновление статусов платежей.
+import asyncio
+import csv
+import gzip
+import io
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import migrate_json
+import migrations
+import payments_archive
+import tenants
+from metrics import timed
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_PATH = "admin_snapshot.db"
+BUILD_PATH = "admin_snapshot.db.build"
+# Секции migrate_json, которые переносятся в снимок, и таблицы, которые
+# очищаются перед повторным чтением изменившегося файла. Платежи только
+# добавляются и обновляются (upsert), поэтому их таблица не очищается
+SNAPSHOT_SECTIONS = {
+    "db": ("purchases", "processed_payments"),
+    "yookassa": (),
+}
+PRODUCT_COLUMNS = "id, title, description, price_stars, deliver_text, deliver_url, price_rub, days"
+# Через сколько секунд снимок считается устаревшим, если исходные файлы менялись
+SNAPSHOT_TTL = int(os.getenv("ADMIN_SNAPSHOT_TTL", "60"))
+
+_refresh_lock = threading.Lock()
+
+
+def _sources() -> List[str]:
+    db_path = tenants.path(migrate_json.DB_PATH)
+    paths = [tenants.path(migrate_json.SECTIONS[section][0]) for section in SNAPSHOT_SECTIONS]
+    paths.append(os.path.join(payments_archive.archive_dir(), payments_archive.INDEX_FILE))
+    # Изменения товаров сначала попадают в WAL базы бота
+    return paths + [db_path, db_path + "-wal"]
+
+
+def snapshot_path() -> str:
+    """Снимок текущего магазина"""
+    return tenants.path(SNAPSHOT_PATH)
+
+
+def snapshot_age() -> Optional[float]:
+    """Возраст снимка в секундах (None, если снимка нет)"""
+    path = snapshot_path()
+    if not os.path.exists(path):
+        return None
+    return time.time() - os.path.getmtime(path)
+
+
+def is_stale(ttl: int = SNAPSHOT_TTL) -> bool:
+    path = snapshot_path()
+    if not os.path.exists(path):
+        return True
+    built_at = os.path.getmtime(path)
+    changed = any(os.path.exists(p) and os.path.getmtime(p) > built_at for p in _sources())
+    return changed and time.time() - built_at >= ttl
+
+
+@timed("admin_snapshot")
+def refresh_snapshot(force: bool = False) -> bool:
+    """Пересобирает снимок, если он устарел. Возвращает True, если снимок обновлён"""
+    if not force and not is_stale():
+        return False
+    with _refresh_lock:
+        if not force and not is_stale():
+            return False
+        started = time.perf_counter()
+        build = tenants.path(BUILD_PATH)
+        _update_build(build)
+
+        path = snapshot_path()
+        tmp = f"{path}.{os.getpid()}.tmp"
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        source = sqlite3.connect(build)
+        target = sqlite3.connect(tmp)
+        try:
+            source.backup(target)
+            # Снимок читается только на чтение: WAL ему не нужен
+            target.execute("PRAGMA journal_mode=DELETE")
+        finally:
+            target.close()
+            source.close()
+        os.replace(tmp, path)
+        logger.info(f"Снимок для админ-панели обновлён за {time.perf_counter() - started:.2f} с")
+        return True
+
+
+def _update_build(build: str) -> None:
+    """Переносит в рабочую базу изменившиеся JSON-файлы и текущие товары"""
+    migrations.migrate(build)
+    conn = sqlite3.connect(build, timeout=30)
+    try:
+        for section, tables in SNAPSHOT_SECTIONS.items():
+            path = tenants.path(migrate_json.SECTIONS[section][0])
+            if migrate_json.is_section_current(conn, section, path):
+                continue
+            if tables:
+                # Из файла могли удалить записи: секция читается заново
+                with conn:
+                    for table in tables:
+                        conn.execute(f"DELETE FROM {table}")
+            migrate_json.migrate_section(conn, section, path, restart=True)
+        _copy_archive(conn)
+        _copy_products(conn)
+    finally:
+        conn.close()
+
+
+def _copy_archive(conn: sqlite3.Connection) -> None:
+    """
+    Платежи из новых сегментов архива: без них выгрузки и итоги теряли бы
+    платежи, перенесённые из yookassa_payments.json. Сегменты неизменяемы,
+    поэтому каждый читается один раз
+    """
+    conn.execute("CREATE TABLE IF NOT EXISTS archive_segments (name TEXT PRIMARY KEY)")
+    loaded = {row[0] for row in conn.execute("SELECT name FROM archive_segments")}
+    for name in sorted(payments_archive.load_index()["segments"]):
+        if name in loaded:
+            continue
+        rows = [migrate_json.payment_row(p["payment_id"], p) for p in payments_archive.iter_segment(name)]
+        with conn:
+            conn.executemany(migrate_json.PAYMENT_SQL, rows)
+            conn.execute("INSERT INTO archive_segments (name) VALUES (?)", (name,))
+
+
+def _copy_products(conn: sqlite3.Connection) -> None:
+    """Товары из базы бота: products.json после перехода на SQLite устаревает"""
+    db_path = tenants.path(migrate_json.DB_PATH)
+    if not os.path.exists(db_path):
+        return
+    source = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, timeout=30)
+    try:
+        rows = source.execute(f"SELECT {PRODUCT_COLUMNS} FROM products").fetchall()
+    except sqlite3.OperationalError as e:
+        logger.warning(f"Товары для снимка не прочитаны: {e}")
+        return
+    finally:
+        source.close()
+    with conn:
+        conn.execute("DELETE FROM products")
+        conn.executemany(f"INSERT INTO products ({PRODUCT_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+
+def _connect() -> sqlite3.Connection:
+    path = snapshot_path()
+    if not os.path.exists(path):
+        refresh_snapshot(force=True)
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    conn.execute("PRAGMA query_only=1")
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def _query(sql: str, params: Tuple = ()) -> List[sqlite3.Row]:
+    conn = _connect()
+    try:
+        return conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+
+
+# ---------- ОТЧЁТЫ ----------
+@timed("admin_snapshot")
+def purchase_stats() -> Dict[str, Any]:
+    """Итоги по покупкам: количество, звёзды, рубли и разбивка по методам оплаты"""
+    total = _query("""
+        SELECT COUNT(*) AS orders, COALESCE(SUM(stars), 0) AS stars,
+               COALESCE(SUM(COALESCE(rub, stars * 10)), 0) AS rub
+        FROM purchases
+    """)[0]
+    methods = _query("""
+        SELECT COALESCE(payment_method, 'stars') AS method, COUNT(*) AS n
+        FROM purchases GROUP BY 1 ORDER BY MIN(id)
+    """)
+    return {
+        "orders": total["orders"],
+        "stars": total["stars"],
+        "rub": total["rub"],
+        "methods": [(row["method"], row["n"]) for row in methods],
+    }
+
+
+@timed("admin_snapshot")
+def last_purchases(limit: int = 20) -> Tuple[List[Tuple[str, Dict[str, Any]]], int]:
+    """Последние покупки в хронологическом порядке и общее число покупок"""
+    rows = _query("""
+        SELECT user_id, product_id, title, stars, rub, payment_method, yookassa_id, ts
+        FROM purchases ORDER BY ts DESC, id DESC LIMIT ?
+    """, (limit,))
+    total = _query("SELECT COUNT(*) FROM purchases")[0][0]
+    out = []
+    for row in reversed(rows):
+        item = {k: row[k] for k in row.keys() if k != "user_id" and row[k] is not None}
+        out.append((str(row["user_id"]), item))
+    return out, total
+
+
+@timed("admin_snapshot")
+def yookassa_summary() -> Dict[str, Any]:
+    row = _query("""
+        SELECT COUNT(*) AS total,
+               COALESCE(SUM(status = 'succeeded'), 0) AS succeeded,
+               COALESCE(SUM(status IN ('pending', 'waiting_for_capture')), 0) AS pending,
+               COALESCE(SUM(status = 'canceled'), 0) AS canceled,
+               COALESCE(SUM(CASE WHEN status = 'succeeded' THEN amount END), 0) AS amount
+        FROM payments
+    """)[0]
+    return dict(row)
+
+
+@timed("admin_snapshot")
+def recent_yookassa_payments(limit: int = 20) -> List[Dict[str, Any]]:
+    """Последние платежи ЮКассы вместе с названием товара"""
+    rows = _query("""
+        SELECT p.id AS payment_id, p.user_id, p.product_id, p.amount, p.status, p.created_at,
+               pr.title AS product_title
+        FROM payments p LEFT JOIN products pr ON pr.id = p.product_id
+        ORDER BY CAST(p.created_at AS INTEGER) DESC LIMIT ?
+    """, (limit,))
+    return [dict(row) for row in rows]
+
+
+# ---------- ЭКСПОРТ ----------
+EXPORT_FORMATS = ("csv", "jsonl")
+# Размер одной части выгрузки (лимит документа в Bot API — 50 МБ)
+EXPORT_CHUNK_BYTES = int(os.getenv("EXPORT_CHUNK_BYTES", str(45 * 1024 * 1024)))
+EXPORT_FETCH_SIZE = 1000
+
+EXPORT_QUERIES = {
+    "purchases": (
+        ["user_id", "product_id", "title", "stars", "rub", "payment_method", "yookassa_id", "ts"],
+        """
+        SELECT user_id, product_id, title, stars, rub, payment_method, yookassa_id, ts
+        FROM purchases WHERE ts >= ? AND ts < ? ORDER BY ts, id
+        """,
+    ),
+    "yookassa": (
+        ["payment_id", "user_id", "product_id", "amount", "status", "created_at", "description"],
+        """
+        SELECT id, user_id, product_id, amount, status, CAST(created_at AS INTEGER), description
+        FROM payments WHERE CAST(created_at AS INTEGER) >= ? AND CAST(created_at AS INTEGER) < ?
+        ORDER BY CAST(created_at AS INTEGER), id
+        """,
+    ),
+}
+
+
+def iter_export_rows(kind: str, since: int = 0, until: int = 2 ** 62) -> Iterator[Tuple]:
+    """Строки выгрузки по курсору, порциями fetchmany (память не зависит от объёма)"""
+    _, sql = EXPORT_QUERIES[kind]
+    conn = _connect()
+    try:
+        cursor = conn.execute(sql, (since, until))
+        while True:
+            rows = cursor.fetchmany(EXPORT_FETCH_SIZE)
+            if not rows:
+                break
+            for row in rows:
+                yield tuple(row)
+    finally:
+        conn.close()
+
+
+class _ChunkWriter:
+    """Пишет выгрузку в файлы-части, начиная новую часть при превышении размера"""
+
+    def __init__(self, out_dir: str, name: str, fmt: str, columns: List[str], chunk_bytes: int):
+        self.out_dir = out_dir
+        self.name = name
+        self.fmt = fmt
+        self.columns = columns
+        self.chunk_bytes = chunk_bytes
+        self.paths: List[str] = []
+        self._raw = None
+        self._stream = None
+        self._csv = None
+
+    def _open(self) -> None:
+        part = len(self.paths) + 1
+        ext = "csv" if self.fmt == "csv" else "jsonl.gz"
+        path = os.path.join(self.out_dir, f"{self.name}.part{part:03d}.{ext}")
+        self.paths.append(path)
+        self._raw = open(path, "wb")
+        if self.fmt == "csv":
+            self._stream = io.TextIOWrapper(self._raw, encoding="utf-8-sig", newline="")
+            self._csv = csv.writer(self._stream)
+            self._csv.writerow(self.columns)
+        else:
+            self._stream = io.TextIOWrapper(gzip.GzipFile(fileobj=self._raw, mode="wb"), encoding="utf-8")
+
+    def write(self, row: Tuple) -> None:
+        if self._stream is None:
+            self._open()
+        if self.fmt == "csv":
+            self._csv.writerow(row)
+        else:
+            self._stream.write(json.dumps(dict(zip(self.columns, row)), ensure_ascii=False) + "\n")
+        # Размер проверяется по сжатым данным на диске, поэтому часть может
+        # немного превысить лимит на величину буфера
+        if self._raw.tell() >= self.chunk_bytes:
+            self.close()
+
+    def close(self) -> None:
+        if self._stream is not None:
+            self._stream.close()
+            # GzipFile не закрывает переданный ему файл
+            if not self._raw.closed:
+                self._raw.close()
+            self._stream = None
+            self._csv = None
+
+
+@timed("admin_snapshot")
+def write_export(kind: str, fmt: str, out_dir: str, since: int = 0, until: int = 2 ** 62,
+                 chunk_bytes: int = EXPORT_CHUNK_BYTES) -> Tuple[List[str], int]:
+    """
+    Выгружает покупки ("purchases") или платежи ЮКассы ("yookassa") за период
+    [since, until) в CSV или gzip JSONL. Возвращает пути частей и число строк.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Неизвестный формат выгрузки: {fmt}")
+    columns, _ = EXPORT_QUERIES[kind]
+    writer = _ChunkWriter(out_dir, kind, fmt, columns, chunk_bytes)
+    count = 0
+    try:
+        for row in iter_export_rows(kind, since, until):
+            writer.write(row)
+            count += 1
+    finally:
+        writer.close()
+    return writer.paths, count
+
+
+async def snapshot_job(context) -> None:
+    """Задача JobQueue: обновление снимка в отдельном потоке"""
+    try:
+        await asyncio.to_thread(refresh_snapshot)
+    except Exception as e:
+        logger.error(f"Ошибка обновления снимка админ-панели: {e}", exc_info=True)
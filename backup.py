@@ -0,0 +1,206 @@
+# backup.py - Резервные копии данных бота
+#
+# Снимок базы делается через онлайн backup API SQLite небольшими порциями
+# страниц с паузами, поэтому запросы бота между шагами не блокируются.
+# В снимок также входят JSON-хранилища. Снимки сжимаются в
+# backups/snapshot-YYYYmmdd-HHMMSS.tar.gz, старые удаляются по BACKUP_KEEP.
+# Пути по умолчанию — файлы и каталог бэкапов текущего магазина (tenants.py).
+#
+# Запуск:
+#   python backup.py create
+#   python backup.py list
+#   python backup.py restore backups/snapshot-20250101-000000.tar.gz
+import argparse
+import asyncio
+import logging
+import os
+import shutil
+import sqlite3
+import tarfile
+import tempfile
+import time
+from datetime import datetime
+from typing import List, Optional, Sequence
+
+import tenants
+from metrics import timed
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = "bot_database.db"
+JSON_FILES = ("db.json", "products.json", "yookassa_payments.json")
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "14"))
+# Интервал фонового бэкапа в часах (0 — отключить)
+BACKUP_INTERVAL_HOURS = float(os.getenv("BACKUP_INTERVAL_HOURS", "6"))
+# Сколько страниц копировать за шаг и пауза между шагами
+BACKUP_PAGES_PER_STEP = int(os.getenv("BACKUP_PAGES_PER_STEP", "64"))
+BACKUP_STEP_SLEEP = float(os.getenv("BACKUP_STEP_SLEEP", "0.005"))
+
+SNAPSHOT_PREFIX = "snapshot-"
+SNAPSHOT_SUFFIX = ".tar.gz"
+
+
+def default_backup_dir() -> str:
+    tenant = tenants.current()
+    if os.path.isabs(BACKUP_DIR) and tenant.data_dir:
+        # Общий абсолютный BACKUP_DIR: у каждого магазина свой подкаталог
+        return os.path.join(BACKUP_DIR, tenant.name)
+    return tenant.path(BACKUP_DIR)
+
+
+def default_json_files() -> List[str]:
+    return [tenants.path(name) for name in JSON_FILES]
+
+
+def copy_database(src_path: str, dst_path: str, pages: int = BACKUP_PAGES_PER_STEP,
+                  sleep: float = BACKUP_STEP_SLEEP) -> None:
+    """Копирует базу SQLite онлайн, порциями по pages страниц"""
+    src = sqlite3.connect(src_path)
+    dst = sqlite3.connect(dst_path)
+    try:
+        src.backup(dst, pages=pages, sleep=sleep)
+    finally:
+        dst.close()
+        src.close()
+
+
+@timed("backup")
+def create_backup(db_path: Optional[str] = None, backup_dir: Optional[str] = None, keep: int = BACKUP_KEEP,
+                  json_files: Optional[Sequence[str]] = None, pages: int = BACKUP_PAGES_PER_STEP,
+                  sleep: float = BACKUP_STEP_SLEEP, label: str = "") -> str:
+    """Создаёт сжатый снимок базы и JSON-хранилищ. Возвращает путь к снимку"""
+    db_path = db_path or tenants.path(DB_PATH)
+    backup_dir = backup_dir or default_backup_dir()
+    json_files = default_json_files() if json_files is None else json_files
+    os.makedirs(backup_dir, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    name = f"{SNAPSHOT_PREFIX}{stamp}{'-' + label if label else ''}"
+    path = os.path.join(backup_dir, name + SNAPSHOT_SUFFIX)
+    n = 1
+    while os.path.exists(path):
+        path = os.path.join(backup_dir, f"{name}.{n}{SNAPSHOT_SUFFIX}")
+        n += 1
+
+    started = time.perf_counter()
+    workdir = tempfile.mkdtemp(prefix="backup_", dir=backup_dir)
+    try:
+        if os.path.exists(db_path):
+            copy_database(db_path, os.path.join(workdir, os.path.basename(db_path)), pages, sleep)
+        for json_file in json_files:
+            if os.path.exists(json_file):
+                shutil.copy2(json_file, os.path.join(workdir, os.path.basename(json_file)))
+
+        tmp = path + ".tmp"
+        with tarfile.open(tmp, "w:gz") as tar:
+            for entry in sorted(os.listdir(workdir)):
+                tar.add(os.path.join(workdir, entry), arcname=entry)
+        os.replace(tmp, path)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    removed = apply_retention(backup_dir, keep)
+    logger.info(
+        f"💾 Резервная копия {path} создана за {time.perf_counter() - started:.2f} с"
+        f"{f', удалено старых: {removed}' if removed else ''}"
+    )
+    return path
+
+
+def list_backups(backup_dir: Optional[str] = None) -> List[str]:
+    """Снимки от старых к новым"""
+    backup_dir = backup_dir or default_backup_dir()
+    if not os.path.isdir(backup_dir):
+        return []
+    names = [n for n in os.listdir(backup_dir) if n.startswith(SNAPSHOT_PREFIX) and n.endswith(SNAPSHOT_SUFFIX)]
+    paths = [os.path.join(backup_dir, n) for n in names]
+    return sorted(paths, key=lambda p: (os.path.getmtime(p), p))
+
+
+def apply_retention(backup_dir: Optional[str] = None, keep: int = BACKUP_KEEP) -> int:
+    if keep <= 0:
+        return 0
+    removed = 0
+    for old in list_backups(backup_dir)[:-keep]:
+        try:
+            os.remove(old)
+            removed += 1
+        except OSError as e:
+            logger.warning(f"Не удалось удалить старую копию {old}: {e}")
+    return removed
+
+
+def restore_backup(snapshot: str, db_path: Optional[str] = None, json_files: Optional[Sequence[str]] = None,
+                   safety_backup: bool = True) -> List[str]:
+    """
+    Восстанавливает данные из снимка. Перед восстановлением делается
+    страховочный снимок текущего состояния. Возвращает список восстановленных файлов.
+
+    База восстанавливается через backup API в существующий файл, поэтому
+    открытые соединения видят новые данные, а не удалённый файл.
+    """
+    if not os.path.exists(snapshot):
+        raise FileNotFoundError(snapshot)
+    db_path = db_path or tenants.path(DB_PATH)
+    json_files = default_json_files() if json_files is None else json_files
+    if safety_backup:
+        create_backup(db_path, json_files=json_files, label="before-restore")
+
+    restored = []
+    workdir = tempfile.mkdtemp(prefix="restore_")
+    try:
+        with tarfile.open(snapshot, "r:gz") as tar:
+            members = [m for m in tar.getmembers() if m.isfile() and os.path.basename(m.name) == m.name]
+            tar.extractall(workdir, members=members)
+
+        db_copy = os.path.join(workdir, os.path.basename(db_path))
+        if os.path.exists(db_copy):
+            copy_database(db_copy, db_path, pages=-1, sleep=0)
+            restored.append(db_path)
+
+        for json_file in json_files:
+            src = os.path.join(workdir, os.path.basename(json_file))
+            if os.path.exists(src):
+                tmp = json_file + ".restore.tmp"
+                shutil.copy2(src, tmp)
+                os.replace(tmp, json_file)
+                restored.append(json_file)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    logger.warning(f"Данные восстановлены из {snapshot}: {', '.join(restored)}")
+    return restored
+
+
+async def backup_job(context) -> None:
+    """Задача JobQueue: бэкап в отдельном потоке, чтобы не занимать цикл событий"""
+    try:
+        await asyncio.to_thread(create_backup)
+    except Exception as e:
+        logger.error(f"Ошибка планового бэкапа: {e}", exc_info=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Резервные копии данных бота")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("create", help="создать снимок")
+    sub.add_parser("list", help="показать снимки")
+    restore = sub.add_parser("restore", help="восстановить из снимка (бота лучше остановить)")
+    restore.add_argument("snapshot", help="путь к snapshot-*.tar.gz")
+    restore.add_argument("--no-safety-backup", action="store_true", help="не делать страховочный снимок")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    if args.command == "create":
+        print(f"[SUCCESS] {create_backup()}")
+    elif args.command == "list":
+        for path in list_backups():
+            size_mb = os.path.getsize(path) / (1024 * 1024)
+            print(f"{path}  {size_mb:.2f} МБ  {datetime.fromtimestamp(os.path.getmtime(path)):%d.%m.%Y %H:%M}")
+    elif args.command == "restore":
+        restored = restore_backup(args.snapshot, safety_backup=not args.no_safety_backup)
+        print(f"[SUCCESS] Восстановлено: {', '.join(restored) or 'ничего'}")
+
+
+if __name__ == "__main__":
+    main()
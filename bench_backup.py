@@ -0,0 +1,98 @@
+# bench_backup.py - Влияние онлайн-бэкапа на задержку запросов к базе
+#
+# В фоновом потоке создаётся снимок синтетической базы, а в основном потоке
+# идут типичные запросы бота (get_user, check_subscription, add_user).
+# Сравниваются задержки без бэкапа и во время бэкапа.
+#
+# Запуск: python bench_backup.py --users 200000 --pages 64 --sleep 0.005
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from typing import Dict, List
+
+from bench_handlers import percentile
+from bench_storage import generate_sqlite, prepare_environment
+
+
+def probe(adapter, users: int, stop: threading.Event, min_ops: int = 0) -> List[float]:
+    """Выполняет запросы, пока не выставлен stop, и возвращает задержки"""
+    rnd = random.Random(7)
+    latencies: List[float] = []
+    while not stop.is_set() or len(latencies) < min_ops:
+        uid = 1_000_000 + rnd.randrange(users)
+        start = time.perf_counter()
+        op = len(latencies) % 10
+        if op == 0:
+            adapter.add_user(1_000_000 + users + rnd.randrange(users), "u", "U")
+        elif op < 5:
+            adapter.get_user(uid)
+        else:
+            adapter.check_subscription(uid)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def summary(latencies: List[float]) -> Dict[str, float]:
+    return {
+        "n": len(latencies),
+        "p50": percentile(latencies, 0.5) * 1000,
+        "p95": percentile(latencies, 0.95) * 1000,
+        "p99": percentile(latencies, 0.99) * 1000,
+        "max": max(latencies, default=0) * 1000,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Задержка запросов во время онлайн-бэкапа")
+    parser.add_argument("--users", type=int, default=200_000, help="размер синтетической базы")
+    parser.add_argument("--pages", type=int, default=64, help="страниц за шаг backup API")
+    parser.add_argument("--sleep", type=float, default=0.005, help="пауза между шагами, секунды")
+    parser.add_argument("--baseline-seconds", type=float, default=2.0, help="длительность замера без бэкапа")
+    args = parser.parse_args()
+
+    prepare_environment()
+    import backup
+    from database_adapter import DatabaseAdapter
+
+    workdir = tempfile.mkdtemp(prefix="bench_backup_")
+    try:
+        db_path = os.path.join(workdir, "bot_database.db")
+        generate_sqlite(db_path, args.users)
+        adapter = DatabaseAdapter(db_path)
+
+        stop = threading.Event()
+        timer = threading.Timer(args.baseline_seconds, stop.set)
+        timer.start()
+        baseline = probe(adapter, args.users, stop)
+
+        stop = threading.Event()
+        result: Dict[str, float] = {}
+
+        def run_backup() -> None:
+            started = time.perf_counter()
+            backup.create_backup(db_path, os.path.join(workdir, "backups"), keep=1, json_files=(),
+                                 pages=args.pages, sleep=args.sleep)
+            result["seconds"] = time.perf_counter() - started
+            stop.set()
+
+        thread = threading.Thread(target=run_backup)
+        thread.start()
+        during = probe(adapter, args.users, stop, min_ops=100)
+        thread.join()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"База: {args.users} пользователей, шаг {args.pages} страниц, пауза {args.sleep * 1000:.1f} мс")
+    print(f"Бэкап занял {result['seconds']:.2f} с")
+    print(f"{'режим':<16}{'n':>8}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}{'max, мс':>10}")
+    for name, values in (("без бэкапа", baseline), ("во время бэкапа", during)):
+        s = summary(values)
+        print(f"{name:<16}{s['n']:>8}{s['p50']:>10.3f}{s['p95']:>10.3f}{s['p99']:>10.3f}{s['max']:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
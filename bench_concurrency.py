@@ -0,0 +1,138 @@
+# bench_concurrency.py - Пропускная способность при параллельной обработке обновлений
+#
+# Обновления подаются в app.update_queue (как при polling) и проходят через
+# PerUserUpdateProcessor с разным пределом параллельности. Bot API подменяется
+# заглушкой с задержкой --api-latency, сеть не используется, данные копируются
+# во временную папку. Для каждого пользователя проверяется, что его обновления
+# завершились в порядке поступления.
+#
+# Запуск: python bench_concurrency.py --levels 1 8 64 --users 64 --api-latency 0.02
+import argparse
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+import warnings
+from collections import defaultdict
+from typing import Dict, List
+
+from bench_handlers import BENCH_TOKEN, UpdateFactory, make_stub_request, percentile, prepare_environment
+
+
+async def run_level(level: int, users: int, product_id: str, api_latency: float) -> dict:
+    from telegram import Update
+    from telegram.ext import Application, TypeHandler
+    import bot as bot_module
+    from catalog import get_product
+    from payments import create_stars_invoice_payload
+
+    builder = (
+        Application.builder().token(BENCH_TOKEN).job_queue(None)
+        .request(make_stub_request(api_latency)).get_updates_request(make_stub_request(0))
+    )
+    app = bot_module.build_application(builder, rate_limiter=False, concurrent_updates=level)
+
+    product = get_product(product_id)
+    if not product:
+        raise SystemExit(f"Товар {product_id} не найден в каталоге")
+
+    errors: Dict[str, int] = defaultdict(int)
+    put_at: Dict[int, float] = {}
+    latencies: List[float] = []
+    finished: Dict[int, List[int]] = defaultdict(list)
+    total = 0
+    all_done = asyncio.Event()
+
+    async def count_errors(update, context):
+        errors[type(context.error).__name__] += 1
+
+    async def record(update: Update, context) -> None:
+        latencies.append(time.perf_counter() - put_at[update.update_id])
+        finished[update.effective_user.id].append(update.update_id)
+        if len(latencies) == total:
+            all_done.set()
+
+    app.add_error_handler(count_errors)
+    # Последняя группа: отмечает завершение обработки обновления
+    app.add_handler(TypeHandler(Update, record), group=1000)
+
+    await app.initialize()
+    factory = UpdateFactory(app.bot)
+    uids = [20_000_000 + i for i in range(users)]
+    flows = {}
+    for uid in uids:
+        _, payload = create_stars_invoice_payload(uid, product)
+        flows[uid] = [
+            factory.command(uid, "start"),
+            factory.callback(uid, "menu:catalog"),
+            factory.callback(uid, f"prod:{product_id}"),
+            factory.callback(uid, f"choose_pay:{product_id}"),
+            factory.callback(uid, f"pay_stars:{product_id}"),
+            # Двойное нажатие и оплата сразу следом за кликом
+            factory.callback(uid, f"pay_stars:{product_id}"),
+            factory.successful_payment(uid, int(product.price_stars), payload),
+        ]
+    total = sum(len(f) for f in flows.values())
+
+    await app.start()
+    started = time.perf_counter()
+    # Пользователи действуют одновременно: шаги разных пользователей перемешаны
+    for step in range(len(flows[uids[0]])):
+        for uid in uids:
+            update = flows[uid][step]
+            put_at[update.update_id] = time.perf_counter()
+            await app.update_queue.put(update)
+    await all_done.wait()
+    elapsed = time.perf_counter() - started
+    await app.stop()
+    await app.shutdown()
+
+    out_of_order = sum(1 for ids in finished.values() if ids != sorted(ids))
+    return {
+        "level": level,
+        "updates": total,
+        "elapsed": elapsed,
+        "p50": percentile(latencies, 0.5) * 1000,
+        "p95": percentile(latencies, 0.95) * 1000,
+        "out_of_order": out_of_order,
+        "errors": dict(errors),
+    }
+
+
+async def run_all(levels: List[int], users: int, product_id: str, api_latency: float) -> List[dict]:
+    return [await run_level(level, users, product_id, api_latency) for level in levels]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Пропускная способность при параллельной обработке обновлений")
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 8, 64], help="пределы параллельности")
+    parser.add_argument("--users", type=int, default=64, help="сколько пользователей проходят сценарий")
+    parser.add_argument("--product", default="p1", help="ID товара для сценария")
+    parser.add_argument("--api-latency", type=float, default=0.02, help="имитация задержки Bot API, секунды")
+    args = parser.parse_args()
+
+    # Периодические задачи бота в замере не нужны
+    warnings.filterwarnings("ignore", message="No `JobQueue` set up")
+    workdir = tempfile.mkdtemp(prefix="bench_concurrency_")
+    cwd = os.getcwd()
+    try:
+        prepare_environment(workdir)
+        results = asyncio.run(run_all(args.levels, args.users, args.product, args.api_latency))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"Пользователей: {args.users}, задержка Bot API: {args.api_latency * 1000:.0f} мс")
+    print(f"{'параллельно':>12}{'обновлений':>12}{'время, с':>10}{'обн/с':>10}{'p50, мс':>10}{'p95, мс':>10}"
+          f"{'порядок':>10}")
+    for r in results:
+        order = "ok" if not r["out_of_order"] else f"нарушен у {r['out_of_order']}"
+        print(f"{r['level']:>12}{r['updates']:>12}{r['elapsed']:>10.2f}{r['updates'] / r['elapsed']:>10.1f}"
+              f"{r['p50']:>10.1f}{r['p95']:>10.1f}{order:>10}")
+        if r["errors"]:
+            print("    ошибки: " + ", ".join(f"{k}={v}" for k, v in r["errors"].items()))
+
+
+if __name__ == "__main__":
+    main()
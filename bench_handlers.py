@@ -0,0 +1,260 @@
+# bench_handlers.py - Офлайн нагрузочный тест обработчиков бота
+#
+# Прогоняет синтетические Update через настоящие обработчики из bot.py
+# (start → каталог → товар → выбор оплаты → оплата Stars → successful_payment).
+# Bot API подменяется заглушкой, сеть не используется. Все файлы данных
+# копируются во временную папку, рабочие данные не изменяются.
+#
+# Запуск: python bench_handlers.py --users 500 --concurrency 50
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+BENCH_TOKEN = "123456:BENCHMARK-TOKEN"
+BENCH_BOT_ID = 123456
+DATA_FILES = ("products.json", "db.json", "yookassa_payments.json", "bot_database.db")
+FLOW = ("start", "catalog", "product", "choose_pay", "pay_stars", "successful_payment")
+
+
+def prepare_environment(workdir: str) -> None:
+    """Готовит окружение: копия данных и переменные, которые не должен перезаписать .env"""
+    src = os.path.dirname(os.path.abspath(__file__))
+    for name in DATA_FILES:
+        path = os.path.join(src, name)
+        if os.path.exists(path):
+            shutil.copy(path, os.path.join(workdir, name))
+    os.environ["BOT_TOKEN"] = BENCH_TOKEN
+    os.environ["YOOKASSA_SHOP_ID"] = ""
+    os.environ["YOOKASSA_SECRET_KEY"] = ""
+    os.environ["STARS_PAYLOAD_SECRET"] = "benchmark-secret"
+    os.environ["METRICS_PORT"] = "0"
+    os.chdir(workdir)
+    if src not in sys.path:
+        sys.path.insert(0, src)
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def make_stub_request(api_latency: float):
+    """Создаёт заглушку Bot API, которая отвечает как Telegram, но без сети"""
+    from telegram.request import BaseRequest
+
+    class StubRequest(BaseRequest):
+        def __init__(self):
+            self.calls: Dict[str, int] = defaultdict(int)
+            self._message_ids = itertools.count(1000)
+
+        @property
+        def read_timeout(self) -> Optional[float]:
+            return None
+
+        async def initialize(self) -> None:
+            pass
+
+        async def shutdown(self) -> None:
+            pass
+
+        def _message(self, params) -> dict:
+            chat_id = int(params.get("chat_id") or 1)
+            return {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": {"id": BENCH_BOT_ID, "is_bot": True, "first_name": "Bench"},
+                "text": str(params.get("text") or params.get("caption") or ""),
+            }
+
+        async def do_request(self, url, method, request_data=None, read_timeout=None,
+                             write_timeout=None, connect_timeout=None, pool_timeout=None) -> Tuple[int, bytes]:
+            endpoint = url.rsplit("/", 1)[-1]
+            self.calls[endpoint] += 1
+            params = request_data.parameters if request_data else {}
+            if api_latency:
+                await asyncio.sleep(api_latency)
+
+            if endpoint == "getMe":
+                result = {"id": BENCH_BOT_ID, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+            elif endpoint.startswith("send") or endpoint.startswith("edit"):
+                result = self._message(params)
+            else:
+                result = True
+            return 200, json.dumps({"ok": True, "result": result}).encode("utf-8")
+
+    return StubRequest()
+
+
+class UpdateFactory:
+    """Строит синтетические обновления Telegram"""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._update_ids = itertools.count(1)
+        self._ids = itertools.count(1)
+
+    def _user(self, uid: int) -> dict:
+        return {"id": uid, "is_bot": False, "first_name": f"User{uid}", "username": f"user{uid}"}
+
+    def _message(self, uid: int, **extra) -> dict:
+        message = {
+            "message_id": next(self._ids),
+            "date": int(time.time()),
+            "chat": {"id": uid, "type": "private"},
+            "from": self._user(uid),
+        }
+        message.update(extra)
+        return message
+
+    def command(self, uid: int, command: str):
+        from telegram import Update
+        text = f"/{command}"
+        message = self._message(uid, text=text, entities=[{"type": "bot_command", "offset": 0, "length": len(text)}])
+        return Update.de_json({"update_id": next(self._update_ids), "message": message}, self.bot)
+
+    def callback(self, uid: int, data: str):
+        from telegram import Update
+        bot_message = self._message(uid, text="…")
+        bot_message["from"] = {"id": BENCH_BOT_ID, "is_bot": True, "first_name": "Bench"}
+        query = {
+            "id": str(next(self._ids)),
+            "from": self._user(uid),
+            "chat_instance": str(uid),
+            "data": data,
+            "message": bot_message,
+        }
+        return Update.de_json({"update_id": next(self._update_ids), "callback_query": query}, self.bot)
+
+    def successful_payment(self, uid: int, amount: int, payload: str):
+        from telegram import Update
+        payment = {
+            "currency": "XTR",
+            "total_amount": amount,
+            "invoice_payload": payload,
+            "telegram_payment_charge_id": f"bench-charge-{uid}-{next(self._ids)}",
+            "provider_payment_charge_id": f"bench-provider-{uid}",
+        }
+        message = self._message(uid, successful_payment=payment)
+        return Update.de_json({"update_id": next(self._update_ids), "message": message}, self.bot)
+
+
+async def run_benchmark(users: int, concurrency: int, product_id: str, api_latency: float,
+                        rate_limiter: bool) -> dict:
+    from telegram.ext import Application
+    import bot as bot_module
+    from catalog import get_product
+    from payments import create_stars_invoice_payload
+
+    request = make_stub_request(api_latency)
+    builder = Application.builder().token(BENCH_TOKEN).request(request).get_updates_request(make_stub_request(0))
+    app = bot_module.build_application(builder, rate_limiter=rate_limiter)
+
+    errors: Dict[str, int] = defaultdict(int)
+
+    async def count_errors(update, context):
+        errors[type(context.error).__name__] += 1
+
+    app.add_error_handler(count_errors)
+
+    product = get_product(product_id)
+    if not product:
+        raise SystemExit(f"Товар {product_id} не найден в каталоге")
+
+    await app.initialize()
+    factory = UpdateFactory(app.bot)
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def step(name: str, update) -> None:
+        start = time.perf_counter()
+        await app.process_update(update)
+        latencies[name].append(time.perf_counter() - start)
+
+    async def user_flow(uid: int) -> None:
+        async with semaphore:
+            await step("start", factory.command(uid, "start"))
+            await step("catalog", factory.callback(uid, "menu:catalog"))
+            await step("product", factory.callback(uid, f"prod:{product_id}"))
+            await step("choose_pay", factory.callback(uid, f"choose_pay:{product_id}"))
+            await step("pay_stars", factory.callback(uid, f"pay_stars:{product_id}"))
+            _, payload = create_stars_invoice_payload(uid, product)
+            await step("successful_payment", factory.successful_payment(uid, int(product.price_stars), payload))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user_flow(10_000_000 + i) for i in range(users)))
+    elapsed = time.perf_counter() - started
+    await app.shutdown()
+
+    return {
+        "users": users,
+        "concurrency": concurrency,
+        "elapsed": elapsed,
+        "updates": sum(len(v) for v in latencies.values()),
+        "latencies": latencies,
+        "errors": dict(errors),
+        "api_calls": dict(request.calls),
+    }
+
+
+def print_report(result: dict) -> None:
+    updates = result["updates"]
+    elapsed = result["elapsed"]
+    print("=" * 72)
+    print(f"Пользователей: {result['users']}, параллельно: {result['concurrency']}")
+    print(f"Обновлений: {updates} за {elapsed:.2f} с → {updates / elapsed:.1f} обновлений/с")
+    print("=" * 72)
+    print(f"{'шаг':<20}{'n':>7}{'p50, мс':>11}{'p95, мс':>11}{'p99, мс':>11}{'max, мс':>11}")
+    for name in FLOW:
+        values = result["latencies"].get(name, [])
+        print(
+            f"{name:<20}{len(values):>7}"
+            f"{percentile(values, 0.5) * 1000:>11.2f}{percentile(values, 0.95) * 1000:>11.2f}"
+            f"{percentile(values, 0.99) * 1000:>11.2f}{max(values, default=0) * 1000:>11.2f}"
+        )
+    print("-" * 72)
+    print("Вызовы Bot API: " + ", ".join(f"{k}={v}" for k, v in sorted(result["api_calls"].items())))
+    if result["errors"]:
+        print("Ошибки в обработчиках: " + ", ".join(f"{k}={v}" for k, v in result["errors"].items()))
+    else:
+        print("Ошибок в обработчиках нет")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Офлайн нагрузочный тест обработчиков бота")
+    parser.add_argument("--users", type=int, default=200, help="сколько пользователей проходят сценарий")
+    parser.add_argument("--concurrency", type=int, default=20, help="сколько пользователей одновременно")
+    parser.add_argument("--product", default="p1", help="ID товара для сценария")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="имитация задержки Bot API, секунды")
+    parser.add_argument("--no-rate-limiter", action="store_true", help="отключить очередь с флуд-контролем")
+    parser.add_argument("--keep-workdir", action="store_true", help="не удалять временную папку с данными")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_handlers_")
+    cwd = os.getcwd()
+    try:
+        prepare_environment(workdir)
+        result = asyncio.run(run_benchmark(
+            args.users, args.concurrency, args.product, args.api_latency, not args.no_rate_limiter
+        ))
+        print_report(result)
+    finally:
+        os.chdir(cwd)
+        if args.keep_workdir:
+            print(f"Данные прогона: {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
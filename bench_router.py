@@ -0,0 +1,99 @@
+# bench_router.py - Стоимость выбора обработчика callback-кнопки
+#
+# Сравнивает прежнюю схему (цепочка CallbackQueryHandler с регулярными
+# выражениями, затем лестница "if action == ...") с таблицей router.py
+# (один разбор callback_data и поиск в словаре) при росте числа действий.
+# Обработчики не вызываются, измеряется только выбор. Сеть не используется.
+#
+# Запуск: python bench_router.py --sizes 10 50 200 1000 --lookups 20000
+import argparse
+import random
+import time
+from typing import Callable, List
+
+from telegram import CallbackQuery, Update, User
+from telegram.ext import CallbackQueryHandler
+
+from router import CallbackRouter, parse_callback
+
+
+async def _noop(update, context) -> None:
+    pass
+
+
+def make_update(data: str) -> Update:
+    user = User(id=1, first_name="bench", is_bot=False)
+    return Update(update_id=1, callback_query=CallbackQuery(id="1", from_user=user, chat_instance="bench", data=data))
+
+
+def make_ladder(actions: List[str]) -> Callable[[str], int]:
+    """Функция вида "if action == 'a0': ... elif ..." на len(actions) веток"""
+    lines = ["def ladder(action):"]
+    for i, action in enumerate(actions):
+        lines.append(f"    if action == {action!r}:")
+        lines.append(f"        return {i}")
+    lines.append("    return -1")
+    namespace: dict = {}
+    exec("\n".join(lines), namespace)
+    return namespace["ladder"]
+
+
+def per_call_us(func: Callable[[object], object], items: list) -> float:
+    started = time.perf_counter()
+    for item in items:
+        func(item)
+    return (time.perf_counter() - started) / len(items) * 1e6
+
+
+def bench(size: int, lookups: int) -> dict:
+    rnd = random.Random(size)
+    namespaces = [f"ns{i}" for i in range(size)]
+    actions = [f"act{i}" for i in range(size)]
+
+    # Прежняя схема: N CallbackQueryHandler с pattern "^nsI:", проверяемых по порядку
+    chain = [CallbackQueryHandler(_noop, pattern=rf"^{ns}:") for ns in namespaces]
+    ladder = make_ladder(actions)
+
+    router = CallbackRouter()
+    for ns in namespaces:
+        router.add(ns, _noop)
+    for action in actions:
+        router.add("menu", _noop, action=action)
+    router_handler = router.handler()
+
+    ns_updates = [make_update(f"{rnd.choice(namespaces)}:p1") for _ in range(lookups)]
+    menu_data = [f"menu:{rnd.choice(actions)}" for _ in range(lookups)]
+
+    def chain_select(update):
+        for handler in chain:
+            if handler.check_update(update):
+                return handler
+        return None
+
+    def router_select(update):
+        return router_handler.check_update(update) and router.resolve(update.callback_query.data)
+
+    return {
+        "size": size,
+        "chain": per_call_us(chain_select, ns_updates),
+        "router": per_call_us(router_select, ns_updates),
+        "ladder": per_call_us(lambda data: ladder(parse_callback(data).action), menu_data),
+        "table": per_call_us(router.resolve, menu_data),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Стоимость маршрутизации callback-кнопок")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 50, 200, 1000], help="число действий")
+    parser.add_argument("--lookups", type=int, default=20_000, help="выборов на каждый размер")
+    args = parser.parse_args()
+
+    print("Время выбора обработчика, мкс на обновление")
+    print(f"{'действий':>9}{'regex-цепочка':>15}{'router':>10}{'if-лестница':>13}{'таблица':>10}")
+    for size in args.sizes:
+        r = bench(size, args.lookups)
+        print(f"{r['size']:>9}{r['chain']:>15.2f}{r['router']:>10.2f}{r['ladder']:>13.2f}{r['table']:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
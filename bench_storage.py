@@ -0,0 +1,286 @@
+# bench_storage.py - Микробенчмарки слоя хранения на разных объёмах данных
+#
+# Измеряет load_db, add_purchase, mark_payment_processed, load_yookassa_payments,
+# save_yookassa_payments и методы DatabaseAdapter на 1k, 100k и 1M записей.
+# Данные генерируются синтетически во временной папке.
+#
+# load_db не читает db.json больше data_tools.MAX_DB_FILE_BYTES (50 МБ), а
+# load_yookassa_payments — файл платежей больше payments.MAX_PAYMENTS_FILE_BYTES
+# (10 МБ): они возвращают пустые данные. Такие объёмы (100k платежей, 1M
+# покупок) не измеряются, а пропускаются с пояснением. Для остальных
+# проверяется, что загружено ровно size записей.
+#
+# save_yookassa_payments при числе платежей больше HOT_LIMIT переносит
+# завершённые платежи в архив: архив бенчмарка лежит во временной папке,
+# а каждый повтор получает свою копию словаря платежей.
+#
+# Запуск:
+#   python bench_storage.py                          # 1k и 100k
+#   python bench_storage.py --sizes 1000,100000,1000000
+#   python bench_storage.py --save-baseline          # сохранить эталон
+#   python bench_storage.py --check                  # сравнить с эталоном (код выхода 1 при регрессии)
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+DEFAULT_SIZES = (1_000, 100_000)
+BASELINE_FILE = "bench_storage_baseline.json"
+# Допустимое замедление относительно эталона (0.25 = на 25% медленнее)
+DEFAULT_TOLERANCE = 0.25
+
+
+def prepare_environment() -> None:
+    """Переменные окружения, без которых модули хранилища не импортируются"""
+    os.environ.setdefault("BOT_TOKEN", "123456:BENCHMARK-TOKEN")
+    os.environ["YOOKASSA_SHOP_ID"] = ""
+    os.environ["YOOKASSA_SECRET_KEY"] = ""
+    os.environ.setdefault("STARS_PAYLOAD_SECRET", "benchmark-secret")
+    # Предупреждения хранилища (например, о размере файлов) не нужны в отчёте
+    logging.basicConfig(level=logging.ERROR)
+    src = os.path.dirname(os.path.abspath(__file__))
+    if src not in sys.path:
+        sys.path.insert(0, src)
+
+
+# ---------- ГЕНЕРАТОРЫ ДАННЫХ ----------
+def generate_db(size: int, users: int) -> dict:
+    """db.json с size покупками, распределёнными по users пользователям"""
+    rnd = random.Random(size)
+    purchases: Dict[str, list] = {}
+    base_ts = 1_700_000_000
+    for i in range(size):
+        uid = str(1_000_000 + rnd.randrange(users))
+        purchases.setdefault(uid, []).append({
+            "product_id": f"p{rnd.randrange(1, 7)}",
+            "title": f"Товар #{i % 7}",
+            "stars": 50,
+            "rub": 500,
+            "payment_method": "stars" if i % 3 else "yookassa",
+            "ts": base_ts + i,
+        })
+    return {"payments_processed": [f"charge_{i}" for i in range(size)], "purchases": purchases}
+
+
+def generate_yookassa_payments(size: int) -> dict:
+    rnd = random.Random(size + 1)
+    statuses = ("succeeded", "canceled", "pending")
+    payments = {}
+    for i in range(size):
+        pid = f"yookassa_{i:016x}"
+        payments[pid] = {
+            "payment_id": pid,
+            "user_id": 1_000_000 + rnd.randrange(size // 10 + 1),
+            "product_id": f"p{rnd.randrange(1, 7)}",
+            "amount": 500,
+            "status": statuses[i % 3],
+            "created_at": 1_700_000_000 + i,
+            "payment_url": f"https://yoomoney.ru/checkout/payments/v2/contract?orderId={pid}",
+            "message_id": i,
+            "description": "Покупка товара",
+        }
+    return payments
+
+
+def generate_sqlite(path: str, size: int) -> None:
+    """bot_database.db со схемой init_database и size пользователями"""
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE users (
+            user_id INTEGER PRIMARY KEY, username TEXT, full_name TEXT,
+            subscription_end TEXT, is_admin INTEGER DEFAULT 0,
+            reg_date TEXT DEFAULT CURRENT_TIMESTAMP)
+    """)
+    conn.execute("""
+        CREATE TABLE products (
+            id TEXT PRIMARY KEY, title TEXT NOT NULL, description TEXT, price_stars INTEGER,
+            deliver_text TEXT, deliver_url TEXT, price_rub INTEGER, days INTEGER)
+    """)
+    conn.executemany(
+        "INSERT INTO users (user_id, username, full_name, subscription_end) VALUES (?, ?, ?, ?)",
+        ((1_000_000 + i, f"user{i}", f"User {i}", "2030-01-01" if i % 2 else None) for i in range(size)),
+    )
+    conn.executemany(
+        "INSERT INTO products VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        ((f"p{i}", f"Товар {i}", "Описание", 50, "Код", "https://example.com", 500, 30)
+         for i in range(1, 7)),
+    )
+    conn.commit()
+    conn.close()
+
+
+# ---------- ИЗМЕРЕНИЯ ----------
+def measure(func: Callable[[], object], repeat: int, rounds: int = 3) -> dict:
+    """Возвращает ops/sec (лучший из rounds прогонов) и пиковую память (tracemalloc) для func"""
+    func()  # прогрев
+    elapsed = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            func()
+        elapsed = min(elapsed, time.perf_counter() - start)
+    # Память меряется отдельным вызовом: tracemalloc сильно замедляет код
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"ops_per_sec": repeat / elapsed if elapsed else 0.0, "peak_mb": peak / (1024 * 1024)}
+
+
+def repeats_for(size: int, cheap: bool = False) -> int:
+    if cheap:
+        return 2000
+    return max(1, min(50, 100_000 // size))
+
+
+def bench_size(size: int, workdir: str) -> Dict[str, dict]:
+    import data_tools
+    import payments
+    import payments_archive
+    from database_adapter import DatabaseAdapter
+
+    db_file = os.path.join(workdir, f"db_{size}.json")
+    payments_file = os.path.join(workdir, f"yookassa_{size}.json")
+    sqlite_file = os.path.join(workdir, f"bot_{size}.db")
+
+    with open(db_file, "w", encoding="utf-8") as f:
+        json.dump(generate_db(size, max(1, size // 10)), f, ensure_ascii=False, indent=2)
+    yk = generate_yookassa_payments(size)
+    with open(payments_file, "w", encoding="utf-8") as f:
+        json.dump(yk, f, ensure_ascii=False, indent=2)
+    generate_sqlite(sqlite_file, size)
+
+    data_tools.DB_FILE = db_file
+    payments.YOOKASSA_PAYMENTS_FILE = payments_file
+    # Архив — не настоящий archive/yookassa магазина, а папка бенчмарка
+    archive = os.path.join(workdir, f"archive_{size}")
+    payments_archive.ARCHIVE_DIR = archive
+    adapter = DatabaseAdapter(sqlite_file)
+    product = data_tools.Product(
+        id="p1", title="Товар", description="", price_stars=50, deliver_text="", deliver_url="", price_rub=500
+    )
+    charges = iter(range(10**9))
+    rnd = random.Random(42)
+    heavy = repeats_for(size)
+    cheap = repeats_for(size, cheap=True)
+
+    results = {}
+    db_bytes = os.path.getsize(db_file)
+    if db_bytes <= data_tools.MAX_DB_FILE_BYTES:
+        loaded = sum(len(items) for items in data_tools.load_db()["purchases"].values())
+        if loaded != size:
+            raise RuntimeError(f"load_db: загружено {loaded} покупок из {size}")
+        results["load_db"] = measure(data_tools.load_db, heavy)
+        results["add_purchase"] = measure(lambda: data_tools.add_purchase(1_000_001, product), heavy)
+        results["mark_payment_processed"] = measure(
+            lambda: data_tools.mark_payment_processed(f"new_{next(charges)}"), heavy)
+    else:
+        # add_purchase и mark_payment_processed читают db.json через load_db
+        print(f"   пропущены load_db, add_purchase, mark_payment_processed: db.json {db_bytes / 2**20:.0f} МБ "
+              f"больше лимита {data_tools.MAX_DB_FILE_BYTES / 2**20:.0f} МБ")
+    payments_bytes = os.path.getsize(payments_file)
+    if payments_bytes <= payments.MAX_PAYMENTS_FILE_BYTES:
+        loaded = len(payments.load_yookassa_payments())
+        if loaded != size:
+            raise RuntimeError(f"load_yookassa_payments: загружено {loaded} платежей из {size}")
+        results["load_yookassa_payments"] = measure(payments.load_yookassa_payments, heavy)
+    else:
+        print(f"   пропущен load_yookassa_payments: файл {payments_bytes / 2**20:.0f} МБ "
+              f"больше лимита {payments.MAX_PAYMENTS_FILE_BYTES / 2**20:.0f} МБ")
+    results.update({
+        # Архивация удаляет платежи из словаря: каждому повтору — свежая копия
+        "save_yookassa_payments": measure(lambda: payments.save_yookassa_payments(dict(yk)), heavy),
+        "adapter.add_user": measure(lambda: adapter.add_user(1_000_000 + rnd.randrange(size * 2), "u", "U"), cheap),
+        "adapter.get_user": measure(lambda: adapter.get_user(1_000_000 + rnd.randrange(size)), cheap),
+        "adapter.check_subscription": measure(lambda: adapter.check_subscription(1_000_000 + rnd.randrange(size)), cheap),
+        "adapter.update_subscription": measure(lambda: adapter.update_subscription(1_000_000 + rnd.randrange(size), 30), cheap),
+        "adapter.get_product": measure(lambda: adapter.get_product("p1"), cheap),
+        "adapter.get_all_products": measure(adapter.get_all_products, cheap),
+    })
+    for path in (db_file, payments_file, sqlite_file):
+        os.remove(path)
+    shutil.rmtree(archive, ignore_errors=True)
+    return results
+
+
+def print_results(all_results: Dict[str, Dict[str, dict]]) -> None:
+    print(f"{'операция':<30}{'записей':>10}{'ops/sec':>14}{'пик, МБ':>12}")
+    print("-" * 66)
+    for size, results in all_results.items():
+        for name, r in results.items():
+            print(f"{name:<30}{size:>10}{r['ops_per_sec']:>14.1f}{r['peak_mb']:>12.2f}")
+        print("-" * 66)
+
+
+def check_regressions(all_results: Dict[str, Dict[str, dict]], baseline: dict, tolerance: float) -> List[str]:
+    """Сравнивает результаты с эталоном и возвращает список регрессий"""
+    problems = []
+    for size, results in all_results.items():
+        for name, r in results.items():
+            ref = baseline.get(size, {}).get(name)
+            if not ref:
+                continue
+            if r["ops_per_sec"] < ref["ops_per_sec"] * (1 - tolerance):
+                problems.append(
+                    f"{name} @ {size}: {r['ops_per_sec']:.1f} ops/sec, эталон {ref['ops_per_sec']:.1f}"
+                )
+            if r["peak_mb"] > ref["peak_mb"] * (1 + tolerance) + 1:
+                problems.append(
+                    f"{name} @ {size}: пик {r['peak_mb']:.1f} МБ, эталон {ref['peak_mb']:.1f} МБ"
+                )
+    return problems
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Микробенчмарки слоя хранения")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+                        help="объёмы данных через запятую, например 1000,100000,1000000")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="файл эталонных результатов")
+    parser.add_argument("--save-baseline", action="store_true", help="сохранить результаты как эталон")
+    parser.add_argument("--check", action="store_true", help="сравнить с эталоном, код выхода 1 при регрессии")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="допустимое замедление")
+    args = parser.parse_args()
+
+    prepare_environment()
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    workdir = tempfile.mkdtemp(prefix="bench_storage_")
+    all_results: Dict[str, Dict[str, dict]] = {}
+    try:
+        for size in sizes:
+            print(f"⏳ {size} записей...")
+            all_results[str(size)] = bench_size(size, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print_results(all_results)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(all_results, f, ensure_ascii=False, indent=2)
+        print(f"💾 Эталон сохранён в {args.baseline}")
+
+    if args.check:
+        if not os.path.exists(args.baseline):
+            print(f"❌ Эталон {args.baseline} не найден. Сначала запустите с --save-baseline")
+            sys.exit(2)
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        problems = check_regressions(all_results, baseline, args.tolerance)
+        if problems:
+            print("❌ Регрессии производительности:")
+            for p in problems:
+                print(f"  • {p}")
+            sys.exit(1)
+        print("✅ Регрессий нет")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,35 +1,34 @@
+# Профиль холодного старта: замер импортов начинается раньше всех остальных импортов
+import startup_profile
+startup_profile.start_import_timer()
+
 import os
 import logging
 import asyncio
+import signal
+import time
+from typing import List, Optional, Tuple
 from dotenv import load_dotenv
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import (
-    Application, CommandHandler, CallbackQueryHandler, MessageHandler,
-    PreCheckoutQueryHandler, ContextTypes, filters
+    Application, CommandHandler, MessageHandler,
+    PreCheckoutQueryHandler, TypeHandler, ContextTypes, filters
 )
+from telegram.request import HTTPXRequest
 
 # ====== ЗАГРУЗКА ПЕРЕМЕННЫХ ОКРУЖЕНИЯ ======
 load_dotenv()  # Загружает переменные из .env файла
 
 # ====== НАСТРОЙКА ЛОГИРОВАНИЯ ======
-if not os.path.exists('logs'):
-    os.makedirs('logs')
-
-# 1. Файловый handler (ВСЕ логи ТОЛЬКО в файл)
-file_handler = logging.FileHandler('logs/bot.log', encoding='utf-8')
-file_handler.setLevel(logging.INFO)
-file_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-file_handler.setFormatter(file_formatter)
+from logging_setup import setup_logging
 
-# 2. УБИРАЕМ console_handler полностью - ничего не будет в терминале
-
-# 3. Настройка корневого логгера только с ОДНИМ обработчиком (файловым)
-logging.basicConfig(
-    level=logging.INFO,  # Минимальный уровень для логгеров
-    handlers=[file_handler]  # ← ТОЛЬКО file_handler, без console_handler
-)
+# 1. Логи ТОЛЬКО в файл logs/bot.log, без вывода в терминал.
+#    Вызов logger.* лишь кладёт запись в очередь; запись в файл, ротация
+#    по размеру/времени и сжатие старых файлов идут в фоновом потоке.
+#    LOG_JSON=1 включает структурированный JSON формат.
+setup_logging(level=logging.INFO)
 
-# 4. Отключаем шумные модули
+# 2. Отключаем шумные модули
 logging.getLogger("httpx").setLevel(logging.WARNING)
 logging.getLogger("httpcore").setLevel(logging.WARNING)
 logging.getLogger("telegram").setLevel(logging.WARNING)
@@ -38,57 +37,47 @@ logging.getLogger("telegram.ext").setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
 # Импорты из наших модулей
+import tenants
 from data_tools import (
-    BOT_TOKEN, WAITING_PROMO, ADMIN_STATE, LAST_INVOICE,
+    BOT_TOKEN, WAITING_PROMO, ADMIN_STATE,
     mark_payment_processed, add_purchase,
-    load_db, check_rate_limit, is_admin, YOOKASSA_SHOP_ID, YOOKASSA_SECRET_KEY
+    load_db, check_rate_limit, is_admin, YOOKASSA_SHOP_ID, YOOKASSA_SECRET_KEY,
+    METRICS_PORT, sanitize_input
 )
 
-# Импорты для работы с базой данных
-from database_adapter import (
-    add_user_to_db,
-    get_product_from_db,
-    load_products_from_db
+# Известные пользователи: запись в базу только новых и изменившихся, пакетами
+from user_registry import (
+    ACTIVITY, ACTIVITY_FLUSH_INTERVAL, REGISTRY, USER_FLUSH_INTERVAL, activity_job, register_user,
+    track_activity, flush_job as users_flush_job,
 )
-
-# СОЗДАЁМ ПСЕВДОНИМЫ ДЛЯ СОВМЕСТИМОСТИ СО СТАРЫМ КОДОМ
-get_product = get_product_from_db
-load_products = load_products_from_db
-
-from database_adapter import add_user_to_db
-from keyboards import main_menu_kb, back_to_product_kb, product_kb, catalog_kb, payment_methods_kb, home_only_kb
+# Каталог товаров в памяти: Product загружаются один раз
+from catalog import get_product
+from products_watcher import PRODUCTS_POLL_INTERVAL, PRODUCTS_WATCHER, watch_job as products_watch_job
+# Готовые тексты и клавиатуры экранов каталога
+from render_cache import catalog_screen, product_screen, payment_methods_screen, back_to_product_markup
+from keyboards import main_menu_kb, home_only_kb
 from payments import (
-    delete_last_invoice, create_yookassa_payment,
+    delete_last_invoice, remember_invoice, create_yookassa_payment,
     create_stars_invoice_payload, get_yookassa_payment,
     update_yookassa_payment_status, check_yookassa_payment_status,
     verify_stars_invoice_payload, validate_payment_data
 )
-from admin import get_admin_handlers
-from subscriptions import handle_subscription_command, delete_subscription_message
+from subscriptions import handle_subscription_command, delete_subscription_message, schedule_subscription_reminder
+from outbound import FloodControlLimiter, SharedRequest
+from router import CallbackRouter, ConversationRouter, parse_callback
+from update_processor import CONCURRENT_UPDATES, PerUserUpdateProcessor
+from conversations import CONVERSATIONS
+from metrics import instrument_application, start_metrics_server
+from backup import BACKUP_INTERVAL_HOURS, backup_job
+from leader import LEASE, LEASE_RENEW_INTERVAL, lease_job, leader_only
+from process_lock import JSON_LOCK
+import job_store
+import admin_reports
 
-import html
+startup_profile.stop_import_timer()
 
 
 # ---------- ВАЛИДАЦИЯ И БЕЗОПАСНОСТЬ ----------
-def sanitize_input(text: str, max_length: int = 2000) -> str:
-    """Очищает ввод пользователя от потенциально опасных символов"""
-    if not text:
-        return ""
-    
-    # Ограничиваем длину
-    if len(text) > max_length:
-        text = text[:max_length]
-    
-    # Заменяем опасные HTML символы
-    text = html.escape(text)
-    
-    # Удаляем управляющие символы (кроме переноса строки и табуляции)
-    import re
-    text = re.sub(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F]', '', text)
-    
-    return text
-
-
 def validate_user_session(user_id: int, context: ContextTypes.DEFAULT_TYPE) -> bool:
     """Проверяет валидность сессии пользователя"""
     # Здесь можно добавить проверку IP, времени сессии и т.д.
@@ -107,7 +96,7 @@ async def myid(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         return
     
     username = update.effective_user.username or "нет username"
-    add_user_to_db(uid, username, update.effective_user.full_name or "")
+    register_user(uid, update.effective_user.username, update.effective_user.full_name)
     first_name = sanitize_input(update.effective_user.first_name or "", 100)
     
     await update.message.reply_text(
@@ -141,9 +130,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     username = update.effective_user.username or "нет"
     logger.info(f"Пользователь {uid} (@{username}) запустил бота")
     
-    # --- ВОТ ЭТУ СТРОКУ ДОБАВЬТЕ ---
-    add_user_to_db(uid, username, update.effective_user.full_name or "")
-    # --- КОНЕЦ ДОБАВЛЕНИЯ ---
+    register_user(uid, update.effective_user.username, update.effective_user.full_name)
     
     welcome_text = "Добро пожаловать в магазин бот"
     
@@ -160,7 +147,7 @@ async def on_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
     await query.answer()
     
-    action = query.data
+    action = parse_callback(query.data).action
     user_id = query.from_user.id
     
     # Проверка сессии
@@ -176,34 +163,18 @@ async def on_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     # УДАЛЯЕМ СООБЩЕНИЕ О ПОДПИСКЕ если пользователь переходит в другое меню
     await delete_subscription_message(user_id, context)
     
-    if action in ("menu:home", "menu:catalog", "menu:promocode", "menu:support", "menu:mysub"):
+    handler = MENU_ACTIONS.get(action)
+    if handler:
         await delete_last_invoice(context, user_id)
     
     WAITING_PROMO.pop(user_id, None)
     ADMIN_STATE.pop(user_id, None)
     
-    if action == "menu:home":
-        await handle_menu_home(query, context)
-        return
-    
-    if action == "menu:catalog":
-        await handle_menu_catalog(query, context)  # ← ДОБАВЛЕНО context
-        return
-    
-    if action == "menu:promocode":
-        await handle_menu_promocode(query, user_id, context)  # ← ДОБАВЛЕНО context
-        return
-    
-    if action == "menu:support":
-        await handle_menu_support(query, context)  # ← ДОБАВЛЕНО context
-        return
-    
-    if action == "menu:mysub":
-        await handle_menu_mysub(query, user_id, context)
-        return
+    if handler:
+        await handler(query, user_id, context)
 
 
-async def handle_menu_home(query, context: ContextTypes.DEFAULT_TYPE):
+async def handle_menu_home(query, user_id, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик главного меню с картинкой"""
     try:
         # Получаем абсолютный путь к картинке
@@ -256,9 +227,9 @@ async def handle_menu_home(query, context: ContextTypes.DEFAULT_TYPE):
             )
 
 
-async def handle_menu_catalog(query, context: ContextTypes.DEFAULT_TYPE):
+async def handle_menu_catalog(query, user_id, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик каталога с удалением предыдущего сообщения"""
-    products = load_products()
+    screen = catalog_screen()
     
     # Пытаемся удалить предыдущее сообщение
     try:
@@ -266,30 +237,17 @@ async def handle_menu_catalog(query, context: ContextTypes.DEFAULT_TYPE):
     except Exception as delete_error:
         logger.warning(f"Не удалось удалить предыдущее сообщение: {delete_error}")
     
-    if not products:
-        try:
-            await query.message.reply_text(
-                "📦 <b>Каталог пуст</b>\n\n"
-                "Товары скоро появятся!",
-                reply_markup=home_only_kb(),
-                parse_mode="HTML"
-            )
-        except Exception as e:
-            logger.error(f"Ошибка в handle_menu_catalog: {e}")
-        return
-    
     try:
         await query.message.reply_text(
-            "📦 <b>Выбор подписки</b>\n\n"  # ← ИЗМЕНЕНИЕ
-            "Выберите вариант подписки:",
-            reply_markup=catalog_kb(products),
+            screen.text,
+            reply_markup=screen.reply_markup,
             parse_mode="HTML"
         )
     except Exception as e:
         logger.error(f"Ошибка в handle_menu_catalog: {e}")
         await query.message.reply_text(
-            "📦 <b>Выбор подписки</b>",
-            reply_markup=catalog_kb(products),
+            screen.text.split("\n", 1)[0],
+            reply_markup=screen.reply_markup,
             parse_mode="HTML"
         )
 
@@ -321,7 +279,7 @@ async def handle_menu_promocode(query, user_id, context: ContextTypes.DEFAULT_TY
         )
 
 
-async def handle_menu_support(query, context: ContextTypes.DEFAULT_TYPE):
+async def handle_menu_support(query, user_id, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик поддержки с удалением предыдущего сообщения"""
     
     # Пытаемся удалить предыдущее сообщение
@@ -384,6 +342,16 @@ async def handle_menu_mysub(query, user_id, context: ContextTypes.DEFAULT_TYPE):
             )
 
 
+# Действия кнопок "menu:<action>"
+MENU_ACTIONS = {
+    "home": handle_menu_home,
+    "catalog": handle_menu_catalog,
+    "promocode": handle_menu_promocode,
+    "support": handle_menu_support,
+    "mysub": handle_menu_mysub,
+}
+
+
 async def on_product(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик выбора товара"""
     query = update.callback_query
@@ -392,29 +360,40 @@ async def on_product(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Извлекаем ID товара из callback_data (формат: "prod:p1")
     pid = query.data.split(":")[1] if ":" in query.data else query.data.replace("prod:", "")
     
-    # НОВЫЙ КОД: получаем товар из базы данных
-    p = get_product(pid)  # ← ТОЛЬКО ОДИН АРГУМЕНТ
+    screen = product_screen(pid)
     
-    if not p:
+    if not screen:
         await query.message.reply_text("❌ Товар не найден")
         return
     
-    # Формируем сообщение с информацией о товаре
-    text = (
-        f"<b>{p.get('name', p.get('title', 'Товар'))}</b>\n\n"
-        f"{p.get('description', '')}\n\n"
-        f"💳 <b>Цена:</b> {p.get('price', p.get('price_rub', 0))} руб.\n"
-        f"⭐ <b>Цена в звёздах:</b> {p.get('price_stars', 0)}\n"
-        f"📅 <b>Срок доступа:</b> {p.get('days', 0)} дней"
-    )
-    
     await query.edit_message_text(
-        text,
-        reply_markup=product_kb(pid),
+        screen.text,
+        reply_markup=screen.reply_markup,
         parse_mode="HTML"
     )
 
 
+async def on_catalog_page(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Листание каталога (формат: "cat:<страница>"): готовый экран из кэша"""
+    query = update.callback_query
+    await query.answer()
+
+    try:
+        page = int(parse_callback(query.data).action)
+    except ValueError:
+        page = 0
+
+    screen = catalog_screen(page)
+    try:
+        await query.edit_message_text(
+            screen.text,
+            reply_markup=screen.reply_markup,
+            parse_mode="HTML"
+        )
+    except Exception as e:
+        logger.warning(f"Не удалось переключить страницу каталога: {e}")
+
+
 async def on_choose_payment(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик выбора способа оплаты"""
     query = update.callback_query
@@ -423,41 +402,15 @@ async def on_choose_payment(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Извлекаем ID товара из callback_data
     pid = query.data.split(":")[1] if ":" in query.data else query.data.replace("choose_pay:", "")
 
-    # Получаем товар из базы данных (теперь это словарь)
-    p = get_product(pid)
+    screen = payment_methods_screen(pid)
 
-    if not p:
+    if not screen:
         await query.message.reply_text("❌ Товар не найден")
         return
 
-    # ИСПРАВЛЕНИЕ: Получаем данные из словаря, а не из объекта
-    # Получаем название товара (может быть в 'name' или 'title')
-    title = p.get('title', p.get('name', 'Товар'))
-    
-    # Получаем описание
-    description = p.get('description', '')
-    
-    # Получаем цены
-    price_rub = p.get('price_rub', p.get('price', 0))
-    price_stars = p.get('price_stars', 0)
-    days = p.get('days', 0)
-
-    # Очищаем ввод (если функция sanitize_input используется)
-    safe_title = sanitize_input(str(title), 100)
-    safe_description = sanitize_input(str(description), 2000)
-
-    # Формируем сообщение с выбором способа оплаты
-    text = (
-        f"<b>{safe_title}</b>\n\n"
-        f"{safe_description}\n\n"
-        f"💳 <b>Цена:</b> {price_rub} руб.\n"
-        f"⭐ <b>Цена в звёздах:</b> {price_stars}\n\n"
-        "Выберите способ оплаты:"
-    )
-
     await query.edit_message_text(
-        text,
-        reply_markup=payment_methods_kb(pid),
+        screen.text,
+        reply_markup=screen.reply_markup,
         parse_mode="HTML"
     )
 
@@ -484,9 +437,8 @@ async def on_pay_stars(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         await query.answer("Ошибка: неверный формат данных", show_alert=True)
         return
     
-    # ИСПРАВЛЕНИЕ: получаем товар из базы (словарь)
-    p_dict = get_product(pid)
-    if not p_dict:
+    p = get_product(pid)
+    if not p:
         await query.answer("Товар не найден", show_alert=True)
         return
     
@@ -497,13 +449,13 @@ async def on_pay_stars(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         logger.warning(f"Не удалось удалить сообщение: {e}")
     
     # Создаем защищенный payload
-    prices, payload = create_stars_invoice_payload(user_id, p_dict)
+    prices, payload = create_stars_invoice_payload(user_id, p)
     
     try:
         invoice_msg = await context.bot.send_invoice(
             chat_id=query.message.chat_id,
-            title=f"Оплата: {p_dict.get('title', p_dict.get('name', 'Товар'))[:32]}",
-            description=p_dict.get('description', 'Цифровой товар')[:255],
+            title=f"Оплата: {p.title[:32]}",
+            description=(p.description or "Цифровой товар")[:255],
             payload=payload,
             provider_token="",  # Для Stars provider_token не нужен
             currency="XTR",
@@ -516,7 +468,8 @@ async def on_pay_stars(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
             start_parameter=pid,
         )
         
-        LAST_INVOICE[user_id] = (invoice_msg.chat_id, invoice_msg.message_id)
+        # Неоплаченный инвойс удаляется отложенной задачей (см. payments.INVOICE_TTL)
+        await remember_invoice(user_id, invoice_msg.chat_id, invoice_msg.message_id)
         
         # Логируем создание инвойса
         logger.info(f"Создан инвойс Stars для user_id={user_id}, product_id={pid}")
@@ -527,7 +480,7 @@ async def on_pay_stars(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
             text="⭐ <b>Счет на оплату отправлен</b>\n\n"
                  "Проверьте сообщение выше для оплаты Telegram Stars.\n\n"
                  "❌ <b>Если передумали</b> — нажмите кнопку ниже.",
-            reply_markup=back_to_product_kb(pid),
+            reply_markup=back_to_product_markup(pid),
             parse_mode="HTML"
         )
         
@@ -567,14 +520,12 @@ async def on_pay_yookassa(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await query.answer("Ошибка: неверный формат данных", show_alert=True)
         return
     
-    # ИСПРАВЛЕНИЕ: получаем товар из базы (словарь)
-    p_dict = get_product(pid)
-    if not p_dict:
+    p = get_product(pid)
+    if not p:
         await query.answer("Товар не найден", show_alert=True)
         return
     
-    # ИСПРАВЛЕНИЕ: Получаем данные через get()
-    price_rub = p_dict.get('price_rub', p_dict.get('price', 0))
+    price_rub = p.price_rub
     
     # Проверка цены
     if price_rub <= 0 or price_rub > 10000000:
@@ -584,9 +535,11 @@ async def on_pay_yookassa(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     
     # Создаем защищенный платеж
     try:
-        payment = create_yookassa_payment(
+        # Запросы к ЮКассе синхронные: выполняем их в потоке, не блокируя других пользователей
+        payment = await asyncio.to_thread(
+            create_yookassa_payment,
             user_id=user_id,
-            product=p_dict,  # Передаём словарь, а не объект
+            product=p,
             message_id=query.message.message_id
         )
         
@@ -595,12 +548,19 @@ async def on_pay_yookassa(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             logger.error(f"Не удалось создать платеж ЮКассы для user_id={user_id}, product_id={pid}")
             return
         
-        safe_title = sanitize_input(p_dict.get('title', p_dict.get('name', 'Товар')), 100)
+        # Бот сам проверит оплату, даже если пользователь не нажмёт «Проверить статус»
+        now = int(time.time())
+        await job_store.schedule(
+            "payment_recheck", f"payment:{payment.payment_id}", now + PAYMENT_RECHECK_FIRST,
+            {"payment_id": payment.payment_id, "user_id": user_id, "created": now},
+        )
+        
+        safe_title = sanitize_input(p.title, 100)
         
         text = (
             f"💰 <b>Оплата через ЮКассу</b>\n\n"
             f"📦 Товар: {safe_title}\n"
-            f"💵 Сумма: <b>{price_rub}₽</b> ({p_dict.get('price_stars', 0)}⭐)\n"
+            f"💵 Сумма: <b>{price_rub}₽</b> ({p.price_stars}⭐)\n"
             f"🆔 Номер платежа: <code>{payment.payment_id[:16]}...</code>\n\n"
             f"ℹ️ <i>Нажмите кнопку ниже для перехода к оплате.</i>\n"
             f"После оплаты нажмите «Проверить статус».\n\n"
@@ -640,6 +600,78 @@ async def on_pay_yookassa(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await query.answer("Ошибка при создании платежа", show_alert=True)
 
 
+# Повторные проверки платежа ЮКассы: первая через PAYMENT_RECHECK_FIRST секунд,
+# затем всё реже, пока платежу не больше PAYMENT_RECHECK_WINDOW секунд
+PAYMENT_RECHECK_FIRST = 60
+PAYMENT_RECHECK_WINDOW = int(os.getenv("PAYMENT_RECHECK_WINDOW", str(24 * 3600)))
+
+
+def yookassa_delivery_text(product) -> str:
+    lines = [f"✅ <b>Оплата прошла успешно!</b>\n\nВот ваш товар:"]
+    lines.append(f"📦 {sanitize_input(product.title, 100)}")
+    
+    if product.deliver_text and product.deliver_text.strip():
+        safe_deliver_text = sanitize_input(product.deliver_text.strip(), 1000)
+        lines.append(f"\n{safe_deliver_text}")
+    
+    if product.deliver_url and product.deliver_url.strip():
+        url = product.deliver_url.strip()
+        if url.startswith(("http://", "https://")) and len(url) <= 500:
+            lines.append(f"\n🔗 Ссылка: {url}")
+    return "\n".join(lines)
+
+
+def deliver_yookassa_payment(payment_id: str, user_id: int, product) -> bool:
+    """
+    Записывает покупку по оплаченному платежу. False, если товар по этому
+    платежу уже выдан. Проверка и запись идут под блокировкой JSON-хранилищ:
+    платёж могут одновременно обрабатывать другой поток или процесс
+    """
+    with JSON_LOCK:
+        purchases = load_db().get("purchases", {})
+        for items in purchases.values():
+            if any(item.get("yookassa_id") == payment_id for item in items):
+                return False
+        add_purchase(user_id, product, payment_method="yookassa", yookassa_id=payment_id)
+    logger.info(f"Товар выдан по платежу ЮКассы {payment_id[:8]}... для user_id={user_id}")
+    return True
+
+
+def _next_recheck(created: int, now: int) -> Optional[int]:
+    age = now - created
+    if age >= PAYMENT_RECHECK_WINDOW:
+        return None
+    return now + (60 if age < 600 else 300 if age < 3600 else 900)
+
+
+@job_store.handler("payment_recheck")
+async def payment_recheck_job(bot, payload) -> Optional[int]:
+    """Отложенная задача: проверка платежа ЮКассы и выдача товара после оплаты"""
+    payment_id, user_id = payload["payment_id"], payload["user_id"]
+    status = await asyncio.to_thread(check_yookassa_payment_status, payment_id)
+    if status is None or status in ("pending", "waiting_for_capture"):
+        return _next_recheck(payload["created"], int(time.time()))
+    await asyncio.to_thread(update_yookassa_payment_status, payment_id, status)
+    if status != "succeeded":
+        return None
+    
+    payment_data = await asyncio.to_thread(get_yookassa_payment, payment_id)
+    if not payment_data or payment_data.get("user_id") != user_id:
+        logger.warning(f"Платеж {payment_id} не найден или принадлежит другому пользователю")
+        return None
+    product = get_product(payment_data["product_id"])
+    if not product:
+        logger.error(f"Товар {payment_data['product_id']} по платежу {payment_id} не найден")
+        return None
+    if deliver_yookassa_payment(payment_id, user_id, product):
+        await schedule_subscription_reminder(user_id)
+        await bot.send_message(
+            chat_id=user_id, text=yookassa_delivery_text(product),
+            reply_markup=main_menu_kb(), parse_mode="HTML"
+        )
+    return None
+
+
 async def on_yookassa_check(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Безопасная проверка статуса платежа ЮКассы"""
     query = update.callback_query
@@ -668,7 +700,7 @@ async def on_yookassa_check(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return
     
     # === КРИТИЧЕСКАЯ ПРОВЕРКА 1: Получаем данные платежа ДО всего ===
-    payment_data = get_yookassa_payment(payment_id)
+    payment_data = await asyncio.to_thread(get_yookassa_payment, payment_id)
     if not payment_data:
         await query.answer("Платеж не найден в базе", show_alert=True)
         logger.warning(f"Платеж {payment_id} не найден для user_id={user_id}")
@@ -676,7 +708,7 @@ async def on_yookassa_check(update: Update, context: ContextTypes.DEFAULT_TYPE)
     
     # === КРИТИЧЕСКАЯ ПРОВЕРКА 2: Проверяем владельца ===
     if payment_data.get("user_id") != user_id:
-        logger.security(f"🚨 ПОПЫТКА КРАЖИ ТОВАРА! user_id={user_id} пытается получить чужой платеж {payment_id}")
+        logger.warning(f"🚨 ПОПЫТКА КРАЖИ ТОВАРА! user_id={user_id} пытается получить чужой платеж {payment_id}")
         await query.answer("Это не ваш платеж", show_alert=True)
         return
     
@@ -684,60 +716,34 @@ async def on_yookassa_check(update: Update, context: ContextTypes.DEFAULT_TYPE)
         from data_tools import fmt_dt
         
         # Проверяем статус платежа через API ЮКассы
-        current_status = check_yookassa_payment_status(payment_id)
+        current_status = await asyncio.to_thread(check_yookassa_payment_status, payment_id)
         if not current_status:
             await query.answer("❌ Не удалось проверить статус платежа", show_alert=True)
             logger.warning(f"Не удалось проверить статус платежа {payment_id} для user_id={user_id}")
             return
         
         # Обновляем статус в локальной БД
-        update_yookassa_payment_status(payment_id, current_status)
+        await asyncio.to_thread(update_yookassa_payment_status, payment_id, current_status)
+        if current_status in ("succeeded", "canceled"):
+            await job_store.cancel(f"payment:{payment_id}")
         
         # Если платеж успешен - выдаем товар
         if current_status == "succeeded":
             # Находим товар
-            products = load_products()
-            product = get_product(products, payment_data["product_id"])
+            product = get_product(payment_data["product_id"])
             
             if product:
-                # Проверяем, не выдавали ли уже товар по этому платежу
-                db = load_db()
-                already_delivered = False
-                purchases = db.get("purchases", {})
-                
-                for uid, items in purchases.items():
-                    for item in items:
-                        if item.get("yookassa_id") == payment_id:
-                            already_delivered = True
-                            break
-                    if already_delivered:
-                        break
-                
-                if not already_delivered:
-                    # Добавляем покупку с валидацией
-                    add_purchase(user_id, product, payment_method="yookassa", yookassa_id=payment_id)
-                    
-                    # Логируем успешную выдачу
-                    logger.info(f"Товар выдан по платежу ЮКассы {payment_id[:8]}... для user_id={user_id}")
+                # Проверяем, не выдавали ли уже товар по этому платежу, и добавляем покупку
+                if deliver_yookassa_payment(payment_id, user_id, product):
+                    await schedule_subscription_reminder(user_id)
                     
                     # Отправляем товар
-                    lines = [f"✅ <b>Оплата прошла успешно!</b>\n\nВот ваш товар:"]
-                    lines.append(f"📦 {sanitize_input(product.title, 100)}")
-                    
-                    if product.deliver_text and product.deliver_text.strip():
-                        safe_deliver_text = sanitize_input(product.deliver_text.strip(), 1000)
-                        lines.append(f"\n{safe_deliver_text}")
-                    
-                    if product.deliver_url and product.deliver_url.strip():
-                        url = product.deliver_url.strip()
-                        if url.startswith(("http://", "https://")) and len(url) <= 500:
-                            lines.append(f"\n🔗 Ссылка: {url}")
-                    
+                    text = yookassa_delivery_text(product)
                     try:
-                        await query.edit_message_text("\n".join(lines), reply_markup=main_menu_kb(), parse_mode="HTML")
+                        await query.edit_message_text(text, reply_markup=main_menu_kb(), parse_mode="HTML")
                     except Exception as e:
                         logger.error(f"Ошибка редактирования сообщения: {e}")
-                        await query.message.reply_text("\n".join(lines), reply_markup=main_menu_kb(), parse_mode="HTML")
+                        await query.message.reply_text(text, reply_markup=main_menu_kb(), parse_mode="HTML")
                 else:
                     # Товар уже был выдан
                     safe_title = sanitize_input(product.title, 100)
@@ -859,12 +865,11 @@ async def on_successful_payment(update: Update, context: ContextTypes.DEFAULT_TY
     pid = verify_stars_invoice_payload(payload, user_id)
     
     if not pid:
-        logger.security(f"Невалидный payload платежа Stars от user_id={user_id}: {payload[:50]}...")
+        logger.warning(f"Невалидный payload платежа Stars от user_id={user_id}: {payload[:50]}...")
         await msg.reply_text("❌ Ошибка проверки платежа. Пожалуйста, обратитесь в поддержку.")
         return
     
-    products = load_products()
-    p = get_product(products, pid) if pid else None
+    p = get_product(pid) if pid else None
     if not p:
         logger.error(f"Товар не найден по payload от user_id={user_id}: pid={pid}")
         await msg.reply_text("✅ Оплата прошла! Но товар не найден. Напишите /start или обратитесь в поддержку.")
@@ -874,6 +879,7 @@ async def on_successful_payment(update: Update, context: ContextTypes.DEFAULT_TY
     add_purchase(user_id, p, payment_method="stars")
     
     logger.info(f"Товар выдан по платежу Stars для user_id={user_id}, product_id={pid}")
+    await schedule_subscription_reminder(user_id)
     
     # Отправляем товар
     await msg.reply_text("✅ <b>Оплата прошла успешно!</b>\n\nВот ваш цифровой товар:", parse_mode="HTML")
@@ -896,13 +902,6 @@ async def on_promo_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     """Безопасная обработка промокодов"""
     user_id = update.effective_user.id
     
-    # Если пользователь в админском состоянии - пропускаем
-    if user_id in ADMIN_STATE:
-        return
-    
-    if not WAITING_PROMO.get(user_id):
-        return
-    
     text = (update.message.text or "").strip()
     
     # Rate limiting для промокодов
@@ -977,30 +976,221 @@ async def security_monitor(context: ContextTypes.DEFAULT_TYPE) -> None:
     # - Множественные неудачные платежи
     # - Попытки доступа к админке и т.д.
     
-    # Пример: очистка старых состояний
-    from data_tools import ADMIN_STATE, WAITING_PROMO, LAST_INVOICE
-    import time
+    logger.info("Монитор безопасности завершил работу")
+
+
+async def sweep_conversations_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Очистка истёкших режимов ввода (промокод — 5 минут, админка — 1 час без активности)"""
+    expired = CONVERSATIONS.sweep()
+    if expired:
+        logger.info(f"Очищено устаревших режимов ввода: {expired}")
+
+
+def lazy_admin(name: str):
+    """Обработчик админки, который импортирует модуль admin при первом обращении"""
+    async def handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        import admin
+        await getattr(admin, name)(update, context)
+    handler.__name__ = name
+    return handler
+
+
+class FirstUpdateHandler(TypeHandler):
+    """Профиль запуска: срабатывает только на первое обновление.
+
+    Убрать обработчик из приложения нельзя — параллельные обновления в этот
+    момент перебирают группы обработчиков. Поэтому после первого обновления
+    check_update просто отказывается, не создавая задачу на каждое обновление.
+    """
+
+    def __init__(self):
+        super().__init__(Update, startup_profile.on_first_update, block=False)
+
+    def check_update(self, update: object) -> bool:
+        return startup_profile.first_update_pending() and super().check_update(update)
+
+
+async def on_shutdown(app: Application) -> None:
+    """Дописывает накопленные в памяти изменения перед остановкой"""
+    PRODUCTS_WATCHER.stop()
+    try:
+        await asyncio.to_thread(REGISTRY.flush)
+        await asyncio.to_thread(ACTIVITY.flush)
+    except Exception as e:
+        logger.error(f"Ошибка записи пользователей при остановке: {e}", exc_info=True)
+
+
+def build_application(builder=None, rate_limiter: bool = True,
+                      concurrent_updates: int = CONCURRENT_UPDATES,
+                      tenant: Optional[tenants.Tenant] = None,
+                      schedule_jobs: bool = True) -> Application:
+    """
+    Создаёт приложение и регистрирует все обработчики.
+    tenant — магазин, обновления которого обрабатывает приложение;
+    schedule_jobs=False — периодические задачи уже запланированы другим
+    приложением процесса (задачи выполняются для всех магазинов)
+    """
+    if builder is None:
+        builder = Application.builder().token(tenant.token if tenant else BOT_TOKEN)
+    if rate_limiter:
+        # Все исходящие запросы идут через очередь с флуд-контролем
+        builder = builder.rate_limiter(FloodControlLimiter())
+    # Разные пользователи обрабатываются параллельно, обновления одного — по очереди
+    builder = builder.concurrent_updates(PerUserUpdateProcessor(concurrent_updates, tenant=tenant))
+    builder = builder.post_shutdown(on_shutdown)
+    app = builder.build()
+    # Отложенные задачи магазина выполняются от имени его бота
+    job_store.set_bot(app.bot)
     
-    current_time = time.time()
+    # Добавляем обработчик ошибок
+    app.add_error_handler(error_handler)
     
-    # Очистка старых состояний админки (старше 1 часа)
-    to_remove = []
-    for uid, state in ADMIN_STATE.items():
-        if current_time - state.get('timestamp', 0) > 3600:
-            to_remove.append(uid)
+    # Профиль запуска: время до первого обновления
+    app.add_handler(FirstUpdateHandler(), group=-100)
+    # Активность пользователей: отметка в памяти, запись в базу пачкой (activity_job)
+    app.add_handler(TypeHandler(Update, track_activity), group=-90)
     
-    for uid in to_remove:
-        ADMIN_STATE.pop(uid, None)
-        logger.info(f"Очищено устаревшее состояние админки user_id={uid}")
+    # Основные команды пользователя
+    app.add_handler(CommandHandler("start", start))
+    app.add_handler(CommandHandler("myid", myid))
+
+    # Все callback-кнопки: один обработчик, поиск по пространству имён callback_data.
+    # Обработчики админ-панели загружают модуль admin при первом обращении
+    router = CallbackRouter()
+    router.add("menu", on_menu)
+    router.add("cat", on_catalog_page)
+    router.add("prod", on_product)
+    router.add("choose_pay", on_choose_payment)
+    router.add("pay_stars", on_pay_stars)
+    router.add("pay_yookassa", on_pay_yookassa)
+    router.add("yookassa_check", on_yookassa_check)
+    router.add("admin", lazy_admin("on_admin_click"))
+    router.add("edit_select", lazy_admin("on_edit_select"))
+    router.add("edit_page", lazy_admin("on_edit_page"))
+    app.add_handler(router.handler())
+
+    app.add_handler(CommandHandler("admin", lazy_admin("admin")))
+
+    # Текст принимается только от пользователей с активным режимом ввода
+    # (промокод, диалог админки) и сразу передаётся обработчику этого режима
+    text_router = ConversationRouter(CONVERSATIONS)
+    text_router.add("promo", on_promo_text)
+    text_router.add("admin", lazy_admin("on_admin_text"))
+    app.add_handler(text_router.handler())
     
-    logger.info("Монитор безопасности завершил работу")
+    # Обработчик платежей
+    app.add_handler(PreCheckoutQueryHandler(precheckout))
+    app.add_handler(MessageHandler(filters.SUCCESSFUL_PAYMENT, on_successful_payment))
+
+    # Добавляем периодические задачи (мониторинг безопасности)
+    # Планировщик один на процесс: каждая задача выполняется для всех магазинов.
+    # Общие задачи выполняет только ведущий процесс (leader.py), задачи
+    # с памятью процесса — каждый процесс
+    job_queue = app.job_queue
+    if job_queue and schedule_jobs:
+        job = tenants.per_tenant
+        job_queue.run_repeating(lease_job, interval=LEASE_RENEW_INTERVAL, first=LEASE_RENEW_INTERVAL)
+        job_queue.run_repeating(leader_only(job(security_monitor)), interval=300, first=10)  # Каждые 5 минут
+        if BACKUP_INTERVAL_HOURS > 0:
+            job_queue.run_repeating(leader_only(job(backup_job)), interval=BACKUP_INTERVAL_HOURS * 3600, first=600)
+        job_queue.run_repeating(leader_only(job(admin_reports.snapshot_job)),
+                                interval=admin_reports.SNAPSHOT_TTL, first=30)
+        # Отложенные задачи из базы: в очередь таймеров попадают только ближайшие
+        job_queue.run_repeating(leader_only(job(job_store.load_job)), interval=job_store.JOBS_LOAD_INTERVAL, first=1)
+        job_queue.run_repeating(job(sweep_conversations_job), interval=300, first=10)
+        job_queue.run_repeating(job(users_flush_job), interval=USER_FLUSH_INTERVAL, first=USER_FLUSH_INTERVAL)
+        job_queue.run_repeating(job(activity_job), interval=ACTIVITY_FLUSH_INTERVAL, first=ACTIVITY_FLUSH_INTERVAL)
+        # Опрос products.json (пропускается, пока работает inotify)
+        job_queue.run_repeating(job(products_watch_job), interval=PRODUCTS_POLL_INTERVAL, first=PRODUCTS_POLL_INTERVAL)
+    
+    # Метрики: задержки, ошибки и in-flight по каждому обработчику
+    instrumented = instrument_application(app)
+    logger.info(f"📈 Инструментировано обработчиков: {instrumented}")
+    
+    startup_profile.mark("build_application")
+    return app
+
+
+# Пул соединений общего HTTP-клиента, когда в процессе несколько ботов
+SHARED_POOL_SIZE = int(os.getenv("SHARED_POOL_SIZE", "64"))
+
+
+def prepare_tenant() -> None:
+    """Миграции базы, известные пользователи и наблюдение за products.json текущего магазина"""
+    import migrations
+    schema_version = migrations.migrate(include_heavy=False)
+    logger.info(f"🗄 [{tenants.current().name}] Версия схемы базы данных: {schema_version}")
+    # Миграции: лёгкие сразу, построение индексов в фоне
+    migrations.migrate_in_background()
+    startup_profile.mark("migrations")
+
+    REGISTRY.load()
+    startup_profile.mark("known_users")
+
+    PRODUCTS_WATCHER.start()
+
+
+def build_tenant_applications(shops: List[tenants.Tenant]) -> List[Tuple[tenants.Tenant, Application]]:
+    """Приложения всех магазинов с общим HTTP-клиентом и одним планировщиком задач"""
+    shared = SharedRequest(HTTPXRequest(connection_pool_size=SHARED_POOL_SIZE))
+    apps = []
+    for i, tenant in enumerate(shops):
+        builder = Application.builder().token(tenant.token).request(shared)
+        if i > 0:
+            builder = builder.job_queue(None)
+        with tenants.use(tenant):
+            apps.append((tenant, build_application(builder, tenant=tenant, schedule_jobs=i == 0)))
+    return apps
+
+
+async def run_tenants(apps: List[Tuple[tenants.Tenant, Application]]) -> None:
+    """Запускает приложения магазинов в одном цикле событий до SIGINT/SIGTERM"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            # Windows: остановка по KeyboardInterrupt
+            pass
+
+    started = []
+    try:
+        for tenant, app in apps:
+            # Задачи приложения (получение и обработка обновлений) наследуют магазин
+            with tenants.use(tenant):
+                await app.initialize()
+                started.append((tenant, app))
+                await app.start()
+                await app.updater.start_polling(
+                    allowed_updates=Update.ALL_TYPES,
+                    drop_pending_updates=True
+                )
+            logger.info(f"🏪 Магазин {tenant.name} запущен")
+        await stop.wait()
+    finally:
+        for tenant, app in reversed(started):
+            with tenants.use(tenant):
+                try:
+                    if app.updater.running:
+                        await app.updater.stop()
+                    if app.running:
+                        await app.stop()
+                    await app.shutdown()
+                    # post_shutdown вызывает только run_polling
+                    await on_shutdown(app)
+                except Exception as e:
+                    logger.error(f"Ошибка остановки магазина {tenant.name}: {e}", exc_info=True)
 
 
 def main() -> None:
     """Основная функция запуска безопасного бота"""
     
+    # Несколько магазинов описываются в tenants.json (см. tenants.py)
+    shops = tenants.load_tenants()
+    
     # Проверка обязательных переменных
-    if not BOT_TOKEN:
+    if not shops and not BOT_TOKEN:
         logger.critical("❌ BOT_TOKEN не задан. Задайте переменную окружения BOT_TOKEN.")
         raise SystemExit("❌ BOT_TOKEN не задан.")
     
@@ -1009,53 +1199,32 @@ def main() -> None:
     logger.info("🚀 ЗАПУСК БЕЗОПАСНОГО БОТА МАГАЗИНА")
     logger.info("=" * 60)
     
-    admin_ids_count = len([id for id in os.getenv("ADMIN_IDS", "").split(",") if id.strip()])
+    if shops:
+        tenants.register(shops)
+        logger.info(f"🏪 Магазинов: {len(shops)}")
+    admin_ids_count = len(tenants.DEFAULT_TENANT.admin_ids) if not shops else sum(len(t.admin_ids) for t in shops)
     logger.info(f"🔐 Администраторов: {admin_ids_count}")
     logger.info(f"💰 ЮКасса: {'✅ Настроена' if YOOKASSA_SHOP_ID and YOOKASSA_SECRET_KEY else '❌ Не настроена'}")
     
     if not YOOKASSA_SHOP_ID or not YOOKASSA_SECRET_KEY:
         logger.warning("⚠️  ЮКасса не настроена. Оплата через ЮКассу недоступна.")
     
+    for shop in shops or [tenants.DEFAULT_TENANT]:
+        with tenants.use(shop):
+            prepare_tenant()
+    
     logger.info("=" * 60)
     logger.info("✅ Все проверки пройдены")
     logger.info("=" * 60)
     
-    # Создание приложения
-    app = Application.builder().token(BOT_TOKEN).build()
+    apps = build_tenant_applications(shops) if shops else [(tenants.DEFAULT_TENANT, build_application())]
     
-    # Добавляем обработчик ошибок
-    app.add_error_handler(error_handler)
+    # Общие периодические задачи выполняет только ведущий процесс
+    leader = LEASE.renew()
+    logger.info(f"👑 Периодические задачи: {'ведущий процесс' if leader else 'ожидание аренды'}")
     
-    # Основные команды пользователя
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(CommandHandler("myid", myid))
-    from admin import admin as admin_command
-    app.add_handler(CommandHandler("admin", admin_command))
-
-    # Обработчики меню и товаров
-    app.add_handler(CallbackQueryHandler(on_menu, pattern=r"^menu:"))
-    app.add_handler(CallbackQueryHandler(on_product, pattern=r"^prod:"))
-    app.add_handler(CallbackQueryHandler(on_choose_payment, pattern=r"^choose_pay:"))
-    app.add_handler(CallbackQueryHandler(on_pay_stars, pattern=r"^pay_stars:"))
-    app.add_handler(CallbackQueryHandler(on_pay_yookassa, pattern=r"^pay_yookassa:"))
-    app.add_handler(CallbackQueryHandler(on_yookassa_check, pattern=r"^yookassa_check:"))
-
-    # Обработчики админ-панели
-    admin_handlers = get_admin_handlers()
-    for handler in admin_handlers:
-        app.add_handler(handler)
-
-    # Обработчик промокодов
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, on_promo_text))
-    
-    # Обработчик платежей
-    app.add_handler(PreCheckoutQueryHandler(precheckout))
-    app.add_handler(MessageHandler(filters.SUCCESSFUL_PAYMENT, on_successful_payment))
-
-    # Добавляем периодические задачи (мониторинг безопасности)
-    job_queue = app.job_queue
-    if job_queue:
-        job_queue.run_repeating(security_monitor, interval=300, first=10)  # Каждые 5 минут
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT)
     
     # Запуск бота
     print("\n" + "=" * 60)
@@ -1076,6 +1245,7 @@ def main() -> None:
     print("📊 МОНИТОРИНГ:")
     print("  • Логи в папке logs/")
     print("  • Мониторинг безопасности каждые 5 минут")
+    print(f"  • Метрики Prometheus: {f'http://127.0.0.1:{METRICS_PORT}/metrics' if METRICS_PORT else '❌ Отключены'}")
     print("  • Личный кабинет подписок: ✅ Активно")
     print("=" * 60)
     print("⚠️  ВАЖНО:")
@@ -1086,10 +1256,19 @@ def main() -> None:
     print("Ctrl+C для остановки")
     print("=" * 60 + "\n")
     
-    app.run_polling(
-        allowed_updates=Update.ALL_TYPES,
-        drop_pending_updates=True  # Очистка pending updates при запуске
-    )
+    startup_profile.mark("ready")
+    try:
+        if shops:
+            asyncio.run(run_tenants(apps))
+            return
+        _, app = apps[0]
+        app.run_polling(
+            allowed_updates=Update.ALL_TYPES,
+            drop_pending_updates=True  # Очистка pending updates при запуске
+        )
+    finally:
+        # Другой процесс заберёт задачи, не дожидаясь истечения аренды
+        LEASE.release()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,121 @@
+# catalog.py - Каталог товаров в памяти
+#
+# Товары загружаются из базы один раз и хранятся как неизменяемые Product.
+# Обработчики берут товар по id из словаря, без запроса к базе и без
+# преобразования структуры на каждый клик. После изменения товаров
+# вызывается reload_catalog(); подписчики (add_listener) получают новый
+# каталог сразу после замены.
+#
+# Единственное хранилище товаров — таблица products в bot_database.db.
+# Админ-панель меняет товары через save_product/delete_product: в базу
+# пишется только изменённая строка, а новый снимок каталога собирается из
+# текущего в памяти, без повторного чтения всей таблицы.
+#
+# У каждого магазина (tenants.py) свой каталог и своя нумерация версий.
+import logging
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import tenants
+from data_tools import Product
+from database_adapter import db
+
+logger = logging.getLogger(__name__)
+
+
+class Catalog:
+    """Снимок каталога: товары в порядке показа и индекс по id"""
+
+    __slots__ = ("products", "by_id", "version")
+
+    def __init__(self, products: Tuple[Product, ...], version: int):
+        self.products = products
+        self.by_id: Dict[str, Product] = {p.id: p for p in products}
+        self.version = version
+
+    def get(self, product_id: str) -> Optional[Product]:
+        return self.by_id.get(product_id)
+
+    def __len__(self) -> int:
+        return len(self.products)
+
+
+# Имя магазина -> текущий снимок каталога
+_catalogs: Dict[str, Catalog] = {}
+_lock = threading.Lock()
+_listeners: List[Callable[[Catalog], None]] = []
+
+
+def add_listener(callback: Callable[[Catalog], None]) -> None:
+    """Регистрирует функцию, вызываемую после каждой перезагрузки каталога"""
+    _listeners.append(callback)
+
+
+def _notify(catalog: Catalog) -> None:
+    for callback in list(_listeners):
+        try:
+            callback(catalog)
+        except Exception as e:
+            logger.error(f"Ошибка обработчика перезагрузки каталога: {e}", exc_info=True)
+
+
+def reload_catalog() -> Catalog:
+    """Перечитывает товары из базы и заменяет текущий каталог"""
+    name = tenants.current().name
+    with _lock:
+        previous = _catalogs.get(name)
+        products = tuple(db.get_all_products())
+        version = previous.version + 1 if previous else 1
+        catalog = _catalogs[name] = Catalog(products, version)
+    logger.info(f"Каталог загружен: {len(products)} товаров (версия {version})")
+    _notify(catalog)
+    return catalog
+
+
+def apply_changes(upserted: Iterable[Product] = (), deleted: Iterable[str] = ()) -> Catalog:
+    """
+    Применяет к снимку в памяти уже записанные в базу изменения и оповещает
+    подписчиков. Порядок товаров тот же, что у get_all_products (по цене)
+    """
+    name = tenants.current().name
+    upserted = {p.id: p for p in upserted}
+    deleted = set(deleted) - upserted.keys()
+    with _lock:
+        previous = _catalogs.get(name)
+        if previous is None:
+            products = tuple(db.get_all_products())
+            version = 1
+        else:
+            kept = [upserted.pop(p.id, p) for p in previous.products if p.id not in deleted]
+            products = tuple(sorted(kept + list(upserted.values()), key=lambda p: p.price_rub))
+            version = previous.version + 1
+        catalog = _catalogs[name] = Catalog(products, version)
+    logger.info(f"Каталог обновлён: {len(products)} товаров (версия {version})")
+    _notify(catalog)
+    return catalog
+
+
+def save_product(product: Product, original_id: Optional[str] = None) -> Catalog:
+    """Добавляет или изменяет товар (original_id — прежний ID при переименовании)"""
+    db.save_products([product], replace_id=original_id)
+    deleted = [original_id] if original_id and original_id != product.id else []
+    return apply_changes([product], deleted)
+
+
+def delete_product(product_id: str) -> bool:
+    """Удаляет товар. Возвращает False, если товара не было"""
+    if not db.delete_product(product_id):
+        return False
+    apply_changes(deleted=[product_id])
+    return True
+
+
+def get_catalog() -> Catalog:
+    catalog = _catalogs.get(tenants.current().name)
+    if catalog is None:
+        catalog = reload_catalog()
+    return catalog
+
+
+def get_product(product_id: str) -> Optional[Product]:
+    return get_catalog().get(product_id)
@@ -0,0 +1,113 @@
+# conversations.py - Индекс активных режимов ввода текста
+#
+# Для каждого пользователя хранится не больше одного активного режима
+# (ввод промокода, диалог админки) и время его истечения. Состояния режимов
+# лежат в FlowStates — словарях, которые сами отмечают пользователя в индексе
+# при записи и снимают отметку при pop/del. Поэтому текстовое сообщение
+# можно сразу отправить владельцу режима (router.ConversationRouter),
+# а сообщения остальных пользователей отбросить без вызова обработчиков.
+# Индекс и состояния ведутся отдельно для каждого магазина (tenants.TenantDict).
+import logging
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from tenants import TenantDict
+
+logger = logging.getLogger(__name__)
+
+# Время жизни режимов без активности, секунды
+PROMO_TTL = 300
+ADMIN_TTL = 3600
+
+
+class FlowStates(TenantDict):
+    """
+    Состояния одного режима: user_id -> данные режима.
+    Изменения через [], pop, del и clear (а значит, и setdefault, update)
+    синхронизируются с индексом.
+    """
+
+    def __init__(self, index: "ConversationIndex", flow: str, ttl: float):
+        super().__init__()
+        self.index = index
+        self.flow = flow
+        self.ttl = ttl
+
+    def __setitem__(self, user_id: int, value: Any) -> None:
+        super().__setitem__(user_id, value)
+        self.index.start(user_id, self.flow, self.ttl)
+
+    def __delitem__(self, user_id: int) -> None:
+        super().__delitem__(user_id)
+        self.index.end(user_id, self.flow)
+
+    def pop(self, user_id: int, *default: Any) -> Any:
+        value = super().pop(user_id, *default)
+        self.index.end(user_id, self.flow)
+        return value
+
+    def clear(self) -> None:
+        for user_id in list(self):
+            self.index.end(user_id, self.flow)
+        super().clear()
+
+
+class ConversationIndex:
+    """user_id -> (режим, момент истечения по time.monotonic)"""
+
+    def __init__(self):
+        self._active: Dict[int, Tuple[str, float]] = TenantDict()
+        self._flows: Dict[str, FlowStates] = {}
+
+    def flow(self, name: str, ttl: float) -> FlowStates:
+        """Создаёт хранилище состояний режима, связанное с индексом"""
+        states = FlowStates(self, name, ttl)
+        self._flows[name] = states
+        return states
+
+    def start(self, user_id: int, flow: str, ttl: float) -> None:
+        current = self._active.get(user_id)
+        if current is not None and current[0] != flow:
+            # Новый режим заменяет прежний: его состояние больше не нужно
+            self._flows[current[0]].pop(user_id, None)
+        self._active[user_id] = (flow, time.monotonic() + ttl)
+
+    def end(self, user_id: int, flow: str) -> None:
+        current = self._active.get(user_id)
+        if current is not None and current[0] == flow:
+            del self._active[user_id]
+
+    def active_flow(self, user_id: int) -> Optional[str]:
+        """Активный режим пользователя (None, если нет или истёк)"""
+        current = self._active.get(user_id)
+        if current is None:
+            return None
+        if current[1] < time.monotonic():
+            self._expire(user_id, current[0])
+            return None
+        return current[0]
+
+    def touch(self, user_id: int) -> None:
+        """Продлевает режим после очередного сообщения пользователя"""
+        current = self._active.get(user_id)
+        if current is not None:
+            self._active[user_id] = (current[0], time.monotonic() + self._flows[current[0]].ttl)
+
+    def sweep(self) -> int:
+        """Удаляет истёкшие режимы. Возвращает их количество"""
+        now = time.monotonic()
+        expired = [(uid, flow) for uid, (flow, expires_at) in self._active.items() if expires_at < now]
+        for user_id, flow in expired:
+            self._expire(user_id, flow)
+        return len(expired)
+
+    def _expire(self, user_id: int, flow: str) -> None:
+        self._flows[flow].pop(user_id, None)
+        self._active.pop(user_id, None)
+        logger.info(f"Режим ввода {flow} пользователя user_id={user_id} истёк")
+
+    def __len__(self) -> int:
+        return len(self._active)
+
+
+CONVERSATIONS = ConversationIndex()
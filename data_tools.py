@@ -3,22 +3,33 @@ import os
 import time
 import logging
 import html
-from dataclasses import dataclass
+import re
+from dataclasses import dataclass, fields
 from typing import Any, Dict, List, Optional, Tuple
 from uuid import uuid4
 
+import tenants
+from conversations import ADMIN_TTL, CONVERSATIONS, PROMO_TTL
+from metrics import timed
+from process_lock import JSON_LOCK
+
 logger = logging.getLogger(__name__)
 
 # ====== КОНФИГУРАЦИЯ ======
 # ВАЖНО: Используйте переменные окружения! Не храните ключи в коде!
-BOT_TOKEN = os.getenv("BOT_TOKEN", "")
+# Токен и администраторы магазина по умолчанию (см. tenants.py)
+BOT_TOKEN = tenants.DEFAULT_TENANT.token
+# Имена файлов данных; путь к файлу текущего магазина — tenants.path(имя)
 PRODUCTS_FILE = "products.json"
 DB_FILE = "db.json"
 YOOKASSA_PAYMENTS_FILE = "yookassa_payments.json"
+# Больше этого размера products.json не читается
+MAX_PRODUCTS_FILE_BYTES = 10 * 1024 * 1024
+# Больший db.json не загружается (load_db возвращает пустую базу)
+MAX_DB_FILE_BYTES = 50 * 1024 * 1024
 
-# ID администраторов через переменные окружения
-ADMIN_IDS_STR = os.getenv("ADMIN_IDS", "7784754900")
-ADMIN_IDS = set(map(int, ADMIN_IDS_STR.split(",")))
+# ID администраторов через переменные окружения (ADMIN_IDS)
+ADMIN_IDS = set(tenants.DEFAULT_TENANT.admin_ids)
 
 # Ограничения на размер данных
 MAX_ID_LENGTH = 50
@@ -36,22 +47,43 @@ YOOKASSA_SHOP_ID = os.getenv("YOOKASSA_SHOP_ID", "")
 YOOKASSA_SECRET_KEY = os.getenv("YOOKASSA_SECRET_KEY", "")
 YOOKASSA_WEBHOOK_SECRET = os.getenv("YOOKASSA_WEBHOOK_SECRET", "")
 
-# Проверка обязательных переменных
+# Локальный эндпоинт метрик Prometheus (0 — отключить)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+
+# Проверка обязательных переменных (запуск без BOT_TOKEN останавливает bot.main)
 if not BOT_TOKEN:
-    raise ValueError("BOT_TOKEN не установлен. Установите переменную окружения BOT_TOKEN")
+    logger.warning("BOT_TOKEN не установлен. Установите переменную окружения BOT_TOKEN")
 if not YOOKASSA_SHOP_ID or not YOOKASSA_SECRET_KEY:
     logger.warning("Ключи ЮКассы не установлены. Оплата через ЮКассу не будет работать")
 
-# Глобальные состояния
-WAITING_PROMO: Dict[int, bool] = {}
-ADMIN_STATE: Dict[int, Dict[str, Any]] = {}
-LAST_INVOICE: Dict[int, Tuple[int, int]] = {}
+# Глобальные состояния, у каждого магазина свои. Режимы ввода текста
+# отмечаются в индексе conversations.CONVERSATIONS, по нему текст сразу
+# попадает нужному обработчику
+WAITING_PROMO: Dict[int, bool] = CONVERSATIONS.flow("promo", PROMO_TTL)
+ADMIN_STATE: Dict[int, Dict[str, Any]] = CONVERSATIONS.flow("admin", ADMIN_TTL)
+LAST_INVOICE: Dict[int, Tuple[int, int]] = tenants.TenantDict()
 # Rate limiting
-RATE_LIMIT: Dict[int, Dict[str, Any]] = {}
+RATE_LIMIT: Dict[int, Dict[str, Any]] = tenants.TenantDict()
 
 
-@dataclass
+_DAYS_BY_TITLE = (
+    ("2 дня", 2), ("1 месяц", 30), ("2 месяца", 60),
+    ("3 месяца", 90), ("6 месяцев", 180), ("1 год", 365),
+)
+
+
+def days_from_title(title: str) -> int:
+    """Срок подписки по названию товара (как в init_database)"""
+    title_lower = title.lower()
+    for marker, days in _DAYS_BY_TITLE:
+        if marker in title_lower:
+            return days
+    return 0
+
+
+@dataclass(frozen=True, slots=True)
 class Product:
+    """Товар каталога. Создаётся один раз при загрузке каталога и не изменяется"""
     id: str
     title: str
     description: str
@@ -59,12 +91,34 @@ class Product:
     deliver_text: str
     deliver_url: str
     price_rub: Optional[int] = None
+    days: int = 0
     
     def __post_init__(self):
-        if self.price_rub is None:
-            self.price_rub = self.price_stars * 10
-        elif self.price_rub == 0:
-            self.price_rub = self.price_stars * 10
+        if not self.price_rub:
+            object.__setattr__(self, "price_rub", self.price_stars * 10)
+    
+    @classmethod
+    def from_dict(cls, raw: Dict[str, Any]) -> "Product":
+        """
+        Единственное место, где разбираются старые варианты ключей
+        (name вместо title, price вместо price_rub) из JSON и SQLite.
+        Без поля days срок берётся из названия, как при импорте в базу
+        """
+        title = str(raw.get("title") or raw.get("name") or "Товар")
+        days = raw.get("days")
+        return cls(
+            id=str(raw.get("id", "")),
+            title=title,
+            description=str(raw.get("description") or ""),
+            price_stars=int(raw.get("price_stars") or 0),
+            deliver_text=str(raw.get("deliver_text") or ""),
+            deliver_url=str(raw.get("deliver_url") or ""),
+            price_rub=int(raw.get("price_rub") or raw.get("price") or 0),
+            days=int(days) if days is not None else days_from_title(title),
+        )
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {f.name: getattr(self, f.name) for f in fields(self)}
 
 
 @dataclass
@@ -81,39 +135,32 @@ class YookassaPayment:
 
 
 # ---------- РАБОТА С ТОВАРАМИ ----------
+@timed("json")
+def read_products_file(path: Optional[str] = None) -> List[Product]:
+    """Разбирает файл товаров. В отличие от load_products, ошибки не скрывает"""
+    path = path or tenants.path(PRODUCTS_FILE)
+    # Размер проверяется по файлу до разбора, а не повторной сериализацией
+    size = os.path.getsize(path)
+    if size > MAX_PRODUCTS_FILE_BYTES:
+        raise ValueError(f"файл товаров слишком большой ({size} байт)")
+    with open(path, "r", encoding="utf-8") as f:
+        raw = json.load(f)
+    if not isinstance(raw, list):
+        raise ValueError("ожидался список товаров")
+    return [Product.from_dict(p) for p in raw]
+
+
 def load_products() -> List[Product]:
-    if not os.path.exists(PRODUCTS_FILE):
+    path = tenants.path(PRODUCTS_FILE)
+    if not os.path.exists(path):
         return []
     try:
-        with open(PRODUCTS_FILE, "r", encoding="utf-8") as f:
-            raw = json.load(f)
-        # Ограничение размера файла
-        if len(json.dumps(raw)) > 10 * 1024 * 1024:  # 10MB
-            logger.error("Файл товаров слишком большой")
-            return []
-            
-        products = []
-        for p in raw:
-            if "price_rub" not in p:
-                p["price_rub"] = p.get("price_stars", 0) * 10
-            products.append(Product(**p))
-        return products
-    except (json.JSONDecodeError, Exception) as e:
+        return read_products_file(path)
+    except Exception as e:
         logger.error(f"Ошибка загрузки товаров: {e}")
         return []
 
 
-def save_products(products: List[Product]) -> None:
-    try:
-        tmp = PRODUCTS_FILE + ".tmp"
-        raw = [p.__dict__ for p in products]
-        with open(tmp, "w", encoding="utf-8") as f:
-            json.dump(raw, f, ensure_ascii=False, indent=2)
-        os.replace(tmp, PRODUCTS_FILE)
-    except Exception as e:
-        logger.error(f"Ошибка сохранения товаров: {e}")
-
-
 def get_product(products: List[Product], product_id: str) -> Optional[Product]:
     for p in products:
         if p.id == product_id:
@@ -126,17 +173,19 @@ def _default_db() -> Dict[str, Any]:
     return {"payments_processed": [], "purchases": {}}
 
 
+@timed("json")
 def load_db() -> Dict[str, Any]:
-    if not os.path.exists(DB_FILE):
+    path = tenants.path(DB_FILE)
+    if not os.path.exists(path):
         return _default_db()
     try:
         # Проверка размера файла перед загрузкой
-        file_size = os.path.getsize(DB_FILE)
-        if file_size > 50 * 1024 * 1024:  # 50MB
+        file_size = os.path.getsize(path)
+        if file_size > MAX_DB_FILE_BYTES:
             logger.error(f"Файл БД слишком большой: {file_size} байт")
             return _default_db()
             
-        with open(DB_FILE, "r", encoding="utf-8") as f:
+        with open(path, "r", encoding="utf-8") as f:
             data = json.load(f)
         if not isinstance(data, dict):
             return _default_db()
@@ -148,12 +197,14 @@ def load_db() -> Dict[str, Any]:
         return _default_db()
 
 
+@timed("json")
 def save_db(data: Dict[str, Any]) -> None:
     try:
-        tmp = DB_FILE + ".tmp"
+        path = tenants.path(DB_FILE)
+        tmp = path + ".tmp"
         with open(tmp, "w", encoding="utf-8") as f:
             json.dump(data, f, ensure_ascii=False, indent=2)
-        os.replace(tmp, DB_FILE)
+        os.replace(tmp, path)
     except Exception as e:
         logger.error(f"Ошибка сохранения БД: {e}")
 
@@ -162,23 +213,24 @@ def reset_db() -> None:
     save_db(_default_db())
 
 
+# Чтение-изменение-запись под JSON_LOCK замеряется в отдельном слое json_tx:
+# внутри уже замерены load_db и save_db (слой json), а здесь видно ожидание
+# блокировки другими процессами
+@timed("json_tx")
 def mark_payment_processed(charge_id: str) -> bool:
-    db = load_db()
-    processed = db.get("payments_processed", [])
-    if charge_id in processed:
-        return False
-    processed.append(charge_id)
-    db["payments_processed"] = processed
-    save_db(db)
+    with JSON_LOCK:
+        db = load_db()
+        processed = db.get("payments_processed", [])
+        if charge_id in processed:
+            return False
+        processed.append(charge_id)
+        db["payments_processed"] = processed
+        save_db(db)
     return True
 
 
+@timed("json_tx")
 def add_purchase(user_id: int, product: Product, payment_method: str = "stars", yookassa_id: str = None) -> None:
-    db = load_db()
-    purchases = db.get("purchases", {})
-    uid = str(user_id)
-    purchases.setdefault(uid, [])
-    
     purchase_data = {
         "product_id": product.id,
         "title": product.title,
@@ -191,9 +243,12 @@ def add_purchase(user_id: int, product: Product, payment_method: str = "stars",
     if yookassa_id:
         purchase_data["yookassa_id"] = yookassa_id
     
-    purchases[uid].append(purchase_data)
-    db["purchases"] = purchases
-    save_db(db)
+    with JSON_LOCK:
+        db = load_db()
+        purchases = db.get("purchases", {})
+        purchases.setdefault(str(user_id), []).append(purchase_data)
+        db["purchases"] = purchases
+        save_db(db)
 
 
 def get_all_purchases_flat() -> List[Tuple[str, Dict[str, Any]]]:
@@ -212,7 +267,7 @@ def get_all_purchases_flat() -> List[Tuple[str, Dict[str, Any]]]:
 
 # ---------- ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ----------
 def is_admin(user_id: int) -> bool:
-    return user_id in ADMIN_IDS
+    return user_id in tenants.current().admin_ids
 
 
 def fmt_dt(ts: int) -> str:
@@ -228,6 +283,25 @@ def validate_text_length(text: str, field_name: str, max_length: int) -> Optiona
     return None
 
 
+_CONTROL_CHARS = re.compile(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F]')
+
+
+def sanitize_input(text: str, max_length: int = 2000) -> str:
+    """Очищает ввод пользователя от потенциально опасных символов"""
+    if not text:
+        return ""
+    
+    # Ограничиваем длину
+    if len(text) > max_length:
+        text = text[:max_length]
+    
+    # Заменяем опасные HTML символы
+    text = html.escape(text)
+    
+    # Удаляем управляющие символы (кроме переноса строки и табуляции)
+    return _CONTROL_CHARS.sub('', text)
+
+
 def calculate_stars_from_rub(rub: int) -> int:
     stars = rub / 10
     return int(stars) if stars.is_integer() else int(stars) + 1
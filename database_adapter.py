@@ -3,10 +3,29 @@ import sqlite3
 import json
 from datetime import datetime, timedelta
 
+import tenants
+from data_tools import Product
+from metrics import timed
+
+DB_PATH = 'bot_database.db'
+
+PRODUCT_UPSERT_SQL = """
+    INSERT INTO products (id, title, description, price_stars, deliver_text, deliver_url, price_rub, days)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(id) DO UPDATE SET
+        title = excluded.title, description = excluded.description,
+        price_stars = excluded.price_stars, deliver_text = excluded.deliver_text,
+        deliver_url = excluded.deliver_url, price_rub = excluded.price_rub, days = excluded.days
+"""
+
+
+def product_row(p):
+    return (p.id, p.title, p.description, p.price_stars, p.deliver_text, p.deliver_url, p.price_rub, p.days)
+
 class DatabaseAdapter:
     """Адаптер для работы с базой данных SQLite"""
     
-    def __init__(self, db_path='bot_database.db'):
+    def __init__(self, db_path=DB_PATH):
         self.db_path = db_path
     
     def _get_connection(self):
@@ -17,6 +36,7 @@ class DatabaseAdapter:
     
     # ========== ФУНКЦИИ ДЛЯ ПОЛЬЗОВАТЕЛЕЙ ==========
     
+    @timed("sqlite")
     def add_user(self, user_id, username="", full_name=""):
         """Добавляет пользователя в базу"""
         conn = self._get_connection()
@@ -35,6 +55,7 @@ class DatabaseAdapter:
         finally:
             conn.close()
     
+    @timed("sqlite")
     def get_user(self, user_id):
         """Получает информацию о пользователе"""
         conn = self._get_connection()
@@ -48,6 +69,7 @@ class DatabaseAdapter:
             return dict(user)
         return None
     
+    @timed("sqlite")
     def update_subscription(self, user_id, days_to_add):
         """Обновляет подписку пользователя"""
         user = self.get_user(user_id)
@@ -83,6 +105,7 @@ class DatabaseAdapter:
         conn.close()
         return True
     
+    @timed("sqlite")
     def check_subscription(self, user_id):
         """Проверяет активность подписки"""
         user = self.get_user(user_id)
@@ -102,8 +125,9 @@ class DatabaseAdapter:
     
     # ========== ФУНКЦИИ ДЛЯ ТОВАРОВ ==========
     
+    @timed("sqlite")
     def get_product(self, product_id):
-        """Получает товар по ID (адаптирует структуру для старого кода)"""
+        """Получает товар по ID"""
         conn = self._get_connection()
         cursor = conn.cursor()
         
@@ -112,24 +136,12 @@ class DatabaseAdapter:
         conn.close()
         
         if product:
-            product_dict = dict(product)
-            # Преобразуем структуру для совместимости со старым кодом
-            return {
-                'id': product_dict['id'],
-                'name': product_dict['title'],
-                'description': product_dict['description'],
-                'price': product_dict['price_rub'],  # Основная цена в рублях
-                'price_stars': product_dict['price_stars'],  # Цена в звёздах
-                'days': product_dict['days'],
-                'deliver_text': product_dict['deliver_text'],
-                'deliver_url': product_dict['deliver_url'],
-                'currency': 'RUB',
-                'is_visible': True
-            }
+            return Product.from_dict(dict(product))
         return None
     
+    @timed("sqlite")
     def get_all_products(self):
-        """Получает все товары"""
+        """Получает все товары (по возрастанию цены)"""
         conn = self._get_connection()
         cursor = conn.cursor()
         
@@ -137,32 +149,60 @@ class DatabaseAdapter:
         products = cursor.fetchall()
         conn.close()
         
-        return [dict(product) for product in products]
+        return [Product.from_dict(dict(product)) for product in products]
     
-    # ========== ФУНКЦИИ ДЛЯ СОВМЕСТИМОСТИ ==========
+    @timed("sqlite")
+    def save_products(self, products, delete_ids=(), replace_id=None):
+        """
+        Построчно добавляет/обновляет товары и удаляет delete_ids одной транзакцией.
+        replace_id — прежний ID товара, если при редактировании ID изменился
+        """
+        conn = self._get_connection()
+        try:
+            with conn:
+                if replace_id and all(p.id != replace_id for p in products):
+                    conn.execute("DELETE FROM products WHERE id = ?", (replace_id,))
+                if delete_ids:
+                    conn.executemany("DELETE FROM products WHERE id = ?", [(pid,) for pid in delete_ids])
+                if products:
+                    conn.executemany(PRODUCT_UPSERT_SQL, [product_row(p) for p in products])
+        finally:
+            conn.close()
     
-    def get_products_for_menu(self):
-        """Возвращает товары в формате для меню (как старый load_products)"""
-        products = self.get_all_products()
-        
-        # Преобразуем в старый формат
-        result = {"products": []}
-        for product in products:
-            result["products"].append({
-                'id': product['id'],
-                'name': product['title'],
-                'description': product['description'],
-                'price': product['price_rub'],
-                'price_stars': product['price_stars'],
-                'days': product['days'],
-                'deliver_text': product['deliver_text'],
-                'deliver_url': product['deliver_url']
-            })
-        
-        return result
+    @timed("sqlite")
+    def delete_product(self, product_id):
+        """Удаляет товар. Возвращает True, если товар был"""
+        conn = self._get_connection()
+        try:
+            with conn:
+                return conn.execute("DELETE FROM products WHERE id = ?", (product_id,)).rowcount > 0
+        finally:
+            conn.close()
 
-# Создаём глобальный экземпляр адаптера
-db = DatabaseAdapter()
+    # ========== СЛУЖЕБНЫЕ ЗНАЧЕНИЯ ==========
+    
+    def get_setting(self, key):
+        conn = self._get_connection()
+        try:
+            row = conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+            return row[0] if row else None
+        finally:
+            conn.close()
+    
+    def set_setting(self, key, value):
+        conn = self._get_connection()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT INTO settings (key, value) VALUES (?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                    (key, value),
+                )
+        finally:
+            conn.close()
+
+# Глобальный адаптер: у каждого магазина своя база (tenants.path)
+db = tenants.TenantScoped(lambda tenant: DatabaseAdapter(tenant.path(DB_PATH)))
 
 # ========== ФУНКЦИИ-ОБЁРТКИ ДЛЯ ПРОСТОГО ИМПОРТА ==========
 
@@ -186,7 +226,4 @@ def get_all_products_from_db():
 
 def load_products_from_db():
     """Аналог старой функции load_products() для совместимости"""
-    return get_products_for_menu_from_db()
-
-def get_products_for_menu_from_db():
-    return db.get_products_for_menu()
\ No newline at end of file
+    return db.get_all_products()
\ No newline at end of file
@@ -2,59 +2,19 @@
 
 import sqlite3
 import json
-import os
+
+import migrations
 
 def init_database():
-    """Создаёт базу данных с правильной структурой"""
+    """Приводит схему базы к последней версии и загружает товары"""
     
-    if os.path.exists('bot_database.db'):
-        os.remove('bot_database.db')
-        print("[INFO] Удалена старая база данных")
+    # Схема обновляется миграциями на месте, данные пользователей сохраняются
+    version = migrations.migrate('bot_database.db')
+    print(f"[SUCCESS] Схема базы данных актуальна (версия {version})")
     
     conn = sqlite3.connect('bot_database.db')
     cursor = conn.cursor()
     
-    # Таблица пользователей
-    cursor.execute('''
-        CREATE TABLE users (
-            user_id INTEGER PRIMARY KEY,
-            username TEXT,
-            full_name TEXT,
-            subscription_end TEXT,
-            is_admin INTEGER DEFAULT 0,
-            reg_date TEXT DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # ТАБЛИЦА ТОВАРОВ - КАК В ВАШЕМ products.json
-    cursor.execute('''
-        CREATE TABLE products (
-            id TEXT PRIMARY KEY,
-            title TEXT NOT NULL,
-            description TEXT,
-            price_stars INTEGER,
-            deliver_text TEXT,
-            deliver_url TEXT,
-            price_rub INTEGER,
-            days INTEGER  -- Добавляем поле для дней подписки
-        )
-    ''')
-    
-    # Таблица платежей
-    cursor.execute('''
-        CREATE TABLE payments (
-            id TEXT PRIMARY KEY,
-            user_id INTEGER,
-            product_id TEXT,
-            amount REAL,
-            status TEXT,
-            created_at TEXT DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    conn.commit()
-    print("[SUCCESS] Таблицы созданы успешно!")
-    
     # Загружаем товары из products.json
     try:
         with open('products.json', 'r', encoding='utf-8') as f:
@@ -0,0 +1,226 @@
+# job_store.py - Отложенные задачи, которые переживают перезапуск
+#
+# Напоминания о подписке, повторные проверки платежей ЮКассы и удаление
+# неоплаченных инвойсов хранятся в таблице scheduled_jobs базы магазина
+# (миграция 7) с индексом по времени запуска run_at. У задачи есть ключ
+# (например, "invoice:<user_id>"): повторное планирование с тем же ключом
+# заменяет задачу, а не добавляет вторую.
+#
+# В память (очередь таймеров JobQueue) попадают только задачи, срок которых
+# наступает в ближайшие JOBS_LOAD_INTERVAL секунд: load_job раз в интервал
+# выбирает их по индексу и ставит в run_once. После перезапуска просроченные
+# задачи выполняются первым же load_job, без пересчёта по всем покупкам и
+# платежам.
+#
+# Задача удаляется из базы только после успешного выполнения, поэтому при
+# аварийной остановке она выполнится повторно (обработчики должны это
+# допускать). Обработчик может вернуть время следующего запуска — тогда
+# задача переносится. Загрузку и запуск выполняет только ведущий процесс
+# (leader.py).
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import tenants
+from leader import LEASE
+from metrics import timed
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = "bot_database.db"
+JOBS_LOAD_INTERVAL = float(os.getenv("JOBS_LOAD_INTERVAL", "30"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+# Задержка перед повтором после ошибки: JOB_RETRY_DELAY * 2^(попытка - 1)
+JOB_RETRY_DELAY = 60
+
+SCHEDULE_SQL = """
+    INSERT INTO scheduled_jobs (key, kind, run_at, payload, attempts) VALUES (?, ?, ?, ?, 0)
+    ON CONFLICT(key) DO UPDATE SET
+        kind = excluded.kind, run_at = excluded.run_at, payload = excluded.payload, attempts = 0
+"""
+
+# Обработчик получает бота магазина и payload задачи. Возвращает None,
+# если задача выполнена, или unix time следующего запуска
+JobHandler = Callable[[Any, Dict[str, Any]], Awaitable[Optional[int]]]
+HANDLERS: Dict[str, JobHandler] = {}
+# Имя магазина -> его бот: планировщик один на процесс и принадлежит
+# приложению первого магазина
+_bots: Dict[str, Any] = {}
+
+
+def handler(kind: str) -> Callable[[JobHandler], JobHandler]:
+    """Регистрирует обработчик задач вида kind"""
+    def register(func: JobHandler) -> JobHandler:
+        HANDLERS[kind] = func
+        return func
+    return register
+
+
+def set_bot(bot) -> None:
+    """Бот текущего магазина, от имени которого выполняются его задачи"""
+    _bots[tenants.current().name] = bot
+
+
+class StoredJob:
+    __slots__ = ("key", "kind", "run_at", "payload", "attempts")
+
+    def __init__(self, key: str, kind: str, run_at: int, payload: str, attempts: int):
+        self.key = key
+        self.kind = kind
+        self.run_at = run_at
+        self.payload: Dict[str, Any] = json.loads(payload) if payload else {}
+        self.attempts = attempts
+
+
+class JobStore:
+    """Таблица scheduled_jobs и учёт задач, уже поставленных в очередь таймеров"""
+
+    def __init__(self, db_path: str = DB_PATH):
+        self.db_path = db_path
+        # key -> run_at задач, поставленных в JobQueue этим процессом
+        self._loaded: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    @timed("sqlite")
+    def schedule(self, kind: str, key: str, run_at: int, payload: Optional[Dict[str, Any]] = None) -> None:
+        """Добавляет задачу или заменяет задачу с тем же ключом"""
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(SCHEDULE_SQL, (key, kind, int(run_at), json.dumps(payload or {}, ensure_ascii=False)))
+        finally:
+            conn.close()
+
+    @timed("sqlite")
+    def cancel(self, key: str) -> bool:
+        conn = self._connect()
+        try:
+            with conn:
+                return conn.execute("DELETE FROM scheduled_jobs WHERE key = ?", (key,)).rowcount > 0
+        finally:
+            conn.close()
+
+    def get(self, key: str) -> Optional[StoredJob]:
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT key, kind, run_at, payload, attempts FROM scheduled_jobs WHERE key = ?", (key,)
+            ).fetchone()
+        finally:
+            conn.close()
+        return StoredJob(*row) if row else None
+
+    @timed("sqlite")
+    def due_before(self, ts: int) -> List[StoredJob]:
+        """Задачи со сроком до ts, ещё не поставленные в очередь таймеров"""
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT key, kind, run_at, payload, attempts FROM scheduled_jobs WHERE run_at <= ? ORDER BY run_at",
+                (ts,),
+            ).fetchall()
+        finally:
+            conn.close()
+        with self._lock:
+            jobs = [StoredJob(*row) for row in rows if self._loaded.get(row[0]) != row[2]]
+            for job in jobs:
+                self._loaded[job.key] = job.run_at
+        return jobs
+
+    def unload(self, key: str, run_at: int) -> None:
+        with self._lock:
+            if self._loaded.get(key) == run_at:
+                del self._loaded[key]
+
+    def finish(self, job: StoredJob, next_run_at: Optional[int] = None, failed: bool = False) -> None:
+        """
+        Удаляет выполненную задачу или переносит её на next_run_at. Строка
+        меняется, только если задачу не перепланировали во время выполнения
+        """
+        conn = self._connect()
+        try:
+            with conn:
+                if next_run_at is None:
+                    conn.execute("DELETE FROM scheduled_jobs WHERE key = ? AND run_at = ?", (job.key, job.run_at))
+                else:
+                    conn.execute(
+                        "UPDATE scheduled_jobs SET run_at = ?, attempts = attempts + ? WHERE key = ? AND run_at = ?",
+                        (int(next_run_at), 1 if failed else 0, job.key, job.run_at),
+                    )
+        finally:
+            conn.close()
+
+
+# У каждого магазина свои задачи в своей базе
+JOBS = tenants.TenantScoped(lambda tenant: JobStore(tenant.path(DB_PATH)))
+
+
+async def schedule(kind: str, key: str, run_at: int, payload: Optional[Dict[str, Any]] = None) -> None:
+    """Планирует задачу из обработчика обновления (запись в базу — в отдельном потоке)"""
+    try:
+        await asyncio.to_thread(JOBS.schedule, kind, key, run_at, payload)
+    except Exception as e:
+        logger.error(f"Задача {key} не запланирована: {e}", exc_info=True)
+
+
+async def cancel(key: str) -> None:
+    try:
+        await asyncio.to_thread(JOBS.cancel, key)
+    except Exception as e:
+        logger.error(f"Задача {key} не отменена: {e}", exc_info=True)
+
+
+async def _run(context) -> None:
+    tenant, key, run_at = context.job.data
+    with tenants.use(tenant):
+        store = JOBS.get()
+        try:
+            # Пока задача ждала в очереди, её могли отменить, перенести или
+            # передать другому ведущему процессу
+            if not LEASE.is_leader:
+                return
+            job = await asyncio.to_thread(store.get, key)
+            if job is None or job.run_at != run_at:
+                return
+            func = HANDLERS.get(job.kind)
+            if func is None:
+                logger.error(f"Нет обработчика для задачи {key} ({job.kind})")
+                return
+            try:
+                next_run_at = await func(_bots.get(tenant.name, context.bot), job.payload)
+            except Exception as e:
+                if job.attempts + 1 >= JOB_MAX_ATTEMPTS:
+                    logger.error(f"Задача {key} снята после {job.attempts + 1} попыток: {e}", exc_info=True)
+                    await asyncio.to_thread(store.finish, job)
+                else:
+                    logger.error(f"Ошибка задачи {key} (попытка {job.attempts + 1}): {e}", exc_info=True)
+                    retry_at = int(time.time()) + JOB_RETRY_DELAY * 2 ** job.attempts
+                    await asyncio.to_thread(store.finish, job, retry_at, True)
+                return
+            await asyncio.to_thread(store.finish, job, next_run_at)
+        finally:
+            store.unload(key, run_at)
+
+
+async def load_job(context) -> None:
+    """Задача JobQueue: ставит в очередь таймеров задачи со сроком в ближайший интервал"""
+    tenant = tenants.current()
+    now = int(time.time())
+    try:
+        jobs = await asyncio.to_thread(JOBS.due_before, now + int(JOBS_LOAD_INTERVAL))
+    except Exception as e:
+        logger.error(f"Ошибка загрузки отложенных задач: {e}", exc_info=True)
+        return
+    for job in jobs:
+        context.job_queue.run_once(_run, when=max(0, job.run_at - now), data=(tenant, job.key, job.run_at),
+                                   name=f"stored:{tenant.name}:{job.key}")
+    if jobs:
+        logger.info(f"В очередь поставлено отложенных задач: {len(jobs)}")
@@ -1,13 +1,41 @@
+from functools import lru_cache
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-from typing import List, Optional
+from typing import Optional, Sequence, Tuple
 from data_tools import Product
 
+# Кнопок товаров на одной странице каталога и списка выбора в админке.
+# Клавиатура страницы остаётся небольшой при любом размере каталога
+CATALOG_PAGE_SIZE = 10
+ADMIN_PAGE_SIZE = 20
+
+
+def page_count(total: int, page_size: int) -> int:
+    return max(1, -(-total // page_size))
+
+
+def clamp_page(page: int, total: int, page_size: int) -> int:
+    return min(max(page, 0), page_count(total, page_size) - 1)
+
+
+def nav_row(page: int, pages: int, callback_prefix: str, suffix: str = "") -> list:
+    """Кнопки «назад/вперёд» между страницами (пустой ряд для одной страницы)"""
+    row = []
+    if page > 0:
+        row.append(InlineKeyboardButton("◀️", callback_data=f"{callback_prefix}:{page - 1}{suffix}"))
+    if page < pages - 1:
+        row.append(InlineKeyboardButton("▶️", callback_data=f"{callback_prefix}:{page + 1}{suffix}"))
+    return row
+
+# Неизменяемые клавиатуры без параметров создаются один раз
+# (InlineKeyboardMarkup в python-telegram-bot неизменяем)
+@lru_cache(maxsize=None)
 def home_only_kb() -> InlineKeyboardMarkup:
     """Клавиатура только с кнопкой Главное меню"""
     return InlineKeyboardMarkup([
         [InlineKeyboardButton("🏠 Главное меню", callback_data="menu:home")]
     ])
 
+@lru_cache(maxsize=None)
 def main_menu_kb() -> InlineKeyboardMarkup:
     """Главное меню пользователя"""
     return InlineKeyboardMarkup([
@@ -18,52 +46,23 @@ def main_menu_kb() -> InlineKeyboardMarkup:
     ])
 
 
-def catalog_kb(products):
-    """Клавиатура для каталога товаров"""
-    # ИСПРАВЛЕНИЕ: Объявляем rows В НАЧАЛЕ функции
+def catalog_kb(products: Sequence[Product], page: int = 0,
+               page_size: int = CATALOG_PAGE_SIZE) -> InlineKeyboardMarkup:
+    """Клавиатура одной страницы каталога товаров"""
+    pages = page_count(len(products), page_size)
+    page = clamp_page(page, len(products), page_size)
     rows = []
-    
-    # Получаем список товаров из разных форматов
-    products_list = []
-    
-    # Вариант 1: products - это словарь с ключом 'products'
-    if isinstance(products, dict) and 'products' in products:
-        products_list = products['products']
-    
-    # Вариант 2: products - это уже список
-    elif isinstance(products, list):
-        products_list = products
-    
-    # Вариант 3: products - это что-то ещё
-    else:
-        # Если что-то пошло не так, возвращаем кнопку только "Главное меню"
-        rows.append([InlineKeyboardButton("🏠 Главное меню", callback_data="menu:home")])
-        return InlineKeyboardMarkup(rows)
-    
-    # Теперь работаем с products_list
-    for p in products_list[:50]:  # Ограничение 50 товаров
-        # Извлекаем данные из товара
-        # p может быть словарём или объектом
-        if isinstance(p, dict):
-            product_id = p.get('id', '')
-            product_name = p.get('name', p.get('title', 'Товар'))
-            product_price = p.get('price', p.get('price_rub', 0))
-            product_days = p.get('days', 0)
+    for p in products[page * page_size:(page + 1) * page_size]:
+        if p.days > 0:
+            button_text = f"{p.title} - {p.price_rub} руб. ({p.days} дн.)"
         else:
-            # Если это объект (старый формат)
-            product_id = getattr(p, 'id', '')
-            product_name = getattr(p, 'name', getattr(p, 'title', 'Товар'))
-            product_price = getattr(p, 'price', getattr(p, 'price_rub', 0))
-            product_days = getattr(p, 'days', 0)
+            button_text = f"{p.title} - {p.price_rub} руб."
         
-        # Формируем текст кнопки
-        if product_days and product_days > 0:
-            button_text = f"{product_name} - {product_price} руб. ({product_days} дн.)"
-        else:
-            button_text = f"{product_name} - {product_price} руб."
-        
-        rows.append([InlineKeyboardButton(button_text, callback_data=f"prod:{product_id}")])
+        rows.append([InlineKeyboardButton(button_text, callback_data=f"prod:{p.id}")])
     
+    nav = nav_row(page, pages, "cat")
+    if nav:
+        rows.append(nav)
     rows.append([InlineKeyboardButton("🏠 Главное меню", callback_data="menu:home")])
     return InlineKeyboardMarkup(rows)
 
@@ -106,6 +105,7 @@ def admin_menu_kb(csrf_token: Optional[str] = None) -> InlineKeyboardMarkup:
             [InlineKeyboardButton("📊 Статистика", callback_data=f"admin:stats:{csrf_token}")],
             [InlineKeyboardButton("📜 Последние покупки", callback_data=f"admin:last_purchases:{csrf_token}")],
             [InlineKeyboardButton("💳 Платежи ЮКассы", callback_data=f"admin:yookassa_payments:{csrf_token}")],
+            [InlineKeyboardButton("📤 Экспорт", callback_data=f"admin:export:{csrf_token}")],
             [InlineKeyboardButton("🧹 Сбросить статистику", callback_data=f"admin:reset_stats:{csrf_token}")],
             [InlineKeyboardButton("🏠 Главное меню", callback_data="menu:home")],
         ])
@@ -119,27 +119,43 @@ def admin_menu_kb(csrf_token: Optional[str] = None) -> InlineKeyboardMarkup:
             [InlineKeyboardButton("📊 Статистика", callback_data="admin:stats")],
             [InlineKeyboardButton("📜 Последние покупки", callback_data="admin:last_purchases")],
             [InlineKeyboardButton("💳 Платежи ЮКассы", callback_data="admin:yookassa_payments")],
+            [InlineKeyboardButton("📤 Экспорт", callback_data="admin:export")],
             [InlineKeyboardButton("🧹 Сбросить статистику", callback_data="admin:reset_stats")],
             [InlineKeyboardButton("🏠 Главное меню", callback_data="menu:home")],
         ])
 
 
-def edit_select_product_kb(products: List[Product], csrf_token: Optional[str] = None) -> InlineKeyboardMarkup:
-    """Защищенная клавиатура выбора товара для редактирования"""
-    rows = []
-    for p in products[:30]:  # Ограничение 30 товаров
-        button_text = f"{p.title[:25]} ({p.id}) - {p.price_stars}⭐"
-        if csrf_token:
-            rows.append([InlineKeyboardButton(
-                button_text, 
-                callback_data=f"edit_select:{p.id}:{csrf_token}"
-            )])
-        else:
-            rows.append([InlineKeyboardButton(
-                button_text, 
-                callback_data=f"edit_select:{p.id}"
-            )])
+# Кнопка списка выбора товара: (текст, id товара)
+SelectButton = Tuple[str, str]
+
+
+def edit_select_layout(products: Sequence[Product],
+                       page_size: int = ADMIN_PAGE_SIZE) -> Tuple[Tuple[SelectButton, ...], ...]:
+    """
+    Страницы списка выбора товара без CSRF-токена. Строятся один раз на
+    версию каталога (render_cache), токен подставляется в edit_select_product_kb
+    """
+    pages = tuple(
+        tuple((f"{p.title[:25]} ({p.id}) - {p.price_stars}⭐", p.id) for p in products[i:i + page_size])
+        for i in range(0, len(products), page_size)
+    )
+    return pages or ((),)
+
+
+def edit_select_product_kb(layout: Tuple[Tuple[SelectButton, ...], ...], csrf_token: Optional[str] = None,
+                           page: int = 0) -> InlineKeyboardMarkup:
+    """Защищенная клавиатура выбора товара для редактирования (одна страница)"""
+    pages = len(layout)
+    page = clamp_page(page, pages, 1)
+    suffix = f":{csrf_token}" if csrf_token else ""
+    rows = [
+        [InlineKeyboardButton(button_text, callback_data=f"edit_select:{pid}{suffix}")]
+        for button_text, pid in layout[page]
+    ]
     
+    nav = nav_row(page, pages, "edit_page", suffix)
+    if nav:
+        rows.append(nav)
     if csrf_token:
         rows.append([InlineKeyboardButton("⬅️ Назад", callback_data=f"admin:back:{csrf_token}")])
     else:
@@ -0,0 +1,140 @@
+# leader.py - Выбор ведущего процесса для периодических задач
+#
+# Каждый рабочий процесс бота регистрирует одни и те же задачи JobQueue.
+# Общие задачи (монитор безопасности, бэкап, снимок админ-панели) должен
+# выполнять только один процесс — ведущий, иначе при N процессах они
+# выполняются N раз.
+#
+# Ведущий держит аренду: строку в таблице leases файла LEASE_DB со сроком
+# действия. Каждый процесс раз в LEASE_RENEW_INTERVAL секунд пытается
+# продлить или захватить аренду одним upsert: строка меняется, только если
+# она уже принадлежит этому процессу или её срок истёк. Если ведущий упал,
+# аренда истекает через LEASE_TTL секунд и её забирает другой процесс; при
+# штатной остановке аренда освобождается сразу.
+#
+# Ведущий перестаёт считать себя ведущим на LEASE_MARGIN секунд раньше
+# истечения аренды, поэтому два процесса не выполняют задачи одновременно.
+# Процессы должны работать на одной машине (общий файл и общие часы).
+#
+# Задачи, обёрнутые leader_only, в остальных процессах пропускаются.
+# Обновления обслуживают все процессы, поэтому запись в общие JSON-файлы и
+# ротация логов идут под блокировками process_lock.py, а не под арендой.
+# Задачи, работающие с памятью своего процесса (запись накопленных
+# пользователей, опрос products.json, очистка режимов ввода), выполняются
+# в каждом процессе.
+import asyncio
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Optional
+
+from metrics import SCHEDULER_LEADER
+
+logger = logging.getLogger(__name__)
+
+LEASE_DB = os.getenv("LEASE_DB", "scheduler_lease.db")
+LEASE_TTL = float(os.getenv("LEASE_TTL", "10"))
+LEASE_RENEW_INTERVAL = float(os.getenv("LEASE_RENEW_INTERVAL", "3"))
+LEASE_MARGIN = 1.0
+
+# Строка меняется, только если аренда своя или истекла
+ACQUIRE_SQL = """
+    INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?)
+    ON CONFLICT(name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at
+    WHERE leases.holder = excluded.holder OR leases.expires_at < ?
+"""
+
+
+class LeaderLease:
+    """Аренда роли ведущего в общей базе SQLite"""
+
+    def __init__(self, db_path: str = LEASE_DB, name: str = "scheduler",
+                 ttl: float = LEASE_TTL, holder: Optional[str] = None):
+        self.db_path = db_path
+        self.name = name
+        self.ttl = ttl
+        self.holder = holder or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        # До какого момента (time.time) аренда наша; 0 — не ведущий
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def is_leader(self) -> bool:
+        return time.time() < self._expires_at - LEASE_MARGIN
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=self.ttl / 2, isolation_level=None)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS leases (
+                name TEXT PRIMARY KEY,
+                holder TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+        return conn
+
+    def renew(self) -> bool:
+        """Продлевает или захватывает аренду. Возвращает True, если процесс — ведущий"""
+        with self._lock:
+            was_leader = self.is_leader
+            now = time.time()
+            try:
+                conn = self._connect()
+                try:
+                    acquired = conn.execute(ACQUIRE_SQL, (self.name, self.holder, now + self.ttl, now)).rowcount == 1
+                finally:
+                    conn.close()
+            except sqlite3.Error as e:
+                # Без доступа к базе продлить аренду нельзя: она истечёт сама
+                logger.error(f"Аренда {self.name} не продлена: {e}")
+                acquired = False
+            if acquired:
+                self._expires_at = now + self.ttl
+            elif not self.is_leader:
+                self._expires_at = 0.0
+            leader = self.is_leader
+        if leader != was_leader:
+            logger.info(f"Процесс {self.holder} {'стал ведущим' if leader else 'больше не ведущий'} ({self.name})")
+        SCHEDULER_LEADER.set(value=1 if leader else 0)
+        return leader
+
+    def release(self) -> None:
+        """Освобождает аренду, чтобы другой процесс забрал её без ожидания"""
+        with self._lock:
+            if not self._expires_at:
+                return
+            self._expires_at = 0.0
+            try:
+                conn = self._connect()
+                try:
+                    conn.execute("DELETE FROM leases WHERE name = ? AND holder = ?", (self.name, self.holder))
+                finally:
+                    conn.close()
+            except sqlite3.Error as e:
+                logger.error(f"Аренда {self.name} не освобождена: {e}")
+        SCHEDULER_LEADER.set(value=0)
+        logger.info(f"Процесс {self.holder} освободил аренду {self.name}")
+
+
+LEASE = LeaderLease()
+
+
+def leader_only(job: Callable[[Any], Awaitable[None]]) -> Callable[[Any], Awaitable[None]]:
+    """Задача JobQueue, которая выполняется только в ведущем процессе"""
+    async def run(context) -> None:
+        if LEASE.is_leader:
+            await job(context)
+    run.__name__ = job.__name__
+    return run
+
+
+async def lease_job(context) -> None:
+    """Задача JobQueue: продление аренды в отдельном потоке"""
+    try:
+        await asyncio.to_thread(LEASE.renew)
+    except Exception as e:
+        logger.error(f"Ошибка продления аренды: {e}", exc_info=True)
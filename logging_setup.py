@@ -0,0 +1,205 @@
+# logging_setup.py - Неблокирующее логирование через очередь с ротацией файлов
+import atexit
+import glob
+import gzip
+import json
+import logging
+import os
+import queue
+import shutil
+import time
+from datetime import datetime, timedelta
+from logging.handlers import BaseRotatingHandler, QueueHandler, QueueListener
+from typing import Optional
+
+from process_lock import ProcessLock
+
+# Настройки по умолчанию (переопределяются переменными окружения)
+LOG_DIR = "logs"
+LOG_FILE = "bot.log"
+LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024  # 10MB
+DEFAULT_ROTATE_WHEN = "midnight"
+DEFAULT_BACKUP_COUNT = 14
+
+_ROTATE_INTERVALS = {"H": timedelta(hours=1), "D": timedelta(days=1)}
+
+_listener: Optional[QueueListener] = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Структурированный формат: одна JSON-запись на строку"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class CompressingRotatingFileHandler(BaseRotatingHandler):
+    """
+    Файловый handler с ротацией по размеру и по времени.
+    Старые сегменты сжимаются в .gz, хранится не больше backup_count сегментов.
+
+    В один файл могут писать несколько процессов бота: ротация выполняется
+    под блокировкой process_lock, а процесс, чей файл уже переименовал
+    другой процесс, просто открывает новый файл.
+    """
+
+    def __init__(self, filename: str, max_bytes: int = DEFAULT_MAX_BYTES,
+                 when: str = DEFAULT_ROTATE_WHEN, backup_count: int = DEFAULT_BACKUP_COUNT,
+                 encoding: str = "utf-8"):
+        super().__init__(filename, "a", encoding=encoding)
+        self.max_bytes = max_bytes
+        self.when = (when or "").strip()
+        self.backup_count = backup_count
+        self.rollover_at = self._next_rollover(datetime.now())
+        self._rotate_lock = ProcessLock(self.baseFilename + ".lock")
+
+    def _rotated_elsewhere(self) -> bool:
+        """Открытый файл уже переименован или удалён другим процессом"""
+        if self.stream is None:
+            return False
+        try:
+            current = os.stat(self.baseFilename)
+        except FileNotFoundError:
+            return True
+        own = os.fstat(self.stream.fileno())
+        return (current.st_dev, current.st_ino) != (own.st_dev, own.st_ino)
+
+    def _reopen(self) -> None:
+        if self.stream:
+            self.stream.close()
+        self.stream = self._open()
+        self.rollover_at = self._next_rollover(datetime.now())
+
+    def _next_rollover(self, now: datetime) -> Optional[float]:
+        if self.when.lower() == "midnight":
+            next_time = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+        elif self.when.upper() in _ROTATE_INTERVALS:
+            next_time = now + _ROTATE_INTERVALS[self.when.upper()]
+        else:
+            return None
+        return next_time.timestamp()
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if self._rotated_elsewhere():
+            self._reopen()
+        if self.rollover_at is not None and time.time() >= self.rollover_at:
+            return True
+        if self.max_bytes > 0:
+            if self.stream is None:
+                self.stream = self._open()
+            # Размер файла, а не позиция своего потока: в файл пишут и другие процессы
+            self.stream.flush()
+            size = os.fstat(self.stream.fileno()).st_size
+            if size + len(self.format(record)) + 1 >= self.max_bytes:
+                return True
+        return False
+
+    def doRollover(self) -> None:
+        with self._rotate_lock:
+            # Пока ждали блокировку, файл мог повернуть другой процесс
+            if self._rotated_elsewhere():
+                self._reopen()
+                return
+            if self.stream:
+                self.stream.close()
+                self.stream = None
+
+            if os.path.exists(self.baseFilename) and os.path.getsize(self.baseFilename) > 0:
+                stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+                segment = f"{self.baseFilename}.{stamp}"
+                n = 1
+                while os.path.exists(segment) or os.path.exists(segment + ".gz"):
+                    segment = f"{self.baseFilename}.{stamp}.{n}"
+                    n += 1
+                os.rename(self.baseFilename, segment)
+                self._compress(segment)
+                self._purge_old_segments()
+
+            self._reopen()
+
+    @staticmethod
+    def _compress(path: str) -> None:
+        try:
+            with open(path, "rb") as src, gzip.open(path + ".gz", "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(path)
+        except OSError:
+            # Несжатый сегмент лучше, чем потерянный
+            pass
+
+    def _purge_old_segments(self) -> None:
+        if self.backup_count <= 0:
+            return
+        segments = sorted(glob.glob(glob.escape(self.baseFilename) + ".*.gz"), key=lambda p: (os.path.getmtime(p), p))
+        for old in segments[:-self.backup_count]:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+
+
+class EnqueueOnlyHandler(QueueHandler):
+    """QueueHandler, который не форматирует запись в потоке вызывающего кода"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Очередь внутрипроцессная, поэтому запись можно передать как есть:
+        # форматирование и трейсбеки обрабатываются в фоновом потоке listener-а
+        return record
+
+
+def setup_logging(level: int = logging.INFO, log_dir: str = LOG_DIR, filename: str = LOG_FILE,
+                  json_mode: Optional[bool] = None) -> QueueListener:
+    """
+    Настраивает корневой логгер: вызов logger.info() только кладёт запись в очередь,
+    запись в файл, ротация и сжатие выполняются в фоновом потоке.
+
+    Переменные окружения: LOG_JSON=1, LOG_MAX_BYTES, LOG_ROTATE_WHEN (midnight/H/D/пусто),
+    LOG_BACKUP_COUNT.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    if json_mode is None:
+        json_mode = os.getenv("LOG_JSON", "").lower() in ("1", "true", "yes")
+    max_bytes = int(os.getenv("LOG_MAX_BYTES", str(DEFAULT_MAX_BYTES)))
+    when = os.getenv("LOG_ROTATE_WHEN", DEFAULT_ROTATE_WHEN)
+    backup_count = int(os.getenv("LOG_BACKUP_COUNT", str(DEFAULT_BACKUP_COUNT)))
+
+    os.makedirs(log_dir, exist_ok=True)
+    file_handler = CompressingRotatingFileHandler(
+        os.path.join(log_dir, filename), max_bytes=max_bytes, when=when, backup_count=backup_count
+    )
+    file_handler.setLevel(level)
+    file_handler.setFormatter(JsonFormatter() if json_mode else logging.Formatter(LOG_FORMAT))
+
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(EnqueueOnlyHandler(log_queue))
+    root.setLevel(level)
+
+    _listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+
+def stop_logging() -> None:
+    """Дописывает оставшиеся записи из очереди и останавливает фоновый поток"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
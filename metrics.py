@@ -0,0 +1,321 @@
+# metrics.py - Метрики обработчиков и слоёв хранения в формате Prometheus
+import bisect
+import functools
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм задержки (секунды)
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Квантили, которые считаются по последним наблюдениям
+QUANTILES = (0.5, 0.95, 0.99)
+# Сколько последних наблюдений хранится для расчёта квантилей
+RESERVOIR_SIZE = 2048
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    """Базовый класс метрики с метками"""
+
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._lock = threading.Lock()
+
+    def _key(self, values: LabelValues) -> LabelValues:
+        if len(values) != len(self.labels):
+            raise ValueError(f"{self.name}: ожидались метки {self.labels}, получено {values}")
+        return tuple(str(v) for v in values)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *labels, amount: float = 1.0) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            for key, value in self._values.items():
+                lines.append(f"{self.name}{_format_labels(self.labels, key)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels, amount: float = 1.0) -> None:
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels, value: float) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """Гистограмма с корзинами Prometheus и квантилями по последним наблюдениям"""
+
+    kind = "histogram"
+
+    def __init__(self, *args, buckets: Tuple[float, ...] = LATENCY_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = buckets
+        # key -> [счётчики корзин, сумма, количество, последние наблюдения]
+        self._series: Dict[LabelValues, list] = {}
+
+    def observe(self, *labels, value: float) -> None:
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = [[0] * len(self.buckets), 0.0, 0, deque(maxlen=RESERVOIR_SIZE)]
+                self._series[key] = series
+            idx = bisect.bisect_left(self.buckets, value)
+            if idx < len(self.buckets):
+                series[0][idx] += 1
+            series[1] += value
+            series[2] += 1
+            series[3].append(value)
+
+    def quantiles(self, *labels) -> Dict[float, float]:
+        """Возвращает p50/p95/p99 по последним наблюдениям"""
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            recent = sorted(series[3]) if series else []
+        if not recent:
+            return {}
+        return {q: recent[min(len(recent) - 1, int(q * len(recent)))] for q in QUANTILES}
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        summary = [
+            f"# HELP {self.name}_recent {self.help_text} (последние {RESERVOIR_SIZE} наблюдений)",
+            f"# TYPE {self.name}_recent summary",
+        ]
+        with self._lock:
+            items = [(key, list(s[0]), s[1], s[2], sorted(s[3])) for key, s in self._series.items()]
+        for key, counts, total, count, recent in items:
+            cumulative = 0
+            for bound, c in zip(self.buckets, counts):
+                cumulative += c
+                le = _format_labels(self.labels, key, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            le = _format_labels(self.labels, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{le} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+            for q in QUANTILES:
+                if recent:
+                    value = recent[min(len(recent) - 1, int(q * len(recent)))]
+                    labels = _format_labels(self.labels, key, 'quantile="%s"' % q)
+                    summary.append(f"{self.name}_recent{labels} {value}")
+            summary.append(f"{self.name}_recent_count{_format_labels(self.labels, key)} {len(recent)}")
+        return lines + summary
+
+
+class Registry:
+    """Реестр всех метрик процесса"""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HANDLER_LATENCY = REGISTRY.register(Histogram(
+    "bot_handler_latency_seconds", "Время обработки обновления", ("handler", "route")))
+HANDLER_ERRORS = REGISTRY.register(Counter(
+    "bot_handler_errors_total", "Исключения в обработчиках", ("handler", "route")))
+HANDLER_IN_FLIGHT = REGISTRY.register(Gauge(
+    "bot_handler_in_flight", "Обновления, обрабатываемые прямо сейчас", ("handler", "route")))
+OPERATION_LATENCY = REGISTRY.register(Histogram(
+    "bot_operation_latency_seconds", "Время операций хранилища и внешних API", ("layer", "op")))
+OPERATION_ERRORS = REGISTRY.register(Counter(
+    "bot_operation_errors_total", "Ошибки операций хранилища и внешних API", ("layer", "op")))
+ACTIVE_USERS = REGISTRY.register(Gauge(
+    "bot_active_users", "Пользователи магазина, активные за окно (1d, 7d, 30d)", ("shop", "window")))
+SCHEDULER_LEADER = REGISTRY.register(Gauge(
+    "bot_scheduler_leader", "1, если процесс ведущий и выполняет общие периодические задачи"))
+
+
+# ---------- ЗАМЕРЫ ОПЕРАЦИЙ ----------
+@contextmanager
+def timer(layer: str, op: str):
+    """Замеряет время блока кода: with timer("yookassa", "create"): ..."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        OPERATION_ERRORS.inc(layer, op)
+        raise
+    finally:
+        OPERATION_LATENCY.observe(layer, op, value=time.perf_counter() - start)
+
+
+def timed(layer: str, op: Optional[str] = None):
+    """Декоратор для синхронных функций хранилища"""
+    def decorator(func):
+        name = op or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(layer, name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# ---------- ОБРАБОТЧИКИ TELEGRAM ----------
+# Метка route берётся только из этого списка (плюс зарегистрированные
+# команды и пространства имён callback_data), иначе — "other": произвольные
+# /команды и callback_data от пользователей не создают новых рядов метрик
+KNOWN_ROUTES: Set[str] = {"pre_checkout", "successful_payment", "text", "other"}
+
+
+def register_routes(routes: Iterable[str]) -> None:
+    KNOWN_ROUTES.update(routes)
+
+
+def route_of(update) -> str:
+    """Метка маршрута обновления: префикс callback_data, команда или тип сообщения"""
+    route = _raw_route(update)
+    return route if route in KNOWN_ROUTES else "other"
+
+
+def _raw_route(update) -> str:
+    query = getattr(update, "callback_query", None)
+    if query is not None and query.data:
+        prefix, sep, _ = query.data.partition(":")
+        return prefix + sep
+    if getattr(update, "pre_checkout_query", None) is not None:
+        return "pre_checkout"
+    message = getattr(update, "message", None)
+    if message is not None:
+        if message.successful_payment:
+            return "successful_payment"
+        text = message.text or ""
+        if text.startswith("/"):
+            return text.split()[0].split("@")[0]
+        return "text"
+    return "other"
+
+
+def instrument_handler(handler):
+    """Оборачивает callback обработчика PTB замером задержки, ошибок и in-flight"""
+    callback = handler.callback
+    if getattr(callback, "__instrumented__", False):
+        return handler
+    name = getattr(callback, "__name__", type(handler).__name__)
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        route = route_of(update)
+        HANDLER_IN_FLIGHT.inc(name, route)
+        start = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            HANDLER_ERRORS.inc(name, route)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(name, route, value=time.perf_counter() - start)
+            HANDLER_IN_FLIGHT.dec(name, route)
+
+    wrapper.__instrumented__ = True
+    handler.callback = wrapper
+    return handler
+
+
+def _handler_routes(handler) -> Set[str]:
+    """Маршруты, которые обслуживает обработчик: команды и пространства имён callback_data"""
+    routes = {f"/{command}" for command in getattr(handler, "commands", ())}
+    router = getattr(handler.callback, "__self__", None)
+    if hasattr(router, "namespaces"):
+        for namespace in router.namespaces():
+            routes.update((namespace, namespace + ":"))
+    return routes
+
+
+def instrument_application(app) -> int:
+    """Инструментирует все зарегистрированные обработчики приложения"""
+    count = 0
+    for handlers in app.handlers.values():
+        for handler in handlers:
+            register_routes(_handler_routes(handler))
+            instrument_handler(handler)
+            count += 1
+    return count
+
+
+# ---------- HTTP ЭНДПОИНТ ----------
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Не засоряем лог каждым запросом Prometheus
+        pass
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1") -> Optional[ThreadingHTTPServer]:
+    """Запускает локальный HTTP эндпоинт /metrics в фоновом потоке"""
+    try:
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        logger.error(f"Не удалось запустить эндпоинт метрик на {host}:{port}: {e}")
+        return None
+    thread = threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True)
+    thread.start()
+    logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return server
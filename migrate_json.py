@@ -0,0 +1,362 @@
+# migrate_json.py - Инкрементальная миграция JSON-хранилищ в SQLite
+#
+# Читает products.json, db.json и yookassa_payments.json потоково (память
+# ограничена размером одной записи и буфера чтения) и загружает их в
+# bot_database.db пачками executemany внутри транзакций.
+#
+# Миграция идемпотентна (INSERT OR IGNORE / upsert по естественным ключам)
+# и возобновляема: прогресс каждой секции хранится в таблице migration_progress
+# в той же транзакции, что и данные. Бот при этом может продолжать работать.
+#
+# Запуск:
+#   python migrate_json.py                 # все файлы
+#   python migrate_json.py --only db       # только db.json
+#   python migrate_json.py --batch 5000 --restart
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import migrations
+import tenants
+from data_tools import days_from_title
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = "bot_database.db"
+DEFAULT_BATCH = 1000
+READ_CHUNK = 64 * 1024
+
+_WHITESPACE = " \t\n\r"
+_NUMBER_START = "-0123456789"
+_NUMBER_CHARS = "+-.0123456789eE"
+
+
+class JsonStream:
+    """
+    Потоковый разбор JSON-документа.
+
+    items() и elements() обходят объект и массив, не загружая их целиком:
+    после получения ключа/индекса вызывающий код обязан прочитать значение
+    через value() или спуститься внутрь через items()/elements().
+    """
+
+    def __init__(self, f, chunk_size: int = READ_CHUNK):
+        self._f = f
+        self._chunk_size = chunk_size
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+        self._decoder = json.JSONDecoder()
+
+    def _fill(self) -> bool:
+        if self._eof:
+            return False
+        chunk = self._f.read(self._chunk_size)
+        if not chunk:
+            self._eof = True
+            return False
+        # Прочитанную часть буфера отбрасываем, чтобы память не росла
+        self._buf = self._buf[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def peek(self) -> str:
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in _WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                raise ValueError("Неожиданный конец JSON")
+
+    def _expect(self, char: str) -> None:
+        if self.peek() != char:
+            raise ValueError(f"Ожидался символ {char!r} в позиции {self._pos}")
+        self._pos += 1
+
+    def value(self) -> Any:
+        """Читает одно значение целиком"""
+        if self.peek() in _NUMBER_START:
+            # Число на границе буфера может оказаться обрезанным: дочитываем до разделителя
+            while True:
+                end = self._pos
+                while end < len(self._buf) and self._buf[end] in _NUMBER_CHARS:
+                    end += 1
+                if end < len(self._buf) or not self._fill():
+                    break
+        while True:
+            try:
+                result, end = self._decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            self._pos = end
+            return result
+
+    def _iter_container(self, open_char: str, close_char: str, keyed: bool) -> Iterator[Any]:
+        self._expect(open_char)
+        if self.peek() == close_char:
+            self._pos += 1
+            return
+        index = 0
+        while True:
+            if keyed:
+                key = self.value()
+                self._expect(":")
+                yield key
+            else:
+                yield index
+                index += 1
+            sep = self.peek()
+            self._pos += 1
+            if sep == close_char:
+                return
+            if sep != ",":
+                raise ValueError(f"Ожидалась ',' или {close_char!r}, получено {sep!r}")
+
+    def items(self) -> Iterator[str]:
+        """Ключи объекта по очереди"""
+        return self._iter_container("{", "}", keyed=True)
+
+    def elements(self) -> Iterator[int]:
+        """Индексы массива по очереди"""
+        return self._iter_container("[", "]", keyed=False)
+
+    def skip(self) -> None:
+        """Пропускает значение, не собирая его целиком в память"""
+        char = self.peek()
+        if char == "{":
+            for _ in self.items():
+                self.skip()
+        elif char == "[":
+            for _ in self.elements():
+                self.skip()
+        else:
+            self.value()
+
+
+# ---------- ПРЕОБРАЗОВАНИЕ ЗАПИСЕЙ ----------
+def _int(value: Any, default: int = 0) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def product_row(item: Dict[str, Any]) -> Tuple:
+    title = str(item.get("title", "Без названия"))
+    days = item.get("days")
+    return (
+        str(item.get("id", "")), title, str(item.get("description", "")),
+        _int(item.get("price_stars")), str(item.get("deliver_text", "")),
+        str(item.get("deliver_url", "")), _int(item.get("price_rub")),
+        _int(days) if days is not None else days_from_title(title),
+    )
+
+
+def purchase_row(uid: str, index: int, item: Dict[str, Any]) -> Tuple:
+    return (
+        f"{uid}:{index}", _int(uid), item.get("product_id"), item.get("title"),
+        _int(item.get("stars")), _int(item["rub"]) if "rub" in item else None, item.get("payment_method"),
+        item.get("yookassa_id"), _int(item.get("ts")),
+    )
+
+
+def payment_row(payment_id: str, item: Dict[str, Any]) -> Tuple:
+    return (
+        payment_id, _int(item.get("user_id")), item.get("product_id"), item.get("amount"),
+        item.get("status"), item.get("created_at"), item.get("payment_url"),
+        item.get("message_id"), item.get("description"),
+        json.dumps(item, ensure_ascii=False, default=str),
+    )
+
+
+# Таблица products — основное хранилище товаров (правки админ-панели есть
+# только в ней), поэтому products.json лишь дополняет её недостающими товарами
+PRODUCT_SQL = """
+    INSERT OR IGNORE INTO products
+    (id, title, description, price_stars, deliver_text, deliver_url, price_rub, days)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+PURCHASE_SQL = """
+    INSERT OR IGNORE INTO purchases
+    (source_key, user_id, product_id, title, stars, rub, payment_method, yookassa_id, ts)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+PROCESSED_SQL = "INSERT OR IGNORE INTO processed_payments (charge_id) VALUES (?)"
+PAYMENT_SQL = """
+    INSERT INTO payments
+    (id, user_id, product_id, amount, status, created_at, payment_url, message_id, description, data)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(id) DO UPDATE SET
+        status = excluded.status, data = excluded.data, message_id = excluded.message_id
+"""
+
+
+# ---------- СЕКЦИИ ----------
+def iter_products(stream: JsonStream) -> Iterator[Tuple[str, Tuple]]:
+    if stream.peek() != "[":
+        stream.skip()
+        return
+    for _ in stream.elements():
+        item = stream.value()
+        if isinstance(item, dict):
+            yield PRODUCT_SQL, product_row(item)
+
+
+def iter_db(stream: JsonStream) -> Iterator[Tuple[str, Tuple]]:
+    for key in stream.items():
+        if key == "payments_processed" and stream.peek() == "[":
+            for _ in stream.elements():
+                charge_id = stream.value()
+                if isinstance(charge_id, str):
+                    yield PROCESSED_SQL, (charge_id,)
+        elif key == "purchases" and stream.peek() == "{":
+            for uid in stream.items():
+                if stream.peek() != "[":
+                    stream.skip()
+                    continue
+                for index in stream.elements():
+                    item = stream.value()
+                    if isinstance(item, dict):
+                        yield PURCHASE_SQL, purchase_row(uid, index, item)
+        else:
+            stream.skip()
+
+
+def iter_yookassa(stream: JsonStream) -> Iterator[Tuple[str, Tuple]]:
+    for payment_id in stream.items():
+        item = stream.value()
+        if isinstance(item, dict):
+            yield PAYMENT_SQL, payment_row(payment_id, item)
+
+
+SECTIONS: Dict[str, Tuple[str, Callable[[JsonStream], Iterator[Tuple[str, Tuple]]]]] = {
+    "products": ("products.json", iter_products),
+    "db": ("db.json", iter_db),
+    "yookassa": ("yookassa_payments.json", iter_yookassa),
+}
+
+
+# ---------- ЗАПУСК ----------
+def _progress(conn: sqlite3.Connection, section: str) -> Optional[sqlite3.Row]:
+    return conn.execute(
+        "SELECT source_size, source_mtime, done, finished FROM migration_progress WHERE section = ?",
+        (section,),
+    ).fetchone()
+
+
+def _save_progress(conn: sqlite3.Connection, section: str, stat: os.stat_result, done: int, finished: bool) -> None:
+    conn.execute("""
+        INSERT INTO migration_progress (section, source_size, source_mtime, done, finished, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(section) DO UPDATE SET
+            source_size = excluded.source_size, source_mtime = excluded.source_mtime,
+            done = excluded.done, finished = excluded.finished, updated_at = excluded.updated_at
+    """, (section, stat.st_size, stat.st_mtime, done, int(finished), int(time.time())))
+
+
+def is_section_current(conn: sqlite3.Connection, section: str, path: str) -> bool:
+    """Секция полностью перенесена, и файл с тех пор не менялся"""
+    progress = _progress(conn, section)
+    if not progress or not progress[3] or not os.path.exists(path):
+        return False
+    stat = os.stat(path)
+    return progress[0] == stat.st_size and progress[1] == stat.st_mtime
+
+
+def migrate_section(conn: sqlite3.Connection, section: str, path: str,
+                    batch_size: int = DEFAULT_BATCH, restart: bool = False) -> int:
+    """
+    Переносит одну секцию. Возвращает число записей, загруженных в этом запуске.
+
+    Если файл не менялся с прошлого запуска, уже загруженные записи пропускаются
+    (разбираются, но не пишутся). Если файл изменился, секция проходится заново:
+    вставки идемпотентны, поэтому повтор безопасен.
+    """
+    if not os.path.exists(path):
+        logger.info(f"{path} не найден, секция {section} пропущена")
+        return 0
+
+    stat = os.stat(path)
+    progress = _progress(conn, section)
+    skip = 0
+    if progress and not restart and progress[0] == stat.st_size and progress[1] == stat.st_mtime:
+        if progress[3]:
+            logger.info(f"Секция {section} уже перенесена")
+            return 0
+        skip = progress[2]
+
+    _, producer = SECTIONS[section]
+    batches: Dict[str, List[Tuple]] = {}
+    pending = 0
+    done = 0
+    loaded = 0
+
+    def flush(finished: bool) -> None:
+        nonlocal pending
+        with conn:
+            for sql, rows in batches.items():
+                if rows:
+                    conn.executemany(sql, rows)
+            _save_progress(conn, section, stat, done, finished)
+        batches.clear()
+        pending = 0
+
+    with open(path, "r", encoding="utf-8") as f:
+        for sql, row in producer(JsonStream(f)):
+            done += 1
+            if done <= skip:
+                continue
+            batches.setdefault(sql, []).append(row)
+            pending += 1
+            loaded += 1
+            if pending >= batch_size:
+                flush(finished=False)
+                logger.info(f"{section}: перенесено {done} записей")
+    flush(finished=True)
+    return loaded
+
+
+def migrate(db_path: str = DB_PATH, sections: Optional[List[str]] = None,
+            batch_size: int = DEFAULT_BATCH, restart: bool = False) -> Dict[str, int]:
+    """Переносит выбранные секции и возвращает число загруженных записей по секциям"""
+    # Таблицы создаются миграциями схемы; индексы лучше строить после загрузки
+    migrations.migrate(db_path, include_heavy=False)
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        # WAL позволяет боту читать базу, пока идёт загрузка
+        conn.execute("PRAGMA journal_mode=WAL")
+        result = {}
+        for section in sections or list(SECTIONS):
+            path, _ = SECTIONS[section]
+            result[section] = migrate_section(conn, section, tenants.path(path), batch_size, restart)
+    finally:
+        conn.close()
+    migrations.migrate(db_path)
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Инкрементальная миграция JSON-хранилищ в SQLite")
+    parser.add_argument("--db", default=DB_PATH, help="путь к базе SQLite")
+    parser.add_argument("--only", choices=sorted(SECTIONS), action="append", help="перенести только эту секцию")
+    parser.add_argument("--batch", type=int, default=DEFAULT_BATCH, help="размер пачки executemany")
+    parser.add_argument("--restart", action="store_true", help="игнорировать сохранённый прогресс")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    started = time.perf_counter()
+    result = migrate(args.db, args.only, args.batch, args.restart)
+    for section, loaded in result.items():
+        print(f"[SUCCESS] {section}: загружено {loaded} записей")
+    print(f"[INFO] Готово за {time.perf_counter() - started:.1f} с")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,318 @@
+# migrations.py - Версионные миграции схемы bot_database.db
+#
+# Каждая миграция меняет схему на месте (CREATE ... IF NOT EXISTS, ADD COLUMN,
+# CREATE INDEX) и записывается в таблицу schema_version. База больше не
+# пересоздаётся целиком, данные сохраняются.
+#
+# Миграции с heavy=True (построение индексов на больших таблицах) можно
+# выполнить в фоне уже после запуска бота: база работает в режиме WAL,
+# поэтому чтения не блокируются, а записи бота ждут busy_timeout. При запуске
+# применяются все лёгкие миграции, тяжёлые пропускаются до фонового прохода,
+# поэтому в schema_version записана каждая применённая версия, а лёгкая
+# миграция не должна зависеть от тяжёлой.
+#
+# Запуск вручную: python migrations.py [--status]
+import argparse
+import contextvars
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Set
+
+import tenants
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = "bot_database.db"
+PRODUCTS_JSON = "products.json"
+BUSY_TIMEOUT_MS = 30_000
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    description: str
+    apply: Callable[[sqlite3.Connection], None]
+    heavy: bool = False
+
+
+def _columns(conn: sqlite3.Connection, table: str) -> set:
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def add_column(conn: sqlite3.Connection, table: str, name: str, decl: str) -> None:
+    """ADD COLUMN, если колонки ещё нет (в SQLite это не переписывает таблицу)"""
+    if name not in _columns(conn, table):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {decl}")
+
+
+# ---------- МИГРАЦИИ ----------
+def _m001_base(conn: sqlite3.Connection) -> None:
+    # Исходная схема init_database
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            full_name TEXT,
+            subscription_end TEXT,
+            is_admin INTEGER DEFAULT 0,
+            reg_date TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS products (
+            id TEXT PRIMARY KEY,
+            title TEXT NOT NULL,
+            description TEXT,
+            price_stars INTEGER,
+            deliver_text TEXT,
+            deliver_url TEXT,
+            price_rub INTEGER,
+            days INTEGER
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS payments (
+            id TEXT PRIMARY KEY,
+            user_id INTEGER,
+            product_id TEXT,
+            amount REAL,
+            status TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    # Старые базы из create_database.py могут не содержать этих колонок
+    add_column(conn, "users", "is_admin", "INTEGER DEFAULT 0")
+    add_column(conn, "users", "reg_date", "TEXT")
+    add_column(conn, "products", "days", "INTEGER")
+
+
+def _m002_json_mirror(conn: sqlite3.Connection) -> None:
+    # Таблицы для данных из db.json и yookassa_payments.json (см. migrate_json.py)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS purchases (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            source_key TEXT UNIQUE,
+            user_id INTEGER NOT NULL,
+            product_id TEXT,
+            title TEXT,
+            stars INTEGER,
+            rub INTEGER,
+            payment_method TEXT,
+            yookassa_id TEXT,
+            ts INTEGER
+        )
+    """)
+    conn.execute("CREATE TABLE IF NOT EXISTS processed_payments (charge_id TEXT PRIMARY KEY)")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS migration_progress (
+            section TEXT PRIMARY KEY,
+            source_size INTEGER,
+            source_mtime REAL,
+            done INTEGER NOT NULL DEFAULT 0,
+            finished INTEGER NOT NULL DEFAULT 0,
+            updated_at INTEGER
+        )
+    """)
+    add_column(conn, "payments", "payment_url", "TEXT")
+    add_column(conn, "payments", "message_id", "INTEGER")
+    add_column(conn, "payments", "description", "TEXT")
+    add_column(conn, "payments", "data", "TEXT")
+
+
+def _m003_indexes(conn: sqlite3.Connection) -> None:
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_subscription_end ON users(subscription_end)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_payments_user ON payments(user_id, status)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_purchases_user_ts ON purchases(user_id, ts)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_purchases_yookassa ON purchases(yookassa_id)")
+
+
+def _m004_activity(conn: sqlite3.Connection) -> None:
+    # Последняя активность (unix time) и число действий, см. user_registry.ActivityTracker
+    add_column(conn, "users", "last_seen", "INTEGER")
+    add_column(conn, "users", "clicks", "INTEGER NOT NULL DEFAULT 0")
+
+
+def _m005_activity_index(conn: sqlite3.Connection) -> None:
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_last_seen ON users(last_seen)")
+
+
+def _m006_products_from_json(conn: sqlite3.Connection) -> None:
+    # Товары, которые админ-панель сохраняла в products.json до перехода
+    # на единое хранилище в таблице products
+    import migrate_json
+    path = tenants.path(PRODUCTS_JSON)
+    if not os.path.exists(path):
+        return
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            raw = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"{path} не прочитан, товары не перенесены: {e}")
+        return
+    if not isinstance(raw, list):
+        return
+    rows = [migrate_json.product_row(item) for item in raw if isinstance(item, dict) and item.get("id")]
+    conn.executemany(migrate_json.PRODUCT_SQL, rows)
+
+
+def _m007_scheduled_jobs(conn: sqlite3.Connection) -> None:
+    # Отложенные задачи (см. job_store.py); run_at — unix time запуска
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS scheduled_jobs (
+            key TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            run_at INTEGER NOT NULL,
+            payload TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_scheduled_jobs_run_at ON scheduled_jobs(run_at)")
+
+
+def _m008_settings(conn: sqlite3.Connection) -> None:
+    # Служебные значения, например состояние products.json (см. products_watcher.py)
+    conn.execute("CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)")
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "Базовые таблицы users, products, payments", _m001_base),
+    Migration(2, "Таблицы покупок и обработанных платежей из JSON", _m002_json_mirror),
+    Migration(3, "Индексы для выборок по пользователю и подписке", _m003_indexes, heavy=True),
+    Migration(4, "Колонки активности пользователей", _m004_activity),
+    Migration(5, "Индекс по последней активности", _m005_activity_index, heavy=True),
+    Migration(6, "Товары из products.json в таблицу products", _m006_products_from_json),
+    Migration(7, "Таблица отложенных задач", _m007_scheduled_jobs),
+    Migration(8, "Таблица служебных значений", _m008_settings),
+]
+
+
+# ---------- ЗАПУСК ----------
+def connect(db_path: Optional[str] = None) -> sqlite3.Connection:
+    """Соединение с базой (по умолчанию — база текущего магазина)"""
+    db_path = db_path or tenants.path(DB_PATH)
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+
+def _ensure_version_table(conn: sqlite3.Connection) -> None:
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            duration_ms INTEGER
+        )
+    """)
+
+
+def applied_versions(conn: sqlite3.Connection) -> Set[int]:
+    _ensure_version_table(conn)
+    return {row[0] for row in conn.execute("SELECT version FROM schema_version")}
+
+
+def current_version(conn: sqlite3.Connection) -> int:
+    """Последняя версия, до которой применены все миграции"""
+    applied = applied_versions(conn)
+    version = 0
+    for migration in MIGRATIONS:
+        if migration.version not in applied:
+            break
+        version = migration.version
+    return version
+
+
+def pending_migrations(conn: sqlite3.Connection) -> List[Migration]:
+    applied = applied_versions(conn)
+    return [m for m in MIGRATIONS if m.version not in applied]
+
+
+def _apply(conn: sqlite3.Connection, migration: Migration) -> None:
+    started = time.perf_counter()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Повторная проверка под блокировкой: миграцию мог применить другой процесс
+        if conn.execute("SELECT 1 FROM schema_version WHERE version = ?", (migration.version,)).fetchone():
+            conn.execute("ROLLBACK")
+            return
+        migration.apply(conn)
+        duration_ms = int((time.perf_counter() - started) * 1000)
+        conn.execute(
+            "INSERT INTO schema_version (version, description, duration_ms) VALUES (?, ?, ?)",
+            (migration.version, migration.description, duration_ms),
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    logger.info(f"Миграция {migration.version} применена за {duration_ms} мс: {migration.description}")
+
+
+def migrate(db_path: Optional[str] = None, include_heavy: bool = True) -> int:
+    """
+    Применяет недостающие миграции по порядку. Возвращает итоговую версию схемы.
+    При include_heavy=False тяжёлые миграции пропускаются (их применит
+    migrate_in_background), а все лёгкие применяются.
+    """
+    conn = connect(db_path)
+    try:
+        for migration in pending_migrations(conn):
+            if migration.heavy and not include_heavy:
+                continue
+            _apply(conn, migration)
+        return current_version(conn)
+    finally:
+        conn.close()
+
+
+def migrate_in_background(db_path: Optional[str] = None) -> Optional[threading.Thread]:
+    """Запускает оставшиеся (тяжёлые) миграции в фоновом потоке"""
+    db_path = db_path or tenants.path(DB_PATH)
+    conn = connect(db_path)
+    try:
+        if not pending_migrations(conn):
+            return None
+    finally:
+        conn.close()
+
+    def run() -> None:
+        try:
+            version = migrate(db_path)
+            logger.info(f"Фоновые миграции завершены, версия схемы: {version}")
+        except Exception as e:
+            logger.error(f"Ошибка фоновой миграции: {e}", exc_info=True)
+
+    # Миграции с данными (products.json) читают файлы магазина, который их запустил
+    context = contextvars.copy_context()
+    thread = threading.Thread(target=context.run, args=(run,), name="schema-migrations", daemon=True)
+    thread.start()
+    return thread
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Миграции схемы bot_database.db")
+    parser.add_argument("--db", default=DB_PATH, help="путь к базе SQLite")
+    parser.add_argument("--status", action="store_true", help="показать версию и ожидающие миграции")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    if args.status:
+        conn = connect(args.db)
+        try:
+            print(f"[INFO] Версия схемы: {current_version(conn)}")
+            for m in pending_migrations(conn):
+                print(f"  ожидает: {m.version} {m.description}{' (тяжёлая)' if m.heavy else ''}")
+        finally:
+            conn.close()
+        return
+    print(f"[SUCCESS] Версия схемы: {migrate(args.db)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+# outbound.py - Централизованная очередь исходящих запросов к Bot API
+import asyncio
+import heapq
+import itertools
+import logging
+from datetime import timedelta
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Union
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+from telegram.request import BaseRequest, RequestData
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты запросов (меньше — важнее)
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+# Приоритеты по умолчанию для методов Bot API
+ENDPOINT_PRIORITIES = {
+    "answerCallbackQuery": PRIORITY_HIGH,
+    "answerPreCheckoutQuery": PRIORITY_HIGH,
+    "sendInvoice": PRIORITY_HIGH,
+    "deleteMessage": PRIORITY_LOW,
+}
+
+# Лимиты чата и бота расходуют только новые сообщения. Ответы на запросы,
+# редактирование и удаление сообщений идут через ту же очередь (порядок в
+# чате, приоритеты, пауза после RetryAfter), но токенов не тратят
+CHAT_MESSAGE_ENDPOINTS = {"copyMessage", "copyMessages", "forwardMessage", "forwardMessages"}
+
+
+def is_chat_message(endpoint: str) -> bool:
+    return endpoint.startswith("send") or endpoint in CHAT_MESSAGE_ENDPOINTS
+
+# Методы, которые можно отбросить при перегрузке вместо ошибки
+DROPPABLE_ENDPOINTS = {"deleteMessage"}
+
+# Лимиты Telegram: ~30 сообщений в секунду на бота,
+# ~1 сообщение в секунду в личный чат и ~20 в минуту в группу.
+# Запас личного чата вмещает сценарий меню → инвойс → чек без ожидания
+GLOBAL_RATE = 30.0
+PRIVATE_CHAT_RATE = 1.0
+PRIVATE_CHAT_BURST = 8
+GROUP_CHAT_RATE = 20 / 60
+GROUP_CHAT_BURST = 5
+
+
+class TokenBucket:
+    """Token bucket: rate токенов в секунду, не более capacity"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def _refill(self, now: float) -> None:
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Сколько секунд осталось до появления токена"""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self) -> None:
+        self.tokens -= 1
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class _ChatState:
+    """Очередь и лимит одного чата"""
+
+    __slots__ = ("lock", "bucket", "last_used")
+
+    def __init__(self, bucket: TokenBucket, now: float):
+        self.lock = asyncio.Lock()
+        self.bucket = bucket
+        self.last_used = now
+
+
+def _retry_seconds(error: RetryAfter) -> float:
+    retry_after = error.retry_after
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+class FloodControlLimiter(BaseRateLimiter[int]):
+    """
+    Планировщик всех исходящих запросов бота.
+
+    - запросы одного чата (включая редактирование и удаление) выполняются строго по очереди;
+    - новые сообщения ограничены token bucket чата и общим для бота;
+    - ответы, редактирование и удаление проходят общую очередь, но токенов не расходуют;
+    - из общей очереди первыми уходят запросы с более высоким приоритетом;
+    - при RetryAfter отправка приостанавливается для всего бота и запрос повторяется;
+    - при перегрузке необязательные запросы (удаление сообщений) отбрасываются.
+
+    Приоритет можно передать явно: bot.send_message(..., rate_limit_args=PRIORITY_LOW)
+    """
+
+    def __init__(
+        self,
+        global_rate: float = GLOBAL_RATE,
+        max_retries: int = 3,
+        max_pending: int = 500,
+    ):
+        self.global_rate = global_rate
+        self.max_retries = max_retries
+        self.max_pending = max_pending
+
+        self._heap: List[Any] = []
+        self._seq = itertools.count()
+        self._chats: Dict[int, _ChatState] = {}
+        self._global: Optional[TokenBucket] = None
+        self._paused_until = 0.0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._dropped = 0
+
+    # ---------- ЖИЗНЕННЫЙ ЦИКЛ ----------
+    async def initialize(self) -> None:
+        if self._dispatcher and not self._dispatcher.done():
+            return
+        loop = asyncio.get_running_loop()
+        self._global = TokenBucket(self.global_rate, self.global_rate, loop.time())
+        self._wakeup = asyncio.Event()
+        self._dispatcher = loop.create_task(self._dispatch_loop())
+
+    async def shutdown(self) -> None:
+        if self._dispatcher:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+            self._dispatcher = None
+        for _, _, _, fut in self._heap:
+            if not fut.done():
+                fut.cancel()
+        self._heap.clear()
+        self._chats.clear()
+
+    @property
+    def pending(self) -> int:
+        """Количество запросов, ожидающих отправки"""
+        return len(self._heap)
+
+    # ---------- ДИСПЕТЧЕР ----------
+    async def _dispatch_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._wakeup.wait()
+            while self._heap:
+                now = loop.time()
+                consume = self._heap[0][2]
+                wait = self._paused_until - now
+                if consume:
+                    wait = max(wait, self._global.delay(now))
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                    continue
+
+                _, _, _, fut = heapq.heappop(self._heap)
+                if fut.done():
+                    # Запрос отменён, пока стоял в очереди
+                    continue
+                if consume:
+                    self._global.consume()
+                fut.set_result(None)
+            self._wakeup.clear()
+            self._prune_chats(loop.time())
+
+    async def _acquire_global(self, priority: int, consume: bool) -> None:
+        """Ждёт своей очереди в общем потоке запросов бота (consume — тратит токен лимита бота)"""
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (priority, next(self._seq), consume, fut))
+        self._wakeup.set()
+        await fut
+
+    def _chat_state(self, chat_id: int, now: float) -> _ChatState:
+        state = self._chats.get(chat_id)
+        if state is None:
+            if chat_id < 0:
+                bucket = TokenBucket(GROUP_CHAT_RATE, GROUP_CHAT_BURST, now)
+            else:
+                bucket = TokenBucket(PRIVATE_CHAT_RATE, PRIVATE_CHAT_BURST, now)
+            state = _ChatState(bucket, now)
+            self._chats[chat_id] = state
+        state.last_used = now
+        return state
+
+    def _prune_chats(self, now: float) -> None:
+        """Удаляет состояния чатов, которые давно простаивают"""
+        if len(self._chats) < 1000:
+            return
+        idle = [
+            chat_id for chat_id, state in self._chats.items()
+            if not state.lock.locked() and now - state.last_used > 60 and state.bucket.is_full(now)
+        ]
+        for chat_id in idle:
+            self._chats.pop(chat_id, None)
+
+    # ---------- ОБРАБОТКА ЗАПРОСА ----------
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Union[bool, Dict[str, Any], List[Dict[str, Any]]]]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[int],
+    ) -> Union[bool, Dict[str, Any], List[Dict[str, Any]]]:
+        if self._dispatcher is None:
+            await self.initialize()
+
+        priority = rate_limit_args if rate_limit_args is not None else ENDPOINT_PRIORITIES.get(endpoint, PRIORITY_NORMAL)
+
+        # Плавная деградация: при перегрузке не копим необязательные запросы
+        if endpoint in DROPPABLE_ENDPOINTS and len(self._heap) >= self.max_pending:
+            self._dropped += 1
+            logger.warning(f"Очередь отправки перегружена ({len(self._heap)}), {endpoint} пропущен")
+            return False
+
+        chat_id = data.get("chat_id")
+        if not isinstance(chat_id, int):
+            return await self._send(callback, args, kwargs, endpoint, priority)
+
+        loop = asyncio.get_running_loop()
+        state = self._chat_state(chat_id, loop.time())
+        async with state.lock:
+            if is_chat_message(endpoint):
+                delay = state.bucket.delay(loop.time())
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                state.bucket.consume()
+            try:
+                return await self._send(callback, args, kwargs, endpoint, priority)
+            finally:
+                state.last_used = loop.time()
+
+    async def _send(self, callback, args, kwargs, endpoint: str, priority: int):
+        loop = asyncio.get_running_loop()
+        consume = is_chat_message(endpoint)
+        for attempt in range(self.max_retries + 1):
+            await self._acquire_global(priority, consume)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt >= self.max_retries:
+                    raise
+                retry_after = _retry_seconds(e)
+                # Флуд-контроль Telegram действует на весь бот — ставим на паузу всю очередь
+                self._paused_until = max(self._paused_until, loop.time() + retry_after)
+                logger.warning(
+                    f"Флуд-контроль на {endpoint}: пауза {retry_after:.1f} с "
+                    f"(попытка {attempt + 1}/{self.max_retries})"
+                )
+                await asyncio.sleep(retry_after)
+
+
+class SharedRequest(BaseRequest):
+    """
+    Один HTTP-клиент (пул соединений) на несколько ботов процесса.
+    Клиент открывается первым initialize и закрывается последним shutdown.
+    Лимиты Telegram действуют на каждого бота отдельно, поэтому
+    FloodControlLimiter у каждого приложения свой
+    """
+
+    def __init__(self, request: BaseRequest):
+        self._request = request
+        self._users = 0
+        self._lock = asyncio.Lock()
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return self._request.read_timeout
+
+    async def initialize(self) -> None:
+        async with self._lock:
+            if self._users == 0:
+                await self._request.initialize()
+            self._users += 1
+
+    async def shutdown(self) -> None:
+        async with self._lock:
+            if self._users == 0:
+                return
+            self._users -= 1
+            if self._users == 0:
+                await self._request.shutdown()
+
+    async def do_request(self, url: str, method: str, request_data: Optional[RequestData] = None,
+                         read_timeout=BaseRequest.DEFAULT_NONE, write_timeout=BaseRequest.DEFAULT_NONE,
+                         connect_timeout=BaseRequest.DEFAULT_NONE, pool_timeout=BaseRequest.DEFAULT_NONE):
+        return await self._request.do_request(
+            url, method, request_data,
+            read_timeout=read_timeout, write_timeout=write_timeout,
+            connect_timeout=connect_timeout, pool_timeout=pool_timeout,
+        )
@@ -7,11 +7,15 @@ import logging
 from typing import Dict, Any, Optional, List
 from uuid import uuid4
 
-from yookassa import Configuration, Payment
-from yookassa.domain.request import PaymentRequest
 from telegram import LabeledPrice
 from telegram.ext import ContextTypes
 
+import job_store
+import tenants
+from metrics import timed, timer
+from process_lock import JSON_LOCK
+from payments_archive import HOT_LIMIT, archive_payments, find_archived_payment
+
 from data_tools import (
     YookassaPayment, Product, YOOKASSA_SHOP_ID, YOOKASSA_SECRET_KEY,
     YOOKASSA_PAYMENTS_FILE, YOOKASSA_WEBHOOK_SECRET, load_products, 
@@ -19,67 +23,73 @@ from data_tools import (
     check_rate_limit  # ← ТОЛЬКО ЭТО ОСТАВИТЬ
 )
 
-# Настройка ЮКассы - только если ключи есть
-if YOOKASSA_SHOP_ID and YOOKASSA_SECRET_KEY:
-    Configuration.account_id = YOOKASSA_SHOP_ID
-    Configuration.secret_key = YOOKASSA_SECRET_KEY
-else:
+if not YOOKASSA_SHOP_ID or not YOOKASSA_SECRET_KEY:
     logger.warning("Ключи ЮКассы не настроены. Оплата через ЮКассу недоступна.")
 
+# Через сколько секунд неоплаченный инвойс Stars удаляется из чата
+INVOICE_TTL = int(os.getenv("INVOICE_TTL", "3600"))
+
+_YOOKASSA_SDK = None
+
+
+def _yookassa():
+    """
+    Импортирует и настраивает SDK ЮКассы при первом обращении.
+    Возвращает (Payment, PaymentRequest).
+    """
+    global _YOOKASSA_SDK
+    if _YOOKASSA_SDK is None:
+        from yookassa import Configuration, Payment
+        from yookassa.domain.request import PaymentRequest
+        Configuration.account_id = YOOKASSA_SHOP_ID
+        Configuration.secret_key = YOOKASSA_SECRET_KEY
+        _YOOKASSA_SDK = (Payment, PaymentRequest)
+    return _YOOKASSA_SDK
+
 # Секретный ключ для хэширования payload инвойсов Telegram Stars
 # Используем комбинацию токена бота и специального секрета для большей безопасности
 STARS_PAYLOAD_SECRET = os.getenv("STARS_PAYLOAD_SECRET", "")
 if not STARS_PAYLOAD_SECRET:
     # Если нет специального секрета, используем токен бота, но это менее безопасно
-    from data_tools import BOT_TOKEN
-    STARS_PAYLOAD_SECRET = BOT_TOKEN
     logger.warning("STARS_PAYLOAD_SECRET не установлен. Используется BOT_TOKEN.")
 
-    # ИСПРАВЛЕНИЕ: функция для работы со словарями вместо объектов
-def get_product_data(product):
-    """Получает данные из товара, независимо от формата (объект или словарь)"""
-    if isinstance(product, dict):
-        return {
-            'id': product.get('id'),
-            'title': product.get('title', product.get('name', 'Товар')),
-            'price_rub': product.get('price_rub', product.get('price', 0)),
-            'price_stars': product.get('price_stars', 0),
-            'days': product.get('days', 0),
-            'description': product.get('description', ''),
-            'deliver_text': product.get('deliver_text', ''),
-            'deliver_url': product.get('deliver_url', '')
-        }
-    else:
-        # Если это объект (старый формат)
-        return {
-            'id': getattr(product, 'id', None),
-            'title': getattr(product, 'title', getattr(product, 'name', 'Товар')),
-            'price_rub': getattr(product, 'price_rub', getattr(product, 'price', 0)),
-            'price_stars': getattr(product, 'price_stars', 0),
-            'days': getattr(product, 'days', 0),
-            'description': getattr(product, 'description', ''),
-            'deliver_text': getattr(product, 'deliver_text', ''),
-            'deliver_url': getattr(product, 'deliver_url', '')
-        }
+
+def _payload_secret() -> str:
+    """Секрет подписи payload: общий из окружения или токен текущего магазина"""
+    return STARS_PAYLOAD_SECRET or tenants.current().token
+
 
 # ---------- ФУНКЦИИ ЮКАССЫ ----------
+# Чтение-изменение-запись yookassa_payments.json. Функции ЮКассы вызываются из
+# asyncio.to_thread параллельно для разных пользователей, а файл общий для
+# всех рабочих процессов, поэтому изменения файла идут под блокировкой
+# process_lock (запросы к API ЮКассы выполняются вне её)
+_payments_lock = JSON_LOCK
+# Больший файл платежей не загружается (load_yookassa_payments возвращает {})
+MAX_PAYMENTS_FILE_BYTES = 10 * 1024 * 1024
+# Версия metadata.hash: хэши без версии зависели от времени создания
+PAYMENT_HASH_VERSION = 2
+
+
+@timed("json")
 def load_yookassa_payments() -> Dict[str, Dict[str, Any]]:
     """Загружает платежи ЮКассы с проверкой целостности данных"""
-    if not os.path.exists(YOOKASSA_PAYMENTS_FILE):
+    path = tenants.path(YOOKASSA_PAYMENTS_FILE)
+    if not os.path.exists(path):
         return {}
     
     try:
-        # Проверяем размер файла (не более 10MB)
-        if os.path.getsize(YOOKASSA_PAYMENTS_FILE) > 10 * 1024 * 1024:
-            logger.error(f"Файл платежей ЮКассы слишком большой: {YOOKASSA_PAYMENTS_FILE}")
+        # Проверяем размер файла
+        if os.path.getsize(path) > MAX_PAYMENTS_FILE_BYTES:
+            logger.error(f"Файл платежей ЮКассы слишком большой: {path}")
             return {}
             
-        with open(YOOKASSA_PAYMENTS_FILE, "r", encoding="utf-8") as f:
+        with open(path, "r", encoding="utf-8") as f:
             data = json.load(f)
         
         # Проверяем структуру данных
         if not isinstance(data, dict):
-            logger.error(f"Некорректный формат файла платежей: {YOOKASSA_PAYMENTS_FILE}")
+            logger.error(f"Некорректный формат файла платежей: {path}")
             return {}
             
         return data
@@ -87,9 +97,9 @@ def load_yookassa_payments() -> Dict[str, Dict[str, Any]]:
     except json.JSONDecodeError as e:
         logger.error(f"Ошибка JSON в файле платежей ЮКассы: {e}")
         # Создаем резервную копию поврежденного файла
-        backup_name = f"{YOOKASSA_PAYMENTS_FILE}.backup.{int(time.time())}"
+        backup_name = f"{path}.backup.{int(time.time())}"
         try:
-            os.rename(YOOKASSA_PAYMENTS_FILE, backup_name)
+            os.rename(path, backup_name)
             logger.info(f"Создана резервная копия поврежденного файла: {backup_name}")
         except:
             pass
@@ -99,6 +109,7 @@ def load_yookassa_payments() -> Dict[str, Dict[str, Any]]:
         return {}
 
 
+@timed("json")
 def save_yookassa_payments(payments: Dict[str, Dict[str, Any]]) -> None:
     """Сохраняет платежи ЮКассы с атомарной записью"""
     try:
@@ -107,19 +118,20 @@ def save_yookassa_payments(payments: Dict[str, Dict[str, Any]]) -> None:
             logger.error("Попытка сохранить некорректные данные платежей")
             return
             
-        # Ограничиваем размер данных (примерно 10000 платежей)
-        if len(payments) > 10000:
-            logger.warning(f"Слишком много платежей в памяти: {len(payments)}")
-            # Оставляем только последние 5000 платежей
-            sorted_items = sorted(payments.items(), key=lambda x: x[1].get('created_at', 0))
-            payments = dict(sorted_items[-5000:])
-        
-        tmp = f"{YOOKASSA_PAYMENTS_FILE}.{int(time.time())}.tmp"
+        # Горячее хранилище держим небольшим: старые завершённые платежи уходят в архив
+        if len(payments) > HOT_LIMIT:
+            try:
+                archive_payments(payments)
+            except Exception as e:
+                logger.error(f"Ошибка архивации платежей ЮКассы: {e}")
+        
+        path = tenants.path(YOOKASSA_PAYMENTS_FILE)
+        tmp = f"{path}.{int(time.time())}.tmp"
         with open(tmp, "w", encoding="utf-8") as f:
             json.dump(payments, f, ensure_ascii=False, indent=2, default=str)
         
         # Атомарная замена файла
-        os.replace(tmp, YOOKASSA_PAYMENTS_FILE)
+        os.replace(tmp, path)
         
     except Exception as e:
         logger.error(f"Ошибка сохранения платежей ЮКассы: {e}")
@@ -158,6 +170,7 @@ def create_yookassa_payment(user_id: int, product: Product, message_id: int = No
         description = f"Покупка товара: {product.title[:100]}"
         
         # Создаем защищенный запрос на платеж
+        Payment, PaymentRequest = _yookassa()
         payment_request = PaymentRequest(
             amount={
                 "value": f"{amount_rub:.2f}",
@@ -179,7 +192,8 @@ def create_yookassa_payment(user_id: int, product: Product, message_id: int = No
         )
         
         # Создаем платеж через API ЮКассы
-        payment_response = Payment.create(payment_request, idempotence_key)
+        with timer("yookassa", "create"):
+            payment_response = Payment.create(payment_request, idempotence_key)
         
         # Валидируем ответ от ЮКассы
         if not payment_response or not hasattr(payment_response, 'id'):
@@ -200,37 +214,39 @@ def create_yookassa_payment(user_id: int, product: Product, message_id: int = No
         )
         
         # Сохраняем в файл с дополнительной проверкой
-        payments = load_yookassa_payments()
-        
-        # Проверяем, не существует ли уже такой платеж
-        if payment.payment_id in payments:
-            logger.warning(f"Платеж {payment.payment_id} уже существует")
-            # Проверяем, не попытка ли это повторного использования
-            existing_payment = payments[payment.payment_id]
-            if existing_payment.get('user_id') != user_id:
-                logger.error(f"Попытка переиспользования платежа {payment.payment_id} другим пользователем")
-                return None
-        
-        payments[payment.payment_id] = {
-            "payment_id": payment.payment_id,
-            "user_id": payment.user_id,
-            "product_id": payment.product_id,
-            "amount": payment.amount,
-            "status": payment.status,
-            "created_at": payment.created_at,
-            "payment_url": payment.payment_url,
-            "message_id": payment.message_id,
-            "description": payment.description,
-            "metadata": {
-                "user_id": str(user_id),
-                "product_id": product.id,
-                "bot_message_id": str(message_id),
-                "timestamp": str(int(time.time())),
-                "hash": generate_payment_hash(user_id, product.id, amount_rub)
+        with _payments_lock:
+            payments = load_yookassa_payments()
+            
+            # Проверяем, не существует ли уже такой платеж
+            if payment.payment_id in payments:
+                logger.warning(f"Платеж {payment.payment_id} уже существует")
+                # Проверяем, не попытка ли это повторного использования
+                existing_payment = payments[payment.payment_id]
+                if existing_payment.get('user_id') != user_id:
+                    logger.error(f"Попытка переиспользования платежа {payment.payment_id} другим пользователем")
+                    return None
+            
+            payments[payment.payment_id] = {
+                "payment_id": payment.payment_id,
+                "user_id": payment.user_id,
+                "product_id": payment.product_id,
+                "amount": payment.amount,
+                "status": payment.status,
+                "created_at": payment.created_at,
+                "payment_url": payment.payment_url,
+                "message_id": payment.message_id,
+                "description": payment.description,
+                "metadata": {
+                    "user_id": str(user_id),
+                    "product_id": product.id,
+                    "bot_message_id": str(message_id),
+                    "timestamp": str(int(time.time())),
+                    "hash": generate_payment_hash(user_id, product.id, amount_rub),
+                    "hash_version": PAYMENT_HASH_VERSION,
+                }
             }
-        }
-        
-        save_yookassa_payments(payments)
+            
+            save_yookassa_payments(payments)
         
         logger.info(f"Создан защищенный платеж ЮКассы: {payment.payment_id[:8]}... для user_id: {user_id}")
         return payment
@@ -247,29 +263,30 @@ def update_yookassa_payment_status(payment_id: str, status: str, metadata: dict
         return False
     
     try:
-        payments = load_yookassa_payments()
-        
-        if payment_id not in payments:
-            logger.error(f"Платеж {payment_id} не найден в локальной БД")
-            return False
-        
-        # Проверяем, что статус допустимый
-        valid_statuses = ["pending", "waiting_for_capture", "succeeded", "canceled"]
-        if status not in valid_statuses:
-            logger.error(f"Некорректный статус платежа: {status}")
-            return False
-        
-        payments[payment_id]["status"] = status
-        
-        # Обновляем метаданные если они предоставлены
-        if metadata:
-            # Фильтруем метаданные (только разрешенные ключи)
-            allowed_keys = {"user_id", "product_id", "bot_message_id", "timestamp", "hash"}
-            filtered_metadata = {k: v for k, v in metadata.items() if k in allowed_keys}
-            payments[payment_id].setdefault("metadata", {})
-            payments[payment_id]["metadata"].update(filtered_metadata)
-        
-        save_yookassa_payments(payments)
+        with _payments_lock:
+            payments = load_yookassa_payments()
+            
+            if payment_id not in payments:
+                logger.error(f"Платеж {payment_id} не найден в локальной БД")
+                return False
+            
+            # Проверяем, что статус допустимый
+            valid_statuses = ["pending", "waiting_for_capture", "succeeded", "canceled"]
+            if status not in valid_statuses:
+                logger.error(f"Некорректный статус платежа: {status}")
+                return False
+            
+            payments[payment_id]["status"] = status
+            
+            # Обновляем метаданные если они предоставлены
+            if metadata:
+                # Фильтруем метаданные (только разрешенные ключи)
+                allowed_keys = {"user_id", "product_id", "bot_message_id", "timestamp", "hash"}
+                filtered_metadata = {k: v for k, v in metadata.items() if k in allowed_keys}
+                payments[payment_id].setdefault("metadata", {})
+                payments[payment_id]["metadata"].update(filtered_metadata)
+            
+            save_yookassa_payments(payments)
         
         # Логируем изменение статуса
         logger.info(f"Статус платежа {payment_id[:8]}... обновлен на: {status}")
@@ -302,13 +319,19 @@ def get_yookassa_payment(payment_id: str) -> Optional[Dict[str, Any]]:
             # Проверяем актуальный статус через API (если есть ключи)
             if YOOKASSA_SHOP_ID and YOOKASSA_SECRET_KEY:
                 try:
-                    payment_response = Payment.find_one(payment_id)
+                    Payment, _ = _yookassa()
+                    with timer("yookassa", "find_one"):
+                        payment_response = Payment.find_one(payment_id)
                     
-                    # Обновляем статус если он изменился
+                    # Обновляем статус если он изменился (файл перечитывается под блокировкой:
+                    # пока шёл запрос к API, его могли изменить)
                     if payment_data.get("status") != payment_response.status:
                         payment_data["status"] = payment_response.status
-                        payments[payment_id] = payment_data
-                        save_yookassa_payments(payments)
+                        with _payments_lock:
+                            payments = load_yookassa_payments()
+                            if payment_id in payments:
+                                payments[payment_id]["status"] = payment_response.status
+                                save_yookassa_payments(payments)
                         logger.info(f"Обновлен статус платежа {payment_id[:8]}...: {payment_response.status}")
                     
                     # Добавляем данные из API к локальным данным
@@ -324,6 +347,11 @@ def get_yookassa_payment(payment_id: str) -> Optional[Dict[str, Any]]:
             
             return payment_data
         
+        # Завершённые платежи могли уйти в архив, их статус уже не меняется
+        archived = find_archived_payment(payment_id)
+        if archived and validate_payment_data(archived):
+            return archived
+        
         return None
         
     except Exception as e:
@@ -353,9 +381,10 @@ def validate_payment_data(payment_data: Dict[str, Any]) -> bool:
         if not isinstance(created_at, (int, float)) or created_at <= 0:
             return False
         
-        # Проверяем хэш если есть
-        metadata = payment_data.get("metadata", {})
-        if metadata.get("hash"):
+        # Проверяем хэш если есть. Хэши старых платежей включали время
+        # создания и проверены быть не могут
+        metadata = payment_data.get("metadata") or {}
+        if metadata.get("hash") and metadata.get("hash_version") == PAYMENT_HASH_VERSION:
             expected_hash = generate_payment_hash(
                 int(user_id),
                 str(payment_data["product_id"]),
@@ -398,7 +427,9 @@ def check_yookassa_payment_status(payment_id: str) -> Optional[str]:
         return None
     
     try:
-        payment_response = Payment.find_one(payment_id)
+        Payment, _ = _yookassa()
+        with timer("yookassa", "find_one"):
+            payment_response = Payment.find_one(payment_id)
         return payment_response.status
     except Exception as e:
         logger.error(f"Ошибка проверки статуса платежа {payment_id}: {e}")
@@ -416,14 +447,40 @@ async def delete_last_invoice(context: ContextTypes.DEFAULT_TYPE, user_id: int)
     try:
         await context.bot.delete_message(chat_id=chat_id, message_id=msg_id)
         LAST_INVOICE.pop(user_id, None)
+        await job_store.cancel(f"invoice:{user_id}")
     except Exception as e:
         logger.error(f"Ошибка удаления инвойса для user_id={user_id}: {e}")
 
 
+async def remember_invoice(user_id: int, chat_id: int, message_id: int) -> None:
+    """Запоминает инвойс и планирует его удаление через INVOICE_TTL секунд (переживает перезапуск)"""
+    LAST_INVOICE[user_id] = (chat_id, message_id)
+    await job_store.schedule(
+        "invoice_cleanup", f"invoice:{user_id}", int(time.time()) + INVOICE_TTL,
+        {"user_id": user_id, "chat_id": chat_id, "message_id": message_id},
+    )
+
+
+@job_store.handler("invoice_cleanup")
+async def invoice_cleanup_job(bot, payload: Dict[str, Any]) -> None:
+    """Отложенная задача: удаление неоплаченного инвойса"""
+    user_id, chat_id, message_id = payload["user_id"], payload["chat_id"], payload["message_id"]
+    if LAST_INVOICE.get(user_id) == (chat_id, message_id):
+        LAST_INVOICE.pop(user_id, None)
+    try:
+        await bot.delete_message(chat_id=chat_id, message_id=message_id)
+    except Exception as e:
+        # Инвойс уже оплачен или удалён пользователем
+        logger.info(f"Инвойс для user_id={user_id} не удалён: {e}")
+
+
 def generate_payment_hash(user_id: int, product_id: str, amount: float) -> str:
-    """Генерирует хэш для проверки целостности платежа"""
-    data = f"{user_id}:{product_id}:{amount}:{int(time.time())}"
-    return hashlib.sha256(f"{data}:{STARS_PAYLOAD_SECRET}".encode()).hexdigest()[:16]
+    """
+    Генерирует хэш для проверки целостности платежа. Зависит только от
+    полей платежа: тот же хэш получается при проверке сохранённой записи
+    """
+    data = f"{int(user_id)}:{product_id}:{float(amount):.2f}"
+    return hashlib.sha256(f"{data}:{_payload_secret()}".encode()).hexdigest()[:16]
 
 
 def create_stars_invoice_payload(user_id: int, product: Product) -> tuple:
@@ -443,7 +500,7 @@ def create_stars_invoice_payload(user_id: int, product: Product) -> tuple:
     
     # Генерируем HMAC-SHA256 хэш
     hash_obj = hmac.new(
-        key=STARS_PAYLOAD_SECRET.encode('utf-8'),
+        key=_payload_secret().encode('utf-8'),
         msg=data_string.encode('utf-8'),
         digestmod=hashlib.sha256
     )
@@ -499,19 +556,15 @@ def verify_stars_invoice_payload(payload: str, user_id: int) -> Optional[str]:
             logger.warning(f"Просроченный или неверный timestamp: {timestamp}, текущее: {current_time}")
             return None
         
-        # Извлекаем подпись
-        received_hash = params.pop('h')
-        
-        # Восстанавливаем исходную строку для проверки (сортировка для консистентности)
-        data_parts = []
-        for key in sorted(params.keys()):
-            if key != 'h':  # Уже извлекли
-                data_parts.append(f"{key}={params[key]}")
-        data_string = '&'.join(data_parts)
+        # Подписана строка до "&h=" в том виде, в каком её сформировал
+        # create_stars_invoice_payload (v, p, u, t, n — не по алфавиту).
+        # Подпись — весь хвост после "&h=", поэтому дописанные после неё
+        # параметры делают её неверной
+        data_string, _, received_hash = payload.rpartition("&h=")
         
         # Генерируем HMAC-SHA256 для проверки
         hash_obj = hmac.new(
-            key=STARS_PAYLOAD_SECRET.encode('utf-8'),
+            key=_payload_secret().encode('utf-8'),
             msg=data_string.encode('utf-8'),
             digestmod=hashlib.sha256
         )
@@ -0,0 +1,241 @@
+# payments_archive.py - Архив завершённых платежей ЮКассы
+#
+# Завершённые платежи старше порога переносятся из yookassa_payments.json
+# в неизменяемые сжатые сегменты по месяцам (archive/yookassa/YYYY-MM.NNN.jsonl.gz).
+# Сегмент после записи не меняется: каждый перенос создаёт новый сегмент.
+# index.json хранит список сегментов и соответствие payment_id → сегмент.
+# Разобранный индекс кэшируется в памяти до изменения файла (inode, размер,
+# mtime), поэтому поиск по id не перечитывает его.
+import gzip
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+import tenants
+from metrics import timed
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_DIR = os.path.join("archive", "yookassa")
+INDEX_FILE = "index.json"
+
+# Статусы, после которых платёж больше не меняется
+FINAL_STATUSES = {"succeeded", "canceled"}
+# Через сколько дней завершённый платёж уходит в архив
+ARCHIVE_AFTER_DAYS = int(os.getenv("YOOKASSA_ARCHIVE_AFTER_DAYS", "30"))
+# Архивация запускается при сохранении, если в горячем хранилище больше платежей
+HOT_LIMIT = int(os.getenv("YOOKASSA_HOT_LIMIT", "1000"))
+
+# Путь к index.json -> ((inode, размер, mtime в наносекундах), разобранный индекс)
+_index_cache: Dict[str, Tuple[Tuple[int, int, int], Dict[str, Any]]] = {}
+
+
+def archive_dir() -> str:
+    """Каталог архива текущего магазина"""
+    return tenants.path(ARCHIVE_DIR)
+
+
+def _index_path() -> str:
+    return os.path.join(archive_dir(), INDEX_FILE)
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _stamp(path: str) -> Tuple[int, int, int]:
+    st = os.stat(path)
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+def load_index() -> Dict[str, Any]:
+    """
+    Индекс архива: {"segments": {имя: {...}}, "ids": {payment_id: имя}}.
+    Возвращает общий кэшированный объект — изменять его нельзя
+    """
+    path = _index_path()
+    try:
+        stamp = _stamp(path)
+    except FileNotFoundError:
+        return {"segments": {}, "ids": {}}
+    cached = _index_cache.get(path)
+    if cached and cached[0] == stamp:
+        return cached[1]
+    index = _read_index()
+    _index_cache[path] = (stamp, index)
+    return index
+
+
+def _read_index() -> Dict[str, Any]:
+    """Индекс, прочитанный с диска (свой объект, можно изменять)"""
+    path = _index_path()
+    if not os.path.exists(path):
+        return {"segments": {}, "ids": {}}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+        index.setdefault("segments", {})
+        index.setdefault("ids", {})
+        return index
+    except (OSError, json.JSONDecodeError) as e:
+        logger.error(f"Индекс архива платежей повреждён, перестраиваем: {e}")
+        return rebuild_index()
+
+
+def _save_index(index: Dict[str, Any]) -> None:
+    data = json.dumps(index, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    path = _index_path()
+    _write_atomic(path, data)
+    _index_cache.pop(path, None)
+
+
+def _month_of(payment: Dict[str, Any]) -> str:
+    try:
+        return datetime.fromtimestamp(int(payment.get("created_at", 0))).strftime("%Y-%m")
+    except (TypeError, ValueError, OverflowError, OSError):
+        return "unknown"
+
+
+def _next_segment_name(month: str, index: Dict[str, Any]) -> str:
+    n = 1
+    while True:
+        name = f"{month}.{n:03d}.jsonl.gz"
+        if name not in index["segments"] and not os.path.exists(os.path.join(archive_dir(), name)):
+            return name
+        n += 1
+
+
+def is_archivable(payment: Dict[str, Any], now: Optional[float] = None, after_days: int = ARCHIVE_AFTER_DAYS) -> bool:
+    """Платёж завершён и старше порога"""
+    if payment.get("status") not in FINAL_STATUSES:
+        return False
+    now = time.time() if now is None else now
+    try:
+        created_at = float(payment.get("created_at", 0))
+    except (TypeError, ValueError):
+        return False
+    return now - created_at >= after_days * 86400
+
+
+@timed("archive")
+def archive_payments(payments: Dict[str, Dict[str, Any]], now: Optional[float] = None,
+                     after_days: int = ARCHIVE_AFTER_DAYS) -> int:
+    """
+    Переносит завершённые платежи старше after_days в архив и удаляет их из payments.
+    Возвращает число перенесённых платежей.
+
+    Порядок записи защищает от потерь: сначала сегмент, затем индекс, и только
+    после этого платежи удаляются из горячего хранилища.
+    """
+    by_month: Dict[str, List[Dict[str, Any]]] = {}
+    for payment_id, payment in payments.items():
+        if is_archivable(payment, now, after_days):
+            by_month.setdefault(_month_of(payment), []).append(payment)
+    if not by_month:
+        return 0
+
+    os.makedirs(archive_dir(), exist_ok=True)
+    index = _read_index()
+    moved = 0
+    for month, items in sorted(by_month.items()):
+        name = _next_segment_name(month, index)
+        lines = "".join(json.dumps(p, ensure_ascii=False, default=str) + "\n" for p in items)
+        _write_atomic(os.path.join(archive_dir(), name), gzip.compress(lines.encode("utf-8")))
+
+        index["segments"][name] = {
+            "month": month,
+            "count": len(items),
+            "created_at": int(time.time()),
+        }
+        for p in items:
+            index["ids"][p["payment_id"]] = name
+        moved += len(items)
+
+    _save_index(index)
+    for items in by_month.values():
+        for p in items:
+            payments.pop(p["payment_id"], None)
+
+    logger.info(f"В архив перенесено платежей ЮКассы: {moved}, сегментов: {len(by_month)}")
+    return moved
+
+
+@lru_cache(maxsize=4)
+def _read_segment(path: str) -> Dict[str, Dict[str, Any]]:
+    # Сегменты неизменяемы, поэтому их можно кэшировать без инвалидации
+    result: Dict[str, Dict[str, Any]] = {}
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                payment = json.loads(line)
+                result[payment["payment_id"]] = payment
+    return result
+
+
+@timed("archive")
+def find_archived_payment(payment_id: str) -> Optional[Dict[str, Any]]:
+    """Ищет платёж в архиве по id"""
+    name = load_index()["ids"].get(payment_id)
+    if not name:
+        return None
+    try:
+        payment = _read_segment(os.path.join(archive_dir(), name)).get(payment_id)
+    except (OSError, EOFError, json.JSONDecodeError) as e:
+        logger.error(f"Не удалось прочитать сегмент архива {name}: {e}")
+        return None
+    return dict(payment) if payment else None
+
+
+def iter_segment(name: str):
+    """Платежи одного сегмента"""
+    with gzip.open(os.path.join(archive_dir(), name), "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def iter_archived_payments():
+    """Все платежи из архива, сегмент за сегментом (для сверок и отчётов)"""
+    for name in sorted(load_index()["segments"]):
+        yield from iter_segment(name)
+
+
+def rebuild_index() -> Dict[str, Any]:
+    """Перестраивает индекс по сегментам на диске"""
+    index: Dict[str, Any] = {"segments": {}, "ids": {}}
+    if not os.path.isdir(archive_dir()):
+        return index
+    for name in sorted(os.listdir(archive_dir())):
+        if not name.endswith(".jsonl.gz"):
+            continue
+        count = 0
+        try:
+            with gzip.open(os.path.join(archive_dir(), name), "rt", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        index["ids"][json.loads(line)["payment_id"]] = name
+                        count += 1
+        except (OSError, EOFError, json.JSONDecodeError, KeyError) as e:
+            logger.error(f"Сегмент архива {name} повреждён и пропущен: {e}")
+            continue
+        index["segments"][name] = {
+            "month": name.split(".", 1)[0],
+            "count": count,
+            "created_at": int(os.path.getmtime(os.path.join(archive_dir(), name))),
+        }
+    _save_index(index)
+    return index
+
+
+def archive_stats() -> Dict[str, int]:
+    index = load_index()
+    return {"segments": len(index["segments"]), "payments": len(index["ids"])}
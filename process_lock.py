@@ -0,0 +1,63 @@
+# process_lock.py - Блокировки, общие для всех рабочих процессов бота
+#
+# Несколько процессов бота работают с одними и теми же JSON-файлами
+# (db.json, yookassa_payments.json) и одним файлом логов. Чтение-изменение-
+# запись этих файлов и ротация логов выполняются под ProcessLock, иначе
+# процессы затирают изменения друг друга.
+#
+# Блокировка — транзакция BEGIN IMMEDIATE в пустом файле SQLite: работает
+# одинаково в Linux и Windows, снимается сама, если процесс упал. Внутри
+# процесса блокировка реентерабельна и разделяет потоки.
+import os
+import sqlite3
+import threading
+
+# Блокировка JSON-хранилищ всех магазинов
+JSON_LOCK_FILE = os.getenv("JSON_LOCK_FILE", "json_write.lock")
+LOCK_TIMEOUT = 30.0
+
+
+class ProcessLock:
+    """Реентерабельная блокировка между процессами и потоками"""
+
+    def __init__(self, path: str, timeout: float = LOCK_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._conn = None
+
+    def _begin(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    def __enter__(self) -> "ProcessLock":
+        self._lock.acquire()
+        if self._depth == 0:
+            try:
+                self._conn = self._begin()
+            except Exception:
+                self._lock.release()
+                raise
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc) -> None:
+        try:
+            self._depth -= 1
+            if self._depth == 0:
+                conn, self._conn = self._conn, None
+                try:
+                    conn.execute("ROLLBACK")
+                finally:
+                    conn.close()
+        finally:
+            self._lock.release()
+
+
+JSON_LOCK = ProcessLock(JSON_LOCK_FILE)
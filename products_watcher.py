@@ -0,0 +1,204 @@
+# products_watcher.py - Подхват правок products.json без перезапуска
+#
+# products.json остаётся редактируемым источником товаров. Файл разбирается
+# только после изменения: изменения ловит inotify (если установлен пакет
+# inotify_simple), иначе задача JobQueue раз в PRODUCTS_POLL_INTERVAL секунд
+# сравнивает inode, размер и mtime файла.
+#
+# Новый список сравнивается по id с прошлым содержимым файла и с каталогом.
+# В таблицу products пишутся только изменённые строки, затем
+# catalog.apply_changes обновляет снимок каталога и кэши экранов.
+# Удаляются только товары, которые убрали из файла: товары, добавленные
+# через админ-панель и в файле не упомянутые, не трогаются.
+#
+# При запуске файл сравнивается с каталогом в SQLite, если он изменился
+# с прошлой синхронизации: правки, сделанные, пока бот был остановлен, тоже
+# применяются. Хэш файла и список его id после каждой синхронизации хранятся
+# в таблице settings. Если файл не менялся, товары, изменённые через
+# админ-панель, не откатываются к содержимому файла.
+import asyncio
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+import catalog
+import tenants
+from data_tools import PRODUCTS_FILE, Product, read_products_file
+from database_adapter import db
+
+logger = logging.getLogger(__name__)
+
+PRODUCTS_POLL_INTERVAL = float(os.getenv("PRODUCTS_POLL_INTERVAL", "5"))
+# Ключ состояния файла в таблице settings
+STATE_KEY = "products_file"
+
+# (inode, размер, mtime в наносекундах)
+Signature = Tuple[int, int, int]
+
+
+def diff_products(previous: Dict[str, Optional[Product]], current: Dict[str, Product],
+                  cat: catalog.Catalog) -> Tuple[List[Product], List[str]]:
+    """Изменённые в файле товары, которые отличаются от каталога, и удалённые из файла id"""
+    upserted = [p for pid, p in current.items() if previous.get(pid) != p and cat.get(pid) != p]
+    deleted = [pid for pid in previous if pid not in current and cat.get(pid) is not None]
+    return upserted, deleted
+
+
+class ProductsFileWatcher:
+    """Следит за products.json и переносит изменения в хранилище товаров"""
+
+    def __init__(self, path: str = PRODUCTS_FILE):
+        self.path = path
+        self._signature: Optional[Signature] = None
+        # Содержимое файла при прошлой проверке (None — ещё не запоминали)
+        self._seen: Optional[Dict[str, Product]] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def inotify_active(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def _stat(self) -> Optional[Signature]:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def _read(self) -> Tuple[Dict[str, Product], str]:
+        """Товары файла и sha256 его содержимого"""
+        with open(self.path, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        return {p.id: p for p in read_products_file(self.path)}, digest
+
+    def _load_state(self) -> Optional[dict]:
+        try:
+            raw = db.get_setting(STATE_KEY)
+        except sqlite3.Error as e:
+            logger.warning(f"Состояние {self.path} не прочитано: {e}")
+            return None
+        return json.loads(raw) if raw else None
+
+    def _save_state(self, digest: str, products: Dict[str, Product]) -> None:
+        try:
+            db.set_setting(STATE_KEY, json.dumps({"sha256": digest, "ids": sorted(products)}))
+        except sqlite3.Error as e:
+            logger.warning(f"Состояние {self.path} не сохранено: {e}")
+
+    def _apply(self, upserted: List[Product], deleted: List[str]) -> bool:
+        if not upserted and not deleted:
+            return False
+        db.save_products(upserted, delete_ids=deleted)
+        catalog.apply_changes(upserted, deleted)
+        logger.info(f"Товары из {self.path}: изменено {len(upserted)}, удалено {len(deleted)}")
+        return True
+
+    def _sync(self) -> bool:
+        """
+        Первая проверка: файл сравнивается с каталогом в SQLite. Удаляются
+        товары, которые были в файле при прошлой синхронизации, а теперь нет
+        """
+        self._signature = self._stat()
+        self._seen = {}
+        if self._signature is None:
+            return False
+        try:
+            current, digest = self._read()
+        except (OSError, ValueError, TypeError) as e:
+            logger.warning(f"{self.path} не прочитан: {e}")
+            return False
+        self._seen = current
+        state = self._load_state() or {}
+        if state.get("sha256") == digest:
+            return False
+        previous = {pid: None for pid in state.get("ids", ())}
+        upserted, deleted = diff_products(previous, current, catalog.get_catalog())
+        changed = self._apply(upserted, deleted)
+        self._save_state(digest, current)
+        return changed
+
+    def start(self) -> None:
+        """Синхронизирует файл с каталогом и, если доступен inotify, запускает поток"""
+        with self._lock:
+            self._sync()
+        if inotify_simple is not None and self._thread is None:
+            # Поток работает в контексте магазина, которому принадлежит файл
+            context = contextvars.copy_context()
+            self._thread = threading.Thread(target=context.run, args=(self._watch,),
+                                            name=f"products-watcher-{tenants.current().name}", daemon=True)
+            self._thread.start()
+            logger.info(f"Изменения {self.path} отслеживаются через inotify")
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def check(self) -> bool:
+        """Проверяет файл и применяет изменения. True, если каталог изменился"""
+        with self._lock:
+            if self._seen is None:
+                return self._sync()
+            signature = self._stat()
+            if signature == self._signature:
+                return False
+            # Сигнатура запоминается и при ошибке разбора: повреждённый файл
+            # читается снова только после следующего изменения
+            self._signature = signature
+            if signature is None:
+                # Файл удалён: товары в базе остаются как есть
+                return False
+            try:
+                current, digest = self._read()
+            except (OSError, ValueError, TypeError) as e:
+                logger.warning(f"{self.path} изменён, но не разобран: {e}")
+                return False
+            previous, self._seen = self._seen, current
+            upserted, deleted = diff_products(previous, current, catalog.get_catalog())
+            changed = self._apply(upserted, deleted)
+            self._save_state(digest, current)
+            return changed
+
+    def _watch(self) -> None:
+        flags = inotify_simple.flags
+        name = os.path.basename(self.path)
+        inotify = inotify_simple.INotify()
+        try:
+            # Наблюдаем за каталогом: редакторы часто заменяют файл целиком (rename)
+            inotify.add_watch(os.path.dirname(os.path.abspath(self.path)),
+                              flags.CLOSE_WRITE | flags.MOVED_TO | flags.DELETE)
+            while not self._stop.is_set():
+                events = inotify.read(timeout=1000)
+                if any(event.name == name for event in events):
+                    try:
+                        self.check()
+                    except Exception as e:
+                        logger.error(f"Ошибка применения изменений {self.path}: {e}", exc_info=True)
+        except Exception as e:
+            logger.error(f"inotify для {self.path} остановлен: {e}", exc_info=True)
+        finally:
+            inotify.close()
+
+
+# У каждого магазина свой products.json
+PRODUCTS_WATCHER = tenants.TenantScoped(lambda tenant: ProductsFileWatcher(tenant.path(PRODUCTS_FILE)))
+
+
+async def watch_job(context) -> None:
+    """Задача JobQueue: опрос products.json, когда inotify недоступен"""
+    if PRODUCTS_WATCHER.inotify_active:
+        return
+    try:
+        await asyncio.to_thread(PRODUCTS_WATCHER.check)
+    except Exception as e:
+        logger.error(f"Ошибка применения изменений products.json: {e}", exc_info=True)
@@ -0,0 +1,137 @@
+# render_cache.py - Готовые к отправке экраны каталога
+#
+# Текст (уже экранированный для HTML) и клавиатуры каталога, карточек товаров
+# и выбора способа оплаты строятся один раз на версию каталога. Обработчики
+# берут готовый Screen по id товара и отправляют его как есть. Каталог
+# разбит на страницы по CATALOG_PAGE_SIZE, все страницы строятся заранее.
+# Раскладка страниц выбора товара в админке тоже строится на версию каталога,
+# CSRF-токен подставляется при сборке клавиатуры.
+# При перезагрузке каталога (catalog.reload_catalog) кэш пересобирается.
+# Экраны хранятся отдельно для каждого магазина (tenants.py).
+import logging
+import threading
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from telegram import InlineKeyboardMarkup
+
+import catalog
+import tenants
+from data_tools import Product, sanitize_input
+from keyboards import (
+    CATALOG_PAGE_SIZE, back_to_product_kb, catalog_kb, clamp_page, edit_select_layout,
+    edit_select_product_kb, home_only_kb, page_count, payment_methods_kb, product_kb,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class Screen(NamedTuple):
+    text: str
+    reply_markup: InlineKeyboardMarkup
+
+
+class Rendered:
+    """Экраны одной версии каталога"""
+
+    __slots__ = ("version", "pages", "products", "payments", "back", "admin_pages")
+
+    def __init__(self, cat: catalog.Catalog):
+        self.version = cat.version
+        self.pages = render_catalog_pages(cat)
+        self.admin_pages = edit_select_layout(cat.products)
+        self.products: Dict[str, Screen] = {}
+        self.payments: Dict[str, Screen] = {}
+        self.back: Dict[str, InlineKeyboardMarkup] = {}
+        for p in cat.products:
+            self.products[p.id] = render_product(p)
+            self.payments[p.id] = render_payment_methods(p)
+            self.back[p.id] = back_to_product_kb(p.id)
+
+
+def render_catalog_pages(cat: catalog.Catalog, page_size: int = CATALOG_PAGE_SIZE) -> Tuple[Screen, ...]:
+    if not cat.products:
+        return (Screen(
+            "📦 <b>Каталог пуст</b>\n\n"
+            "Товары скоро появятся!",
+            home_only_kb(),
+        ),)
+    pages = page_count(len(cat.products), page_size)
+    screens = []
+    for page in range(pages):
+        text = "📦 <b>Выбор подписки</b>\n\nВыберите вариант подписки:"
+        if pages > 1:
+            text += f"\n\n<i>Страница {page + 1} из {pages}</i>"
+        screens.append(Screen(text, catalog_kb(cat.products, page, page_size)))
+    return tuple(screens)
+
+
+def render_product(p: Product) -> Screen:
+    text = (
+        f"<b>{sanitize_input(p.title, 100)}</b>\n\n"
+        f"{sanitize_input(p.description, 2000)}\n\n"
+        f"💳 <b>Цена:</b> {p.price_rub} руб.\n"
+        f"⭐ <b>Цена в звёздах:</b> {p.price_stars}\n"
+        f"📅 <b>Срок доступа:</b> {p.days} дней"
+    )
+    return Screen(text, product_kb(p.id))
+
+
+def render_payment_methods(p: Product) -> Screen:
+    text = (
+        f"<b>{sanitize_input(p.title, 100)}</b>\n\n"
+        f"{sanitize_input(p.description, 2000)}\n\n"
+        f"💳 <b>Цена:</b> {p.price_rub} руб.\n"
+        f"⭐ <b>Цена в звёздах:</b> {p.price_stars}\n\n"
+        "Выберите способ оплаты:"
+    )
+    return Screen(text, payment_methods_kb(p.id))
+
+
+# Имя магазина -> экраны текущей версии его каталога
+_rendered: Dict[str, Rendered] = {}
+_lock = threading.Lock()
+
+
+def _rebuild(cat: catalog.Catalog) -> Rendered:
+    name = tenants.current().name
+    with _lock:
+        current = _rendered.get(name)
+        if current is not None and current.version >= cat.version:
+            return current
+        rendered = _rendered[name] = Rendered(cat)
+    logger.info(f"Экраны каталога собраны: {len(cat)} товаров (версия {cat.version})")
+    return rendered
+
+
+def get_rendered() -> Rendered:
+    cat = catalog.get_catalog()
+    rendered = _rendered.get(tenants.current().name)
+    if rendered is None or rendered.version != cat.version:
+        rendered = _rebuild(cat)
+    return rendered
+
+
+def catalog_screen(page: int = 0) -> Screen:
+    pages = get_rendered().pages
+    return pages[clamp_page(page, len(pages), 1)]
+
+
+def product_screen(product_id: str) -> Optional[Screen]:
+    return get_rendered().products.get(product_id)
+
+
+def payment_methods_screen(product_id: str) -> Optional[Screen]:
+    return get_rendered().payments.get(product_id)
+
+
+def edit_select_markup(csrf_token: Optional[str], page: int = 0) -> InlineKeyboardMarkup:
+    """Страница выбора товара в админке с CSRF-токеном"""
+    return edit_select_product_kb(get_rendered().admin_pages, csrf_token, page)
+
+
+def back_to_product_markup(product_id: str) -> InlineKeyboardMarkup:
+    markup = get_rendered().back.get(product_id)
+    return markup if markup is not None else back_to_product_kb(product_id)
+
+
+catalog.add_listener(_rebuild)
@@ -0,0 +1,110 @@
+# router.py - Маршрутизация callback-кнопок и текстовых сообщений через таблицы
+#
+# callback_data имеет вид "namespace:action[:arg...]". Строка разбирается
+# один раз в Route, обработчик находится поиском в словаре по
+# (namespace, action), а если такого нет — по namespace целиком
+# (например, "prod:<id>"). Вместо цепочки CallbackQueryHandler с регулярными
+# выражениями в приложении регистрируется один обработчик.
+#
+# Текстовые сообщения так же идут одним обработчиком: ConversationRouter
+# смотрит активный режим пользователя в conversations.CONVERSATIONS.
+import logging
+from typing import Awaitable, Callable, Dict, NamedTuple, Optional, Set, Tuple
+
+from telegram import Update
+from telegram.ext import CallbackQueryHandler, ContextTypes, MessageHandler, filters
+
+from conversations import ConversationIndex
+
+logger = logging.getLogger(__name__)
+
+Callback = Callable[[Update, ContextTypes.DEFAULT_TYPE], Awaitable[None]]
+
+
+class Route(NamedTuple):
+    namespace: str
+    action: str
+    args: Tuple[str, ...]
+
+
+def parse_callback(data: str) -> Route:
+    """Разбирает callback_data: "admin:stats:token" -> Route("admin", "stats", ("token",))"""
+    parts = data.split(":")
+    return Route(parts[0], parts[1] if len(parts) > 1 else "", tuple(parts[2:]))
+
+
+class CallbackRouter:
+    """Таблица обработчиков callback-кнопок"""
+
+    def __init__(self):
+        self._actions: Dict[Tuple[str, str], Callback] = {}
+        self._namespaces: Dict[str, Callback] = {}
+
+    def add(self, namespace: str, callback: Callback, action: Optional[str] = None) -> None:
+        """Регистрирует обработчик действия или всего пространства имён"""
+        if action is None:
+            self._namespaces[namespace] = callback
+        else:
+            self._actions[(namespace, action)] = callback
+
+    def resolve(self, data: str) -> Optional[Callback]:
+        namespace, _, rest = data.partition(":")
+        if self._actions:
+            callback = self._actions.get((namespace, rest.partition(":")[0]))
+            if callback is not None:
+                return callback
+        return self._namespaces.get(namespace)
+
+    def namespaces(self) -> Set[str]:
+        """Пространства имён с обработчиками (для меток метрик)"""
+        return set(self._namespaces) | {namespace for namespace, _ in self._actions}
+
+    def matches(self, data: object) -> bool:
+        """Фильтр для CallbackQueryHandler: есть ли обработчик для callback_data"""
+        return isinstance(data, str) and self.resolve(data) is not None
+
+    async def dispatch(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        callback = self.resolve(update.callback_query.data)
+        if callback is None:
+            logger.warning(f"Нет обработчика для callback_data={update.callback_query.data!r}")
+            return
+        await callback(update, context)
+
+    def handler(self) -> CallbackQueryHandler:
+        """Один CallbackQueryHandler на все зарегистрированные маршруты"""
+        return CallbackQueryHandler(self.dispatch, pattern=self.matches)
+
+
+class _ActiveConversation(filters.MessageFilter):
+    """Пропускает только сообщения пользователей с активным режимом ввода"""
+
+    def __init__(self, router: "ConversationRouter"):
+        super().__init__(name="ActiveConversation")
+        self.router = router
+
+    def filter(self, message) -> bool:
+        user = message.from_user
+        return user is not None and self.router.index.active_flow(user.id) in self.router.flows
+
+
+class ConversationRouter:
+    """Текстовые сообщения: режим пользователя из индекса -> обработчик режима"""
+
+    def __init__(self, index: ConversationIndex):
+        self.index = index
+        self.flows: Dict[str, Callback] = {}
+
+    def add(self, flow: str, callback: Callback) -> None:
+        self.flows[flow] = callback
+
+    async def dispatch(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        user_id = update.effective_user.id
+        callback = self.flows.get(self.index.active_flow(user_id))
+        if callback is None:
+            return
+        self.index.touch(user_id)
+        await callback(update, context)
+
+    def handler(self) -> MessageHandler:
+        """Один MessageHandler на все режимы ввода текста"""
+        return MessageHandler(filters.TEXT & ~filters.COMMAND & _ActiveConversation(self), self.dispatch)
@@ -0,0 +1,96 @@
+# startup_profile.py - Профиль холодного старта бота
+#
+# Импортируется первым в bot.py: замеряет время импорта каждого пакета
+# (собственное время, без вложенных импортов), этапы запуска и время
+# до первого обработанного обновления.
+import builtins
+import logging
+import os
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_START = time.perf_counter()
+_original_import = builtins.__import__
+
+# Собственное время импорта по пакетам верхнего уровня
+IMPORT_TIMES: Dict[str, float] = {}
+# Этапы запуска: (название, секунд от старта)
+MARKS: List[Tuple[str, float]] = []
+FIRST_UPDATE_AT: Optional[float] = None
+
+_stack: List[float] = []
+
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    if level == 0 and name in sys.modules:
+        return _original_import(name, globals, locals, fromlist, level)
+
+    start = time.perf_counter()
+    _stack.append(0.0)
+    try:
+        return _original_import(name, globals, locals, fromlist, level)
+    finally:
+        elapsed = time.perf_counter() - start
+        nested = _stack.pop()
+        if _stack:
+            _stack[-1] += elapsed
+        if level and globals:
+            top = (globals.get("__package__") or globals.get("__name__") or name).split(".")[0]
+        else:
+            top = name.split(".")[0]
+        IMPORT_TIMES[top] = IMPORT_TIMES.get(top, 0.0) + (elapsed - nested)
+
+
+def start_import_timer() -> None:
+    """Начинает замер импортов"""
+    builtins.__import__ = _timed_import
+
+
+def stop_import_timer() -> None:
+    """Заканчивает замер импортов и отмечает этап"""
+    builtins.__import__ = _original_import
+    mark("imports")
+
+
+def mark(name: str) -> None:
+    """Отмечает завершение этапа запуска"""
+    MARKS.append((name, time.perf_counter() - _START))
+
+
+def first_update_pending() -> bool:
+    """Первое обновление ещё не обработано"""
+    return FIRST_UPDATE_AT is None
+
+
+def record_first_update() -> bool:
+    """Отмечает первое обработанное обновление. Возвращает True только в первый раз"""
+    global FIRST_UPDATE_AT
+    if FIRST_UPDATE_AT is not None:
+        return False
+    FIRST_UPDATE_AT = time.perf_counter() - _START
+    mark("first_update")
+    return True
+
+
+def report(top: int = 10) -> str:
+    """Текстовый отчёт о запуске"""
+    lines = ["⏱ Профиль запуска:"]
+    for name, at in MARKS:
+        lines.append(f"  • {name}: {at * 1000:.0f} мс от старта")
+    total_imports = sum(IMPORT_TIMES.values())
+    lines.append(f"  Импорт модулей: {total_imports * 1000:.0f} мс, самые тяжёлые:")
+    for name, spent in sorted(IMPORT_TIMES.items(), key=lambda x: x[1], reverse=True)[:top]:
+        lines.append(f"    {name:<24}{spent * 1000:>8.1f} мс")
+    return "\n".join(lines)
+
+
+async def on_first_update(update, context) -> None:
+    """TypeHandler: записывает время до первого обновления и выводит отчёт"""
+    if record_first_update():
+        text = report()
+        logger.info(text)
+        if os.getenv("STARTUP_PROFILE", "").lower() in ("1", "true", "yes"):
+            print(text)
@@ -1,13 +1,24 @@
 # subscriptions.py - с функцией удаления сообщения
+#
+# За SUBSCRIPTION_REMIND_DAYS дней до окончания подписки пользователь
+# получает напоминание. Напоминание — отложенная задача job_store, поэтому
+# переживает перезапуск бота.
+import asyncio
 import logging
+import os
 import time
 from datetime import datetime, timedelta
 from typing import Optional, Dict, Any, Tuple
 
+import job_store
+import tenants
+
 logger = logging.getLogger(__name__)
 
 # Храним ID сообщений с подписками для каждого пользователя
-SUBSCRIPTION_MESSAGES = {}  # {user_id: (chat_id, message_id)}
+SUBSCRIPTION_MESSAGES = tenants.TenantDict()  # {user_id: (chat_id, message_id)}
+
+SUBSCRIPTION_REMIND_DAYS = int(os.getenv("SUBSCRIPTION_REMIND_DAYS", "3"))
 
 
 def get_user_subscription_info(user_id: int) -> Dict[str, Any]:
@@ -200,6 +211,54 @@ async def delete_subscription_message(user_id: int, context):
     return False
 
 
+def _reminder_time(info: Dict[str, Any]) -> Optional[int]:
+    """Когда напомнить об окончании активной подписки (None — подписки нет)"""
+    if info["status"] != "active":
+        return None
+    end_date = info["details"]["end_date"]
+    return int((end_date - timedelta(days=SUBSCRIPTION_REMIND_DAYS)).timestamp())
+
+
+async def schedule_subscription_reminder(user_id: int) -> None:
+    """Планирует напоминание об окончании подписки (вызывается после покупки)"""
+    info = await asyncio.to_thread(get_user_subscription_info, user_id)
+    remind_at = _reminder_time(info)
+    if remind_at is None:
+        return
+    await job_store.schedule(
+        "subscription_reminder", f"subscription:{user_id}", max(remind_at, int(time.time())),
+        {"user_id": user_id},
+    )
+
+
+@job_store.handler("subscription_reminder")
+async def subscription_reminder_job(bot, payload: Dict[str, Any]) -> Optional[int]:
+    """Отложенная задача: напоминание об окончании подписки"""
+    user_id = payload["user_id"]
+    info = await asyncio.to_thread(get_user_subscription_info, user_id)
+    remind_at = _reminder_time(info)
+    if remind_at is None:
+        return None
+    if remind_at > time.time() + 60:
+        # Подписку продлили — напомним ближе к новой дате окончания
+        return remind_at
+
+    from keyboards import main_menu_kb
+    end_date = info["details"]["end_date"]
+    await bot.send_message(
+        chat_id=user_id,
+        text=(
+            f"⏰ <b>Подписка скоро закончится</b>\n\n"
+            f"📅 <b>Действует до:</b> <code>{end_date.strftime('%d.%m.%Y')}</code>\n"
+            f"⏳ <b>Осталось дней:</b> <b>{info['details']['days_left']}</b>\n\n"
+            f"Продлите подписку в каталоге, чтобы не потерять доступ."
+        ),
+        reply_markup=main_menu_kb(),
+        parse_mode="HTML"
+    )
+    return None
+
+
 def clear_subscription_message(user_id: int):
     """Очищает информацию о сообщении подписки (без удаления из Telegram)"""
     SUBSCRIPTION_MESSAGES.pop(user_id, None)
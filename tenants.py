@@ -0,0 +1,189 @@
+# tenants.py - Несколько магазинов в одном процессе
+#
+# Магазин (Tenant) — токен бота, каталог данных и администраторы. Текущий
+# магазин хранится в contextvars: обработчики обновлений, задачи JobQueue и
+# asyncio.to_thread видят свой магазин без передачи его через параметры.
+# Пути к файлам данных разрешаются через path(), а состояние в памяти,
+# привязанное к магазину, хранится в TenantDict и TenantScoped.
+#
+# Без файла TENANTS_FILE работает один магазин "default" с BOT_TOKEN и
+# ADMIN_IDS из окружения и данными в текущем каталоге, как раньше.
+#
+# Формат tenants.json:
+#   [{"name": "shop1", "token_env": "SHOP1_TOKEN", "admin_ids": [1, 2]},
+#    {"name": "shop2", "token": "...", "data_dir": "/srv/shop2"}]
+# По умолчанию data_dir — tenants/<name>.
+import contextvars
+import json
+import logging
+import os
+import re
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, FrozenSet, Generic, Iterator, List, TypeVar
+
+logger = logging.getLogger(__name__)
+
+TENANTS_FILE = os.getenv("TENANTS_FILE", "tenants.json")
+TENANTS_DIR = "tenants"
+
+T = TypeVar("T")
+
+
+def _parse_ids(value: str) -> FrozenSet[int]:
+    return frozenset(int(part) for part in value.split(",") if part.strip())
+
+
+@dataclass(frozen=True)
+class Tenant:
+    name: str
+    token: str
+    # Каталог данных магазина ("" — текущий каталог)
+    data_dir: str = ""
+    admin_ids: FrozenSet[int] = field(default_factory=frozenset)
+
+    def path(self, filename: str) -> str:
+        return os.path.join(self.data_dir, filename) if self.data_dir else filename
+
+
+DEFAULT_TENANT = Tenant(
+    name="default",
+    token=os.getenv("BOT_TOKEN", ""),
+    admin_ids=_parse_ids(os.getenv("ADMIN_IDS", "7784754900")),
+)
+
+_current: contextvars.ContextVar[Tenant] = contextvars.ContextVar("tenant", default=DEFAULT_TENANT)
+# Зарегистрированные магазины: name -> Tenant
+TENANTS: Dict[str, Tenant] = {DEFAULT_TENANT.name: DEFAULT_TENANT}
+
+
+def current() -> Tenant:
+    return _current.get()
+
+
+def path(filename: str) -> str:
+    """Путь к файлу данных текущего магазина"""
+    return _current.get().path(filename)
+
+
+def activate(tenant: Tenant) -> None:
+    """Делает магазин текущим до конца задачи (asyncio.Task) или потока"""
+    _current.set(tenant)
+
+
+@contextmanager
+def use(tenant: Tenant) -> Iterator[Tenant]:
+    token = _current.set(tenant)
+    try:
+        yield tenant
+    finally:
+        _current.reset(token)
+
+
+def per_tenant(job: Callable[[Any], Awaitable[None]]) -> Callable[[Any], Awaitable[None]]:
+    """
+    Задача JobQueue, которая выполняется по очереди для каждого магазина.
+    Планировщик один на процесс, поэтому задача регистрируется один раз
+    """
+    async def run(context) -> None:
+        for tenant in list(TENANTS.values()):
+            with use(tenant):
+                await job(context)
+    run.__name__ = job.__name__
+    return run
+
+
+class TenantDict(MutableMapping):
+    """Словарь, у каждого магазина свой (ключи — например, user_id)"""
+
+    def __init__(self):
+        self._by_tenant: Dict[str, dict] = {}
+
+    def data(self) -> dict:
+        name = _current.get().name
+        data = self._by_tenant.get(name)
+        if data is None:
+            data = self._by_tenant.setdefault(name, {})
+        return data
+
+    def __getitem__(self, key):
+        return self.data()[key]
+
+    def __setitem__(self, key, value) -> None:
+        self.data()[key] = value
+
+    def __delitem__(self, key) -> None:
+        del self.data()[key]
+
+    def __contains__(self, key) -> bool:
+        return key in self.data()
+
+    def __iter__(self):
+        return iter(self.data())
+
+    def __len__(self) -> int:
+        return len(self.data())
+
+    def get(self, key, default=None):
+        return self.data().get(key, default)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.data()!r})"
+
+
+class TenantScoped(Generic[T]):
+    """
+    Объект, у каждого магазина свой: создаётся factory(tenant) при первом
+    обращении. Атрибуты берутся у объекта текущего магазина
+    """
+
+    def __init__(self, factory: Callable[[Tenant], T]):
+        object.__setattr__(self, "_factory", factory)
+        object.__setattr__(self, "_instances", {})
+
+    def get(self) -> T:
+        tenant = _current.get()
+        instance = self._instances.get(tenant.name)
+        if instance is None:
+            instance = self._instances.setdefault(tenant.name, self._factory(tenant))
+        return instance
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.get(), name)
+
+
+def load_tenants(path: str = TENANTS_FILE) -> List[Tenant]:
+    """Читает описание магазинов. Пустой список, если файла нет"""
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        raw = json.load(f)
+    tenants = []
+    for item in raw:
+        name = str(item["name"])
+        if not re.match(r"^[a-zA-Z0-9_\-]+$", name):
+            raise ValueError(f"Недопустимое имя магазина: {name}")
+        token = item.get("token") or os.getenv(item.get("token_env", ""), "")
+        if not token:
+            raise ValueError(f"Не задан токен магазина {name}")
+        admin_ids = item.get("admin_ids")
+        tenants.append(Tenant(
+            name=name,
+            token=token,
+            data_dir=item.get("data_dir") or os.path.join(TENANTS_DIR, name),
+            admin_ids=frozenset(map(int, admin_ids)) if admin_ids is not None else DEFAULT_TENANT.admin_ids,
+        ))
+    return tenants
+
+
+def register(tenants: List[Tenant]) -> None:
+    """Заменяет магазин по умолчанию списком магазинов и создаёт их каталоги"""
+    TENANTS.clear()
+    for tenant in tenants:
+        if tenant.name in TENANTS:
+            raise ValueError(f"Магазин {tenant.name} описан дважды")
+        if tenant.data_dir:
+            os.makedirs(tenant.data_dir, exist_ok=True)
+        TENANTS[tenant.name] = tenant
+    logger.info(f"Магазинов в процессе: {len(TENANTS)} ({', '.join(TENANTS)})")
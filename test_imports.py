@@ -4,12 +4,12 @@ try:
     
     # Тест 1: Загрузка всех товаров
     products = load_products_from_db()
-    print(f"✅ load_products_from_db работает. Товаров: {len(products.get('products', []))}")
+    print(f"✅ load_products_from_db работает. Товаров: {len(products)}")
     
     # Тест 2: Получение одного товара
     product = get_product_from_db('p1')
     if product:
-        print(f"✅ get_product_from_db работает. Товар p1: {product['name']}")
+        print(f"✅ get_product_from_db работает. Товар p1: {product.title}")
     else:
         print("❌ get_product_from_db не нашёл товар p1")
         
@@ -6,9 +6,9 @@ print("=== ТЕСТ ПОЛУЧЕНИЯ ТОВАРА ===")
 # Тест 1: Существующий товар
 product = get_product_from_db('p6')
 if product:
-    print(f"✅ Товар p6 найден: {product.get('name', product.get('title'))}")
-    print(f"   Цена: {product.get('price', product.get('price_rub'))} руб.")
-    print(f"   Дней: {product.get('days')}")
+    print(f"✅ Товар p6 найден: {product.title}")
+    print(f"   Цена: {product.price_rub} руб.")
+    print(f"   Дней: {product.days}")
 else:
     print("❌ Товар p6 не найден")
 
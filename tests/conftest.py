@@ -0,0 +1,36 @@
+# conftest.py - Общие фикстуры тестов
+import os
+import tempfile
+import uuid
+
+import pytest
+
+# Значения, которые не должен подменить .env: тесты не обращаются к Telegram и ЮКассе
+os.environ["BOT_TOKEN"] = "123456:test"
+os.environ["YOOKASSA_SHOP_ID"] = ""
+os.environ["YOOKASSA_SECRET_KEY"] = ""
+os.environ["STARS_PAYLOAD_SECRET"] = "test-secret"
+os.environ["METRICS_PORT"] = "0"
+os.environ["JSON_LOCK_FILE"] = os.path.join(tempfile.mkdtemp(prefix="bot-tests-"), "json_write.lock")
+
+import tenants  # noqa: E402
+
+
+@pytest.fixture
+def tenant(tmp_path):
+    """Отдельный магазин с данными во временном каталоге"""
+    shop = tenants.Tenant(name=f"test-{uuid.uuid4().hex[:8]}", token="", data_dir=str(tmp_path))
+    with tenants.use(shop):
+        yield shop
+
+
+@pytest.fixture(scope="session")
+def bot_module(tmp_path_factory):
+    """Модуль bot; логи при импорте пишутся во временный каталог, а не в logs/ репозитория"""
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("bot"))
+    try:
+        import bot
+    finally:
+        os.chdir(cwd)
+    return bot
@@ -0,0 +1,105 @@
+# test_admin_reports.py - Снимок для админ-панели
+import json
+import sqlite3
+
+import pytest
+
+import admin_reports
+import migrate_json
+import migrations
+import payments_archive
+
+
+def _write(tenant, name, data):
+    with open(tenant.path(name), "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+
+
+def _purchase(ts, stars=100):
+    return {"product_id": "p1", "title": "Товар", "stars": stars, "ts": ts}
+
+
+@pytest.fixture
+def shop(tenant):
+    db_path = tenant.path(migrate_json.DB_PATH)
+    migrations.migrate(db_path)
+    conn = sqlite3.connect(db_path)
+    with conn:
+        conn.execute("INSERT INTO products (id, title, price_stars) VALUES ('p1', 'Товар из базы', 100)")
+    conn.close()
+    _write(tenant, "products.json", [{"id": "p1", "title": "Товар из файла", "price_stars": 100}])
+    _write(tenant, "db.json", {"payments_processed": [], "purchases": {"1": [_purchase(10), _purchase(20)]}})
+    _write(tenant, "yookassa_payments.json", {
+        "y1": {"payment_id": "y1", "user_id": 1, "product_id": "p1", "amount": 150,
+               "status": "succeeded", "created_at": 30},
+    })
+    return tenant
+
+
+@pytest.fixture
+def sections(monkeypatch):
+    """Секции, которые снимок перечитывал из JSON"""
+    parsed = []
+    migrate_section = migrate_json.migrate_section
+
+    def counting(conn, section, path, *args, **kwargs):
+        parsed.append(section)
+        return migrate_section(conn, section, path, *args, **kwargs)
+
+    monkeypatch.setattr(migrate_json, "migrate_section", counting)
+    return parsed
+
+
+def test_snapshot_reports_purchases_and_payments(shop):
+    admin_reports.refresh_snapshot(force=True)
+
+    assert admin_reports.purchase_stats()["orders"] == 2
+    assert admin_reports.yookassa_summary()["succeeded"] == 1
+
+
+def test_unchanged_files_are_not_parsed_again(shop, sections):
+    admin_reports.refresh_snapshot(force=True)
+    sections.clear()
+
+    admin_reports.refresh_snapshot(force=True)
+
+    assert sections == []
+    assert admin_reports.purchase_stats()["orders"] == 2
+
+
+def test_only_changed_file_is_parsed(shop, sections):
+    admin_reports.refresh_snapshot(force=True)
+    sections.clear()
+    # Покупку удалили из db.json: снимок её тоже не содержит
+    _write(shop, "db.json", {"payments_processed": [], "purchases": {"1": [_purchase(20, stars=5)]}})
+
+    admin_reports.refresh_snapshot(force=True)
+
+    assert sections == ["db"]
+    assert admin_reports.purchase_stats()["orders"] == 1
+    assert admin_reports.purchase_stats()["stars"] == 5
+
+
+def test_archived_payments_stay_in_reports_and_exports(shop, tmp_path):
+    old = {"payment_id": "y0", "user_id": 2, "product_id": "p1", "amount": 150,
+           "status": "succeeded", "created_at": 5}
+    admin_reports.refresh_snapshot(force=True)
+    # Платёж перенесён в архив и в горячем файле его нет
+    payments_archive.archive_payments({"y0": old}, now=40 * 86400)
+    admin_reports.refresh_snapshot(force=True)
+
+    assert admin_reports.yookassa_summary()["succeeded"] == 2
+    rows = list(admin_reports.iter_export_rows("yookassa", 0, 10))
+    assert [row[0] for row in rows] == ["y0"]
+
+    out = tmp_path / "export"
+    out.mkdir()
+    _, count = admin_reports.write_export("yookassa", "csv", str(out))
+    assert count == 2
+
+
+def test_products_come_from_database(shop):
+    admin_reports.refresh_snapshot(force=True)
+
+    payment, = admin_reports.recent_yookassa_payments()
+    assert payment["product_title"] == "Товар из базы"
@@ -0,0 +1,96 @@
+# test_backup.py - Резервные копии и восстановление
+import json
+import os
+import sqlite3
+import tarfile
+
+import backup
+import migrations
+
+
+def _write_json(tenant, name, data):
+    with open(tenant.path(name), "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+
+
+def _read_json(tenant, name):
+    with open(tenant.path(name), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _set_price(db_path, price):
+    conn = sqlite3.connect(db_path)
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO products (id, title, price_stars) VALUES ('p1', 'Товар', ?)", (price,))
+    conn.close()
+
+
+def _price(conn):
+    return conn.execute("SELECT price_stars FROM products WHERE id = 'p1'").fetchone()[0]
+
+
+def test_backup_contains_database_and_json(tenant):
+    db_path = tenant.path(backup.DB_PATH)
+    migrations.migrate(db_path)
+    _set_price(db_path, 100)
+    _write_json(tenant, "db.json", {"purchases": {}})
+
+    path = backup.create_backup(pages=1, sleep=0)
+
+    assert os.path.dirname(path) == backup.default_backup_dir()
+    with tarfile.open(path, "r:gz") as tar:
+        assert sorted(tar.getnames()) == [backup.DB_PATH, "db.json"]
+    # Временный каталог снимка удалён
+    assert backup.list_backups() == [path]
+    assert os.listdir(backup.default_backup_dir()) == [os.path.basename(path)]
+
+
+def test_restore_returns_data_to_open_connections(tenant):
+    db_path = tenant.path(backup.DB_PATH)
+    migrations.migrate(db_path)
+    _set_price(db_path, 100)
+    _write_json(tenant, "db.json", {"payments_processed": ["a"]})
+    snapshot = backup.create_backup(sleep=0)
+
+    _set_price(db_path, 500)
+    _write_json(tenant, "db.json", {"payments_processed": ["a", "b"]})
+    conn = sqlite3.connect(db_path)
+    try:
+        assert _price(conn) == 500
+
+        restored = backup.restore_backup(snapshot)
+
+        # Соединение, открытое до восстановления, видит данные снимка
+        assert _price(conn) == 100
+    finally:
+        conn.close()
+    assert restored == [db_path, tenant.path("db.json")]
+    assert _read_json(tenant, "db.json") == {"payments_processed": ["a"]}
+
+
+def test_restore_keeps_safety_backup(tenant):
+    db_path = tenant.path(backup.DB_PATH)
+    migrations.migrate(db_path)
+    _set_price(db_path, 100)
+    snapshot = backup.create_backup(sleep=0)
+    _set_price(db_path, 500)
+
+    backup.restore_backup(snapshot)
+
+    safety = [p for p in backup.list_backups() if "before-restore" in p]
+    assert len(safety) == 1
+    backup.restore_backup(safety[0], safety_backup=False)
+    conn = sqlite3.connect(db_path)
+    try:
+        assert _price(conn) == 500
+    finally:
+        conn.close()
+
+
+def test_retention_removes_oldest_snapshots(tenant):
+    paths = [backup.create_backup(keep=0, sleep=0, label=str(n)) for n in range(4)]
+    for n, path in enumerate(paths):
+        os.utime(path, (1_700_000_000 + n, 1_700_000_000 + n))
+
+    assert backup.apply_retention(keep=2) == 2
+    assert backup.list_backups() == paths[2:]
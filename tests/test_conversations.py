@@ -0,0 +1,122 @@
+# test_conversations.py - Индекс режимов ввода и маршрутизация текста
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import conversations
+import tenants
+import router as router_module
+from router import ConversationRouter
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(conversations, "time", SimpleNamespace(monotonic=lambda: now[0]))
+    return now
+
+
+@pytest.fixture
+def index(tenant):
+    return conversations.ConversationIndex()
+
+
+def test_flow_states_mark_the_index(index):
+    promo = index.flow("promo", ttl=60)
+
+    promo[1] = {"step": 1}
+    assert index.active_flow(1) == "promo"
+
+    promo.pop(1)
+    assert index.active_flow(1) is None
+    assert len(index) == 0
+
+
+def test_new_flow_replaces_previous_state(index):
+    promo = index.flow("promo", ttl=60)
+    admin = index.flow("admin", ttl=60)
+
+    promo[1] = True
+    admin[1] = {"action": "price"}
+
+    assert index.active_flow(1) == "admin"
+    assert 1 not in promo
+
+
+def test_flow_expires_after_ttl(index, clock):
+    promo = index.flow("promo", ttl=60)
+    promo[1] = True
+
+    clock[0] += 59
+    assert index.active_flow(1) == "promo"
+    clock[0] += 2
+    assert index.active_flow(1) is None
+    assert 1 not in promo
+
+
+def test_touch_extends_flow(index, clock):
+    admin = index.flow("admin", ttl=60)
+    admin[1] = {}
+
+    clock[0] += 50
+    index.touch(1)
+    clock[0] += 50
+
+    assert index.active_flow(1) == "admin"
+
+
+def test_sweep_removes_only_expired_flows(index, clock):
+    promo = index.flow("promo", ttl=10)
+    admin = index.flow("admin", ttl=100)
+    promo[1] = True
+    admin[2] = {}
+
+    clock[0] += 50
+
+    assert index.sweep() == 1
+    assert 1 not in promo
+    assert index.active_flow(2) == "admin"
+
+
+def _message(user_id, text="текст"):
+    user = SimpleNamespace(id=user_id)
+    message = SimpleNamespace(from_user=user, text=text)
+    return SimpleNamespace(effective_user=user, message=message)
+
+
+def test_text_goes_only_to_active_flow(index, clock):
+    calls = []
+
+    async def on_promo(update, context):
+        calls.append(update.effective_user.id)
+
+    router = ConversationRouter(index)
+    router.add("promo", on_promo)
+    promo = index.flow("promo", ttl=60)
+    active_filter = router_module._ActiveConversation(router)
+    promo[1] = True
+
+    # Сообщения пользователей без режима отбрасываются фильтром, до обработчиков
+    assert active_filter.filter(_message(1).message)
+    assert not active_filter.filter(_message(2).message)
+    for user_id in (1, 2):
+        asyncio.run(router.dispatch(_message(user_id), None))
+
+    assert calls == [1]
+    # Сообщение в режиме продлевает его
+    clock[0] += 59
+    asyncio.run(router.dispatch(_message(1), None))
+    clock[0] += 59
+    assert index.active_flow(1) == "promo"
+
+
+def test_flows_are_separate_per_tenant(index, tenant):
+    promo = index.flow("promo", ttl=60)
+    promo[1] = True
+    other = tenants.Tenant(name=f"{tenant.name}-other", token="")
+
+    with tenants.use(other):
+        assert index.active_flow(1) is None
+        assert 1 not in promo
+    assert index.active_flow(1) == "promo"
@@ -0,0 +1,130 @@
+# test_job_store.py - Отложенные задачи в scheduled_jobs
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import job_store
+import migrations
+
+
+@pytest.fixture
+def store(tenant):
+    migrations.migrate(tenant.path(job_store.DB_PATH))
+    return job_store.JOBS.get()
+
+
+@pytest.fixture
+def leader(monkeypatch):
+    monkeypatch.setattr(job_store.LEASE, "_expires_at", time.time() + 3600)
+
+
+def _run(tenant, job):
+    context = SimpleNamespace(job=SimpleNamespace(data=(tenant, job.key, job.run_at)), bot=None)
+    asyncio.run(job_store._run(context))
+
+
+def test_due_before_returns_each_job_once(store):
+    store.schedule("remind", "a", 100)
+    store.schedule("remind", "b", 200)
+    store.schedule("remind", "later", 10_000)
+
+    assert [job.key for job in store.due_before(500)] == ["a", "b"]
+    assert store.due_before(500) == []
+
+
+def test_rescheduled_job_is_loaded_again(store):
+    store.schedule("remind", "a", 100)
+    store.due_before(500)
+
+    store.schedule("remind", "a", 150, {"step": 2})
+    jobs = store.due_before(500)
+
+    assert [(job.key, job.run_at, job.payload) for job in jobs] == [("a", 150, {"step": 2})]
+
+
+def test_unloaded_job_is_loaded_again(store):
+    store.schedule("remind", "a", 100)
+    store.due_before(500)
+
+    store.unload("a", 100)
+
+    assert [job.key for job in store.due_before(500)] == ["a"]
+
+
+def test_finish_keeps_job_rescheduled_meanwhile(store):
+    store.schedule("remind", "a", 100)
+    job = store.get("a")
+    store.schedule("remind", "a", 300)
+
+    store.finish(job)
+
+    assert store.get("a").run_at == 300
+
+
+def test_successful_job_is_deleted(tenant, store, leader, monkeypatch):
+    calls = []
+
+    async def remind(bot, payload):
+        calls.append(payload)
+
+    monkeypatch.setitem(job_store.HANDLERS, "remind", remind)
+    store.schedule("remind", "a", 100, {"user_id": 1})
+    job, = store.due_before(500)
+
+    _run(tenant, job)
+
+    assert calls == [{"user_id": 1}]
+    assert store.get("a") is None
+    # Задача снята с учёта загруженных: новая с тем же ключом загрузится снова
+    store.schedule("remind", "a", 100)
+    assert [j.key for j in store.due_before(500)] == ["a"]
+
+
+def test_failed_job_is_retried_with_backoff(tenant, store, leader, monkeypatch):
+    async def broken(bot, payload):
+        raise RuntimeError("сеть недоступна")
+
+    monkeypatch.setitem(job_store.HANDLERS, "remind", broken)
+    store.schedule("remind", "a", 100)
+    job, = store.due_before(500)
+
+    before = int(time.time())
+    _run(tenant, job)
+
+    retried = store.get("a")
+    assert retried.attempts == 1
+    assert retried.run_at >= before + job_store.JOB_RETRY_DELAY
+    assert [j.key for j in store.due_before(retried.run_at)] == ["a"]
+
+
+def test_job_is_dropped_after_max_attempts(tenant, store, leader, monkeypatch):
+    async def broken(bot, payload):
+        raise RuntimeError("сеть недоступна")
+
+    monkeypatch.setitem(job_store.HANDLERS, "remind", broken)
+    monkeypatch.setattr(job_store, "JOB_MAX_ATTEMPTS", 2)
+    store.schedule("remind", "a", 100)
+
+    for _ in range(2):
+        job = store.get("a")
+        _run(tenant, job)
+
+    assert store.get("a") is None
+
+
+def test_follower_does_not_run_jobs(tenant, store, monkeypatch):
+    calls = []
+
+    async def remind(bot, payload):
+        calls.append(payload)
+
+    monkeypatch.setitem(job_store.HANDLERS, "remind", remind)
+    monkeypatch.setattr(job_store.LEASE, "_expires_at", 0.0)
+    store.schedule("remind", "a", 100)
+
+    _run(tenant, store.get("a"))
+
+    assert calls == []
+    assert store.get("a") is not None
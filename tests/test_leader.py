@@ -0,0 +1,59 @@
+# test_leader.py - Аренда роли ведущего
+import sqlite3
+
+import leader
+
+
+def _holder(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        row = conn.execute("SELECT holder FROM leases WHERE name = 'scheduler'").fetchone()
+    finally:
+        conn.close()
+    return row[0] if row else None
+
+
+def _expire(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        with conn:
+            conn.execute("UPDATE leases SET expires_at = 0")
+    finally:
+        conn.close()
+
+
+def test_only_one_process_holds_the_lease(tmp_path):
+    db_path = str(tmp_path / "lease.db")
+    first = leader.LeaderLease(db_path, holder="first")
+    second = leader.LeaderLease(db_path, holder="second")
+
+    assert first.renew() is True
+    assert second.renew() is False
+    assert first.renew() is True
+    assert first.is_leader and not second.is_leader
+    assert _holder(db_path) == "first"
+
+
+def test_expired_lease_is_taken_over(tmp_path):
+    db_path = str(tmp_path / "lease.db")
+    first = leader.LeaderLease(db_path, holder="first")
+    second = leader.LeaderLease(db_path, holder="second")
+    first.renew()
+
+    _expire(db_path)
+
+    assert second.renew() is True
+    assert _holder(db_path) == "second"
+
+
+def test_released_lease_is_taken_without_waiting(tmp_path):
+    db_path = str(tmp_path / "lease.db")
+    first = leader.LeaderLease(db_path, holder="first")
+    second = leader.LeaderLease(db_path, holder="second")
+    first.renew()
+
+    first.release()
+
+    assert not first.is_leader
+    assert second.renew() is True
+    assert _holder(db_path) == "second"
@@ -0,0 +1,27 @@
+# test_metrics.py - Метрики операций хранилища
+import metrics
+from data_tools import Product, add_purchase, get_all_purchases_flat
+
+
+def _counts():
+    with metrics.OPERATION_LATENCY._lock:
+        return {key: series[2] for key, series in metrics.OPERATION_LATENCY._series.items()}
+
+
+def _delta(before, after):
+    return {key: n - before.get(key, 0) for key, n in after.items() if n != before.get(key, 0)}
+
+
+def test_json_layer_counts_each_file_access_once(tenant):
+    product = Product(id="p1", title="Товар", description="", price_stars=100, deliver_text="", deliver_url="")
+    before = _counts()
+
+    add_purchase(1, product)
+    get_all_purchases_flat()
+
+    # Запись покупки — одна транзакция json_tx; чтения и запись файла — только в слое json
+    assert _delta(before, _counts()) == {
+        ("json_tx", "add_purchase"): 1,
+        ("json", "load_db"): 2,
+        ("json", "save_db"): 1,
+    }
@@ -0,0 +1,121 @@
+# test_migrate_json.py - Перенос JSON-хранилищ в SQLite
+import io
+import json
+import sqlite3
+
+import pytest
+
+import migrate_json
+import migrations
+
+
+def _write(tenant, name, data):
+    with open(tenant.path(name), "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+
+
+def test_products_json_does_not_overwrite_table(tenant):
+    db_path = tenant.path(migrate_json.DB_PATH)
+    migrations.migrate(db_path)
+    conn = sqlite3.connect(db_path)
+    with conn:
+        # Цена изменена в админ-панели и есть только в таблице
+        conn.execute("INSERT INTO products (id, title, price_stars) VALUES ('p1', 'Товар', 250)")
+    conn.close()
+    _write(tenant, "products.json", [
+        {"id": "p1", "title": "Товар", "price_stars": 100},
+        {"id": "p2", "title": "Новый товар", "price_stars": 300},
+    ])
+
+    migrate_json.migrate(db_path, ["products"], restart=True)
+
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute("SELECT id, price_stars FROM products ORDER BY id").fetchall()
+    finally:
+        conn.close()
+    assert rows == [("p1", 250), ("p2", 300)]
+
+
+DB_JSON = {
+    "users": {"1": {"name": "Пропускаемая секция", "tags": [1, 2, {"a": None}]}},
+    "purchases": {
+        "100": [{"product_id": "p1", "title": "Товар", "stars": 123456789, "ts": 1700000000}],
+        "200": [{"product_id": "p2", "stars": -5, "rub": 99.5, "ts": 1700000001}, "мусор"],
+    },
+    "payments_processed": ["charge-1", 7, "charge-2"],
+}
+
+
+def _stream(data, chunk_size=3):
+    return migrate_json.JsonStream(io.StringIO(json.dumps(data, ensure_ascii=False)), chunk_size=chunk_size)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 64 * 1024])
+def test_stream_parses_across_chunk_boundaries(chunk_size):
+    rows = list(migrate_json.iter_db(_stream(DB_JSON, chunk_size)))
+
+    assert rows == [
+        (migrate_json.PURCHASE_SQL, ("100:0", 100, "p1", "Товар", 123456789, None, None, None, 1700000000)),
+        (migrate_json.PURCHASE_SQL, ("200:0", 200, "p2", None, -5, 99, None, None, 1700000001)),
+        (migrate_json.PROCESSED_SQL, ("charge-1",)),
+        (migrate_json.PROCESSED_SQL, ("charge-2",)),
+    ]
+
+
+def test_stream_items_elements_and_skip():
+    stream = _stream({"a": [10, 20.5, -3e2], "b": {"x": [1, [2]]}, "c": 1234567}, chunk_size=2)
+    seen = {}
+    for key in stream.items():
+        if key == "a":
+            seen[key] = [(index, stream.value()) for index in stream.elements()]
+        elif key == "b":
+            stream.skip()
+        else:
+            seen[key] = stream.value()
+
+    assert seen == {"a": [(0, 10), (1, 20.5), (2, -300.0)], "c": 1234567}
+
+
+def test_stream_number_at_end_of_document():
+    assert _stream(1234567890, chunk_size=4).value() == 1234567890
+
+
+def test_stream_rejects_truncated_document():
+    stream = migrate_json.JsonStream(io.StringIO('{"a": [1, 2'), chunk_size=4)
+
+    with pytest.raises(ValueError):
+        for _ in stream.items():
+            for _ in stream.elements():
+                stream.value()
+
+
+def test_interrupted_section_resumes(tenant, monkeypatch):
+    db_path = tenant.path(migrate_json.DB_PATH)
+    _write(tenant, "db.json", DB_JSON)
+    migrations.migrate(db_path)
+    path, producer = migrate_json.SECTIONS["db"]
+
+    def failing_producer(stream):
+        for n, row in enumerate(producer(stream)):
+            if n == 3:
+                raise OSError("процесс остановлен")
+            yield row
+
+    conn = sqlite3.connect(db_path)
+    try:
+        monkeypatch.setitem(migrate_json.SECTIONS, "db", (path, failing_producer))
+        with pytest.raises(OSError):
+            migrate_json.migrate_section(conn, "db", tenant.path(path), batch_size=1)
+        monkeypatch.setitem(migrate_json.SECTIONS, "db", (path, producer))
+
+        # Три записи уже сохранены вместе с прогрессом: загружается только остаток
+        assert migrate_json.migrate_section(conn, "db", tenant.path(path), batch_size=1) == 1
+        assert migrate_json.migrate_section(conn, "db", tenant.path(path), batch_size=1) == 0
+        assert migrate_json.is_section_current(conn, "db", tenant.path(path))
+        assert conn.execute("SELECT COUNT(*) FROM purchases").fetchone()[0] == 2
+        assert conn.execute("SELECT charge_id FROM processed_payments ORDER BY charge_id").fetchall() == [
+            ("charge-1",), ("charge-2",)
+        ]
+    finally:
+        conn.close()
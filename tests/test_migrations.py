@@ -0,0 +1,66 @@
+# test_migrations.py - Применение миграций схемы
+import json
+import os
+import sqlite3
+
+import migrations
+
+LATEST = migrations.MIGRATIONS[-1].version
+
+
+def _count(db_path, table):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_migrate_is_idempotent(tenant):
+    db_path = tenant.path(migrations.DB_PATH)
+
+    assert migrations.migrate(db_path) == LATEST
+    assert migrations.migrate(db_path) == LATEST
+    assert _count(db_path, "schema_version") == len(migrations.MIGRATIONS)
+
+
+def test_light_migrations_skip_heavy_ones(tenant):
+    db_path = tenant.path(migrations.DB_PATH)
+    first_heavy = next(m.version for m in migrations.MIGRATIONS if m.heavy)
+    heavy = [m.version for m in migrations.MIGRATIONS if m.heavy]
+
+    assert migrations.migrate(db_path, include_heavy=False) == first_heavy - 1
+
+    conn = migrations.connect(db_path)
+    try:
+        # Лёгкие миграции после тяжёлых уже применены: их таблицы есть сразу
+        assert [m.version for m in migrations.pending_migrations(conn)] == heavy
+        conn.execute("SELECT key, run_at FROM scheduled_jobs").fetchall()
+        conn.execute("SELECT key, value FROM settings").fetchall()
+        conn.execute("SELECT last_seen FROM users").fetchall()
+    finally:
+        conn.close()
+
+    assert migrations.migrate(db_path) == LATEST
+
+    conn = migrations.connect(db_path)
+    try:
+        assert migrations.pending_migrations(conn) == []
+    finally:
+        conn.close()
+
+
+def test_products_json_is_imported_once(tenant):
+    db_path = tenant.path(migrations.DB_PATH)
+    with open(tenant.path(migrations.PRODUCTS_JSON), "w", encoding="utf-8") as f:
+        json.dump([{"id": "p1", "title": "Подписка 1 месяц", "price_stars": 100}], f, ensure_ascii=False)
+
+    migrations.migrate(db_path)
+    os.remove(tenant.path(migrations.PRODUCTS_JSON))
+    migrations.migrate(db_path)
+
+    conn = sqlite3.connect(db_path)
+    try:
+        assert conn.execute("SELECT id, days FROM products").fetchall() == [("p1", 30)]
+    finally:
+        conn.close()
@@ -0,0 +1,135 @@
+# test_outbound.py - Очередь исходящих запросов с флуд-контролем
+import asyncio
+
+import pytest
+from telegram.error import RetryAfter
+
+import outbound
+
+CHAT_ID = 42
+
+
+def _run(coro_factory, **limiter_args):
+    async def main():
+        limiter = outbound.FloodControlLimiter(**limiter_args)
+        await limiter.initialize()
+        try:
+            return await coro_factory(limiter)
+        finally:
+            await limiter.shutdown()
+    return asyncio.run(main())
+
+
+def _request(limiter, calls, endpoint, data=None, name=None, error=None):
+    async def callback():
+        if error and not error.get("raised"):
+            error["raised"] = True
+            raise RetryAfter(error["seconds"])
+        calls.append((name or endpoint, asyncio.get_running_loop().time()))
+        return True
+    return limiter.process_request(callback, (), {}, endpoint, data or {}, None)
+
+
+def test_requests_of_one_chat_keep_order():
+    calls = []
+
+    async def scenario(limiter):
+        await asyncio.gather(*(
+            _request(limiter, calls, endpoint, {"chat_id": CHAT_ID}, name=f"{endpoint}{i}")
+            for i, endpoint in enumerate(["sendMessage", "editMessageText", "deleteMessage", "sendMessage"])
+        ))
+
+    _run(scenario)
+
+    assert [name for name, _ in calls] == ["sendMessage0", "editMessageText1", "deleteMessage2", "sendMessage3"]
+
+
+def test_edits_do_not_spend_chat_limit():
+    calls = []
+
+    async def scenario(limiter):
+        started = asyncio.get_running_loop().time()
+        await asyncio.gather(*(
+            _request(limiter, calls, "editMessageText", {"chat_id": CHAT_ID})
+            for _ in range(outbound.PRIVATE_CHAT_BURST * 3)
+        ))
+        return asyncio.get_running_loop().time() - started
+
+    assert _run(scenario) < 0.5
+
+
+def test_chat_messages_are_paced_after_burst():
+    calls = []
+
+    async def scenario(limiter):
+        started = asyncio.get_running_loop().time()
+        await asyncio.gather(*(
+            _request(limiter, calls, "sendMessage", {"chat_id": CHAT_ID})
+            for _ in range(outbound.PRIVATE_CHAT_BURST + 1)
+        ))
+        return asyncio.get_running_loop().time() - started
+
+    # Сообщение сверх запаса ждёт токен чата: 1 / PRIVATE_CHAT_RATE
+    assert _run(scenario) >= 0.9 / outbound.PRIVATE_CHAT_RATE
+
+
+def test_high_priority_requests_overtake_waiting_messages():
+    calls = []
+
+    async def scenario(limiter):
+        sends = [
+            asyncio.ensure_future(_request(limiter, calls, "sendMessage", {"chat_id": chat_id}))
+            for chat_id in (1, 2, 3)
+        ]
+        await asyncio.sleep(0.05)
+        await _request(limiter, calls, "answerCallbackQuery")
+        await asyncio.gather(*sends)
+
+    # Лимит бота — одно сообщение в секунду: второе и третье ждут в очереди
+    _run(scenario, global_rate=1.0)
+
+    assert [name for name, _ in calls] == ["sendMessage", "answerCallbackQuery", "sendMessage", "sendMessage"]
+
+
+def test_retry_after_pauses_and_retries():
+    calls = []
+
+    async def scenario(limiter):
+        started = asyncio.get_running_loop().time()
+        error = {"seconds": 0.3}
+        await asyncio.gather(
+            _request(limiter, calls, "sendMessage", {"chat_id": 1}, error=error),
+            _delayed(_request(limiter, calls, "editMessageText", {"chat_id": 2}), 0.05),
+        )
+        return started
+
+    started = _run(scenario)
+
+    # Повтор после паузы, а запрос другого чата ждал окончания паузы
+    assert sorted(name for name, _ in calls) == ["editMessageText", "sendMessage"]
+    assert all(at - started >= 0.29 for _, at in calls)
+
+
+def test_retry_after_is_raised_after_max_retries():
+    async def scenario(limiter):
+        async def callback():
+            raise RetryAfter(0.01)
+        return await limiter.process_request(callback, (), {}, "sendMessage", {"chat_id": CHAT_ID}, None)
+
+    with pytest.raises(RetryAfter):
+        _run(scenario, max_retries=1)
+
+
+def test_deletes_are_dropped_when_overloaded():
+    calls = []
+
+    async def scenario(limiter):
+        return await _request(limiter, calls, "deleteMessage", {"chat_id": CHAT_ID})
+
+    assert _run(scenario, max_pending=0) is False
+    assert calls == []
+
+
+async def _delayed(coro, seconds):
+    await asyncio.sleep(seconds)
+    return await coro
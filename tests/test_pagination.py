@@ -0,0 +1,68 @@
+# test_pagination.py - Постраничные клавиатуры каталога и админки
+import pytest
+
+from data_tools import Product
+from keyboards import (
+    clamp_page, catalog_kb, edit_select_layout, edit_select_product_kb, page_count,
+)
+
+
+def _products(n):
+    return [Product(id=f"p{i}", title=f"Товар {i}", description="", price_stars=100 + i,
+                    deliver_text="", deliver_url="", price_rub=10 * i) for i in range(n)]
+
+
+def _callbacks(markup):
+    return [[button.callback_data for button in row] for row in markup.inline_keyboard]
+
+
+@pytest.mark.parametrize("total, pages", [(0, 1), (1, 1), (10, 1), (11, 2), (25, 3)])
+def test_page_count(total, pages):
+    assert page_count(total, 10) == pages
+
+
+@pytest.mark.parametrize("page, expected", [(-5, 0), (0, 0), (2, 2), (3, 2), (100, 2)])
+def test_clamp_page(page, expected):
+    assert clamp_page(page, 25, 10) == expected
+
+
+def test_catalog_pages_show_only_their_products():
+    products = _products(25)
+
+    first = _callbacks(catalog_kb(products, 0))
+    middle = _callbacks(catalog_kb(products, 1))
+    last = _callbacks(catalog_kb(products, 2))
+
+    assert first[:10] == [[f"prod:p{i}"] for i in range(10)]
+    assert first[10:] == [["cat:1"], ["menu:home"]]
+    assert middle[10:] == [["cat:0", "cat:2"], ["menu:home"]]
+    assert last == [[f"prod:p{i}"] for i in range(20, 25)] + [["cat:1"], ["menu:home"]]
+
+
+def test_catalog_page_out_of_range_is_clamped():
+    products = _products(25)
+
+    assert _callbacks(catalog_kb(products, 99)) == _callbacks(catalog_kb(products, 2))
+
+
+def test_single_page_catalog_has_no_navigation():
+    assert _callbacks(catalog_kb(_products(3))) == [["prod:p0"], ["prod:p1"], ["prod:p2"], ["menu:home"]]
+
+
+def test_edit_select_layout_pages():
+    layout = edit_select_layout(_products(45), page_size=20)
+
+    assert [len(page) for page in layout] == [20, 20, 5]
+    assert layout[2][0] == ("Товар 40 (p40) - 140⭐", "p40")
+    assert edit_select_layout([]) == ((),)
+
+
+def test_edit_select_keyboard_carries_csrf_token():
+    layout = edit_select_layout(_products(45), page_size=20)
+
+    rows = _callbacks(edit_select_product_kb(layout, "tok", page=1))
+
+    assert rows[0] == ["edit_select:p20:tok"]
+    assert rows[-2:] == [["edit_page:0:tok", "edit_page:2:tok"], ["admin:back:tok"]]
+    # Страница за пределами списка — последняя
+    assert _callbacks(edit_select_product_kb(layout, "tok", page=7))[0] == ["edit_select:p40:tok"]
@@ -0,0 +1,113 @@
+# test_payment_recheck.py - Отложенная проверка платежа ЮКассы и выдача товара
+import asyncio
+import json
+import time
+
+import pytest
+
+import migrations
+import payments
+from data_tools import load_db
+
+USER_ID = 42
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text))
+
+
+@pytest.fixture
+def shop(tenant):
+    with open(tenant.path("products.json"), "w", encoding="utf-8") as f:
+        json.dump([{"id": "p1", "title": "Подписка 1 месяц", "price_stars": 100, "price_rub": 150,
+                    "deliver_text": "Спасибо!"}], f, ensure_ascii=False)
+    migrations.migrate(tenant.path(migrations.DB_PATH))
+    return tenant
+
+
+def _store_payment(amount, metadata):
+    payment = {
+        "payment_id": "pay-1", "user_id": USER_ID, "product_id": "p1", "amount": amount,
+        "status": "pending", "created_at": int(time.time()), "metadata": metadata,
+    }
+    payments.save_yookassa_payments({"pay-1": payment})
+    return payment
+
+
+def _recheck(bot_module, monkeypatch, status="succeeded"):
+    monkeypatch.setattr(bot_module, "check_yookassa_payment_status", lambda payment_id: status)
+    bot = FakeBot()
+    payload = {"payment_id": "pay-1", "user_id": USER_ID, "created": int(time.time())}
+    next_run_at = asyncio.run(bot_module.payment_recheck_job(bot, payload))
+    return bot, next_run_at
+
+
+def _yookassa_purchases():
+    return [item for item in load_db()["purchases"].get(str(USER_ID), []) if item.get("yookassa_id")]
+
+
+def test_payment_hash_is_deterministic():
+    first = payments.generate_payment_hash(USER_ID, "p1", 150)
+    time.sleep(1.1)
+
+    assert payments.generate_payment_hash(USER_ID, "p1", 150.0) == first
+    assert payments.generate_payment_hash(USER_ID, "p1", 151) != first
+
+
+@pytest.mark.parametrize("amount", [150, 150.0])
+def test_paid_payment_is_delivered(bot_module, shop, monkeypatch, amount):
+    _store_payment(amount, {
+        "hash": payments.generate_payment_hash(USER_ID, "p1", 150),
+        "hash_version": payments.PAYMENT_HASH_VERSION,
+    })
+
+    bot, next_run_at = _recheck(bot_module, monkeypatch)
+
+    assert next_run_at is None
+    assert [item["yookassa_id"] for item in _yookassa_purchases()] == ["pay-1"]
+    assert [chat_id for chat_id, _ in bot.sent] == [USER_ID]
+    assert payments.load_yookassa_payments()["pay-1"]["status"] == "succeeded"
+
+
+def test_payment_with_legacy_hash_is_delivered(bot_module, shop, monkeypatch):
+    # Хэш старого формата включал время создания и не проверяется
+    _store_payment(150, {"hash": "0123456789abcdef"})
+
+    _recheck(bot_module, monkeypatch)
+
+    assert len(_yookassa_purchases()) == 1
+
+
+def test_tampered_payment_is_not_delivered(bot_module, shop, monkeypatch):
+    _store_payment(1, {
+        "hash": payments.generate_payment_hash(USER_ID, "p1", 150),
+        "hash_version": payments.PAYMENT_HASH_VERSION,
+    })
+
+    bot, _ = _recheck(bot_module, monkeypatch)
+
+    assert _yookassa_purchases() == []
+    assert bot.sent == []
+
+
+def test_pending_payment_is_rechecked_later(bot_module, shop, monkeypatch):
+    _store_payment(150, {})
+
+    bot, next_run_at = _recheck(bot_module, monkeypatch, status="pending")
+
+    assert next_run_at > time.time()
+    assert _yookassa_purchases() == []
+
+
+def test_delivery_happens_once(bot_module, shop, monkeypatch):
+    _store_payment(150, {})
+
+    _recheck(bot_module, monkeypatch)
+    bot, _ = _recheck(bot_module, monkeypatch)
+
+    assert len(_yookassa_purchases()) == 1
+    assert bot.sent == []
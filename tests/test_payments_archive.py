@@ -0,0 +1,110 @@
+# test_payments_archive.py - Перенос платежей ЮКассы в архив
+import json
+import os
+
+import pytest
+
+import payments_archive
+
+NOW = 1_700_000_000
+OLD = NOW - 40 * 86400
+
+
+def _payment(payment_id, status="succeeded", created_at=OLD):
+    return {"payment_id": payment_id, "user_id": 1, "status": status, "created_at": created_at}
+
+
+def test_archive_moves_only_old_final_payments(tenant):
+    payments = {
+        "old": _payment("old"),
+        "pending": _payment("pending", status="pending"),
+        "fresh": _payment("fresh", created_at=NOW),
+    }
+
+    assert payments_archive.archive_payments(payments, now=NOW) == 1
+    assert set(payments) == {"pending", "fresh"}
+    assert payments_archive.find_archived_payment("old") == _payment("old")
+    assert payments_archive.find_archived_payment("pending") is None
+    assert payments_archive.archive_stats() == {"segments": 1, "payments": 1}
+
+
+def test_archive_writes_segment_then_index_then_deletes(tenant, monkeypatch):
+    payments = {"a": _payment("a"), "b": _payment("b")}
+    steps = []
+    write_atomic = payments_archive._write_atomic
+
+    def record_write(path, data):
+        kind = "index" if os.path.basename(path) == payments_archive.INDEX_FILE else "segment"
+        steps.append((kind, len(payments)))
+        write_atomic(path, data)
+
+    monkeypatch.setattr(payments_archive, "_write_atomic", record_write)
+
+    payments_archive.archive_payments(payments, now=NOW)
+
+    # Оба шага записи выполняются, пока платежи ещё в горячем хранилище
+    assert steps == [("segment", 2), ("index", 2)]
+    assert payments == {}
+
+
+def test_failed_index_write_keeps_payments(tenant, monkeypatch):
+    payments = {"a": _payment("a")}
+
+    def broken_index(index):
+        raise OSError("диск заполнен")
+
+    monkeypatch.setattr(payments_archive, "_save_index", broken_index)
+    with pytest.raises(OSError):
+        payments_archive.archive_payments(payments, now=NOW)
+
+    assert "a" in payments
+    assert payments_archive.find_archived_payment("a") is None
+
+
+def test_index_is_rebuilt_from_segments(tenant):
+    payments_archive.archive_payments({"a": _payment("a")}, now=NOW)
+    with open(os.path.join(payments_archive.archive_dir(), payments_archive.INDEX_FILE), "w") as f:
+        f.write("{не json")
+
+    assert payments_archive.find_archived_payment("a") == _payment("a")
+
+
+def test_lookups_do_not_reread_the_index(tenant, monkeypatch):
+    payments_archive.archive_payments({"a": _payment("a")}, now=NOW)
+    reads = []
+    read_index = payments_archive._read_index
+
+    def counting_read():
+        reads.append(1)
+        return read_index()
+
+    monkeypatch.setattr(payments_archive, "_read_index", counting_read)
+    for _ in range(3):
+        assert payments_archive.find_archived_payment("a") == _payment("a")
+        assert payments_archive.find_archived_payment("unknown") is None
+
+    assert len(reads) == 1
+
+
+def test_index_changed_by_another_process_is_reread(tenant):
+    payments_archive.archive_payments({"a": _payment("a")}, now=NOW)
+    assert payments_archive.find_archived_payment("b") is None
+
+    # Другой процесс дописал сегмент и индекс
+    index = payments_archive._read_index()
+    index["ids"]["b"] = index["ids"]["a"]
+    payments_archive._write_atomic(
+        os.path.join(payments_archive.archive_dir(), payments_archive.INDEX_FILE), json.dumps(index).encode()
+    )
+
+    assert payments_archive.find_archived_payment("b") is None
+    assert payments_archive.load_index()["ids"]["b"] == index["ids"]["a"]
+
+
+def test_segments_are_not_rewritten(tenant):
+    payments_archive.archive_payments({"a": _payment("a")}, now=NOW)
+    payments_archive.archive_payments({"b": _payment("b")}, now=NOW)
+
+    assert payments_archive.archive_stats() == {"segments": 2, "payments": 2}
+    assert payments_archive.find_archived_payment("a") == _payment("a")
+    assert payments_archive.find_archived_payment("b") == _payment("b")
@@ -0,0 +1,54 @@
+# test_process_lock.py - Общие для процессов блокировки JSON-хранилищ и логов
+import logging
+import multiprocessing
+import os
+
+import tenants
+from data_tools import Product, add_purchase, load_db
+from logging_setup import CompressingRotatingFileHandler
+
+PRODUCT = Product(id="p1", title="Товар", description="", price_stars=100, deliver_text="", deliver_url="",
+                  price_rub=150)
+PER_WORKER = 25
+
+
+def _buy(data_dir: str, user_id: int) -> None:
+    with tenants.use(tenants.Tenant(name="worker", token="", data_dir=data_dir)):
+        for _ in range(PER_WORKER):
+            add_purchase(user_id, PRODUCT)
+
+
+def test_workers_do_not_lose_each_others_purchases(tenant):
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=_buy, args=(tenant.data_dir, user_id)) for user_id in (1, 2, 3)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    purchases = load_db()["purchases"]
+    assert {uid: len(items) for uid, items in purchases.items()} == {"1": PER_WORKER, "2": PER_WORKER, "3": PER_WORKER}
+
+
+def _record(message: str) -> logging.LogRecord:
+    return logging.LogRecord("test", logging.INFO, __file__, 1, message, None, None)
+
+
+def test_log_rotated_by_another_worker_is_reopened(tmp_path):
+    path = str(tmp_path / "bot.log")
+    first = CompressingRotatingFileHandler(path, max_bytes=200, when="")
+    second = CompressingRotatingFileHandler(path, max_bytes=200, when="")
+    try:
+        first.emit(_record("a" * 150))
+        # Второй процесс переполняет файл и поворачивает его
+        second.emit(_record("b" * 150))
+        first.emit(_record("после ротации"))
+    finally:
+        first.close()
+        second.close()
+
+    segments = [name for name in os.listdir(tmp_path) if name.endswith(".gz")]
+    assert len(segments) == 1
+    with open(path, encoding="utf-8") as f:
+        content = f.read()
+    assert "b" * 150 in content and "после ротации" in content
@@ -0,0 +1,56 @@
+# test_products_watcher.py - Разница между products.json и каталогом
+import catalog
+from data_tools import Product
+from products_watcher import diff_products
+
+
+def _product(pid, price=100):
+    return Product(id=pid, title=f"Товар {pid}", description="", price_stars=price,
+                   deliver_text="", deliver_url="")
+
+
+def _catalog(*products):
+    return catalog.Catalog(tuple(products), version=1)
+
+
+def test_changed_product_is_upserted():
+    upserted, deleted = diff_products({"p1": _product("p1")}, {"p1": _product("p1", 200)},
+                                      _catalog(_product("p1")))
+
+    assert upserted == [_product("p1", 200)]
+    assert deleted == []
+
+
+def test_unchanged_file_keeps_admin_edits():
+    # Цену изменили в админ-панели, файл тот же: правка не откатывается
+    upserted, deleted = diff_products({"p1": _product("p1")}, {"p1": _product("p1")},
+                                      _catalog(_product("p1", 300)))
+
+    assert upserted == []
+    assert deleted == []
+
+
+def test_change_already_in_catalog_is_skipped():
+    upserted, _ = diff_products({"p1": _product("p1")}, {"p1": _product("p1", 200)},
+                                _catalog(_product("p1", 200)))
+
+    assert upserted == []
+
+
+def test_removed_product_is_deleted_only_if_in_catalog():
+    upserted, deleted = diff_products({"p1": _product("p1"), "p2": _product("p2")}, {},
+                                      _catalog(_product("p1")))
+
+    assert upserted == []
+    assert deleted == ["p1"]
+
+
+def test_first_sync_compares_file_with_catalog():
+    # При первой проверке известны только id товаров, сохранённые с прошлого запуска
+    previous = {"p1": None, "p2": None}
+    current = {"p1": _product("p1"), "p3": _product("p3")}
+
+    upserted, deleted = diff_products(previous, current, _catalog(_product("p1"), _product("p2")))
+
+    assert upserted == [_product("p3")]
+    assert deleted == ["p2"]
@@ -0,0 +1,57 @@
+# test_router.py - Маршрутизация callback-кнопок
+import asyncio
+from types import SimpleNamespace
+
+from router import CallbackRouter, Route, parse_callback
+
+
+def _router(calls):
+    def callback(name):
+        async def run(update, context):
+            calls.append(name)
+        return run
+
+    router = CallbackRouter()
+    router.add("admin", callback("admin_stats"), action="stats")
+    router.add("admin", callback("admin_back"), action="back")
+    router.add("prod", callback("product"))
+    return router
+
+
+def _query(data):
+    return SimpleNamespace(callback_query=SimpleNamespace(data=data))
+
+
+def test_parse_callback():
+    assert parse_callback("admin:stats:token") == Route("admin", "stats", ("token",))
+    assert parse_callback("prod:p1") == Route("prod", "p1", ())
+    assert parse_callback("buy") == Route("buy", "", ())
+
+
+def test_action_routes_take_precedence_over_namespace():
+    calls = []
+    router = _router(calls)
+
+    for data in ("admin:stats", "admin:back:1", "prod:p1", "prod:p2:extra"):
+        asyncio.run(router.dispatch(_query(data), None))
+
+    assert calls == ["admin_stats", "admin_back", "product", "product"]
+
+
+def test_unknown_callbacks_do_not_match():
+    router = _router([])
+
+    # Неизвестное действие не уходит в обработчик другого действия того же пространства имён
+    assert not router.matches("admin:unknown")
+    assert not router.matches("other:stats")
+    assert not router.matches(None)
+    assert router.matches("prod:anything")
+    assert router.namespaces() == {"admin", "prod"}
+
+
+def test_dispatch_of_unknown_callback_is_ignored():
+    calls = []
+
+    asyncio.run(_router(calls).dispatch(_query("missing:x"), None))
+
+    assert calls == []
@@ -0,0 +1,25 @@
+# test_stars_payload.py - Подпись payload инвойсов Telegram Stars
+import payments
+from data_tools import Product
+
+PRODUCT = Product(id="p1", title="Подписка 1 месяц", description="", price_stars=100,
+                  deliver_text="", deliver_url="", price_rub=150)
+
+
+def test_created_payload_is_accepted(tenant):
+    _, payload = payments.create_stars_invoice_payload(7, PRODUCT)
+
+    assert payments.verify_stars_invoice_payload(payload, 7) == "p1"
+
+
+def test_payload_of_another_user_is_rejected(tenant):
+    _, payload = payments.create_stars_invoice_payload(7, PRODUCT)
+
+    assert payments.verify_stars_invoice_payload(payload, 8) is None
+
+
+def test_tampered_payload_is_rejected(tenant):
+    _, payload = payments.create_stars_invoice_payload(7, PRODUCT)
+
+    assert payments.verify_stars_invoice_payload(payload.replace("p=p1", "p=p2"), 7) is None
+    assert payments.verify_stars_invoice_payload(payload + "&p=p2", 7) is None
@@ -0,0 +1,24 @@
+# test_startup_profile.py - Профиль холодного старта
+from telegram import Update
+
+import startup_profile
+
+
+def test_first_update_handler_fires_once(bot_module, monkeypatch):
+    monkeypatch.setattr(startup_profile, "FIRST_UPDATE_AT", None)
+    monkeypatch.setattr(startup_profile, "MARKS", [])
+    handler = bot_module.FirstUpdateHandler()
+    update = Update(update_id=1)
+
+    assert handler.check_update(update)
+    assert startup_profile.record_first_update()
+
+    # Дальше обработчик не срабатывает и задачи на обновления не создаются
+    assert not handler.check_update(Update(update_id=2))
+    assert [name for name, _ in startup_profile.MARKS] == ["first_update"]
+
+
+def test_first_update_handler_ignores_other_objects(bot_module, monkeypatch):
+    monkeypatch.setattr(startup_profile, "FIRST_UPDATE_AT", None)
+
+    assert not bot_module.FirstUpdateHandler().check_update("не обновление")
@@ -0,0 +1,139 @@
+# test_tenants.py - Изоляция магазинов в одном процессе
+import asyncio
+import json
+import os
+
+import pytest
+
+import tenants
+from data_tools import Product, add_purchase, get_all_purchases_flat
+
+
+@pytest.fixture
+def shops(tmp_path):
+    return (
+        tenants.Tenant(name="shop-a", token="a", data_dir=str(tmp_path / "a")),
+        tenants.Tenant(name="shop-b", token="b", data_dir=str(tmp_path / "b")),
+    )
+
+
+def test_path_follows_current_tenant(shops):
+    a, b = shops
+
+    with tenants.use(a):
+        assert tenants.path("db.json") == a.path("db.json")
+        with tenants.use(b):
+            assert tenants.path("db.json") == b.path("db.json")
+        assert tenants.current() is a
+    assert tenants.Tenant(name="x", token="").path("db.json") == "db.json"
+
+
+def test_tenant_dict_is_separate_per_tenant(shops):
+    a, b = shops
+    states = tenants.TenantDict()
+
+    with tenants.use(a):
+        states[1] = "a"
+    with tenants.use(b):
+        assert 1 not in states
+        assert states.get(1) is None
+        states[1] = "b"
+        assert len(states) == 1
+    with tenants.use(a):
+        assert states[1] == "a"
+        assert list(states) == [1]
+
+
+def test_tenant_scoped_creates_one_instance_per_tenant(shops):
+    a, b = shops
+    created = []
+
+    def factory(tenant):
+        created.append(tenant.name)
+        return {"db": tenant.path("bot.db")}
+
+    scoped = tenants.TenantScoped(factory)
+    with tenants.use(a):
+        assert scoped.get() is scoped.get()
+        assert scoped.get()["db"] == a.path("bot.db")
+    with tenants.use(b):
+        assert scoped.get()["db"] == b.path("bot.db")
+
+    assert created == ["shop-a", "shop-b"]
+
+
+def test_shop_data_is_isolated(shops):
+    a, b = shops
+    os.makedirs(a.data_dir)
+    os.makedirs(b.data_dir)
+    product = Product(id="p1", title="Товар", description="", price_stars=100, deliver_text="", deliver_url="")
+
+    with tenants.use(a):
+        add_purchase(1, product)
+    with tenants.use(b):
+        assert get_all_purchases_flat() == []
+    with tenants.use(a):
+        assert [uid for uid, _ in get_all_purchases_flat()] == ["1"]
+
+
+def test_tasks_keep_their_tenant(shops):
+    a, b = shops
+    seen = []
+
+    async def handle(tenant):
+        tenants.activate(tenant)
+        await asyncio.sleep(0.01)
+        seen.append((tenant.name, tenants.current().name, await asyncio.to_thread(tenants.path, "x")))
+
+    async def main():
+        await asyncio.gather(handle(a), handle(b))
+
+    asyncio.run(main())
+
+    assert sorted(seen) == [("shop-a", "shop-a", a.path("x")), ("shop-b", "shop-b", b.path("x"))]
+
+
+def test_per_tenant_job_runs_for_every_shop(shops, monkeypatch):
+    monkeypatch.setattr(tenants, "TENANTS", {})
+    tenants.register(list(shops))
+    seen = []
+
+    async def job(context):
+        seen.append(tenants.current().name)
+
+    asyncio.run(tenants.per_tenant(job)(None))
+
+    assert seen == ["shop-a", "shop-b"]
+    assert tenants.current() is tenants.DEFAULT_TENANT
+
+
+def test_register_rejects_duplicate_names(shops, monkeypatch):
+    monkeypatch.setattr(tenants, "TENANTS", {})
+
+    with pytest.raises(ValueError):
+        tenants.register([shops[0], shops[0]])
+
+
+def test_load_tenants(tmp_path, monkeypatch):
+    monkeypatch.setenv("SHOP1_TOKEN", "token-1")
+    path = tmp_path / "tenants.json"
+    path.write_text(json.dumps([
+        {"name": "shop1", "token_env": "SHOP1_TOKEN", "admin_ids": [1, 2]},
+        {"name": "shop2", "token": "token-2", "data_dir": "/srv/shop2"},
+    ]), encoding="utf-8")
+
+    shop1, shop2 = tenants.load_tenants(str(path))
+
+    assert shop1 == tenants.Tenant(
+        "shop1", "token-1", os.path.join(tenants.TENANTS_DIR, "shop1"), frozenset({1, 2}))
+    assert shop2.data_dir == "/srv/shop2"
+    assert shop2.admin_ids == tenants.DEFAULT_TENANT.admin_ids
+
+
+@pytest.mark.parametrize("item", [{"name": "../etc", "token": "t"}, {"name": "shop"}])
+def test_load_tenants_rejects_bad_entries(tmp_path, item):
+    path = tmp_path / "tenants.json"
+    path.write_text(json.dumps([item]), encoding="utf-8")
+
+    with pytest.raises(ValueError):
+        tenants.load_tenants(str(path))
@@ -0,0 +1,89 @@
+# test_update_processor.py - Параллельная обработка обновлений
+import asyncio
+from datetime import datetime
+
+from telegram import Chat, Message, Update, User
+
+import tenants
+from update_processor import PerUserUpdateProcessor, update_key
+
+
+def _update(update_id, user_id):
+    user = User(id=user_id, first_name="u", is_bot=False)
+    chat = Chat(id=user_id, type=Chat.PRIVATE)
+    return Update(update_id, message=Message(update_id, datetime.now(), chat, from_user=user, text="x"))
+
+
+def _run(processor, updates, handle):
+    async def main():
+        await asyncio.gather(*(processor.process_update(u, handle(u)) for u in updates))
+    asyncio.run(main())
+
+
+def test_update_key():
+    assert update_key(_update(1, 42)) == 42
+    assert update_key(Update(2)) is None
+    assert update_key("не обновление") is None
+
+
+def test_updates_of_one_user_run_in_order():
+    events = []
+    processor = PerUserUpdateProcessor(8)
+
+    async def handle(update):
+        events.append(("start", update.update_id))
+        # Первое обновление самое медленное: без очереди второе закончилось бы раньше
+        await asyncio.sleep(0.03 if update.update_id == 1 else 0)
+        events.append(("end", update.update_id))
+
+    _run(processor, [_update(n, 42) for n in (1, 2, 3)], handle)
+
+    assert events == [("start", 1), ("end", 1), ("start", 2), ("end", 2), ("start", 3), ("end", 3)]
+    assert processor.active_users == 0
+
+
+def test_different_users_run_in_parallel():
+    running = []
+    peak = [0]
+    processor = PerUserUpdateProcessor(8)
+
+    async def handle(update):
+        running.append(update.update_id)
+        peak[0] = max(peak[0], len(running))
+        await asyncio.sleep(0.02)
+        running.remove(update.update_id)
+
+    _run(processor, [_update(n, 100 + n) for n in range(5)], handle)
+
+    assert peak[0] == 5
+
+
+def test_concurrency_limit_is_respected():
+    running = []
+    peak = [0]
+    processor = PerUserUpdateProcessor(2)
+
+    async def handle(update):
+        running.append(update.update_id)
+        peak[0] = max(peak[0], len(running))
+        await asyncio.sleep(0.01)
+        running.remove(update.update_id)
+
+    _run(processor, [_update(n, 100 + n) for n in range(6)], handle)
+
+    assert peak[0] == 2
+
+
+def test_processor_activates_its_tenant():
+    shop = tenants.Tenant(name="update-processor-shop", token="")
+    seen = []
+    processor = PerUserUpdateProcessor(4, tenant=shop)
+
+    async def handle(update):
+        seen.append(tenants.current().name)
+
+    _run(processor, [_update(1, 1), Update(2)], handle)
+
+    assert seen == [shop.name, shop.name]
+    # Магазин задаётся только в задаче обработки обновления
+    assert tenants.current() is not shop
@@ -0,0 +1,139 @@
+# test_user_registry.py - Известные пользователи и пакетная запись
+import sqlite3
+
+import pytest
+
+import migrations
+import user_registry
+
+
+@pytest.fixture
+def db_path(tenant):
+    path = tenant.path(user_registry.DB_PATH)
+    migrations.migrate(path)
+    return path
+
+
+def _users(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute("SELECT user_id, username, full_name FROM users ORDER BY user_id").fetchall()
+    finally:
+        conn.close()
+
+
+def test_only_new_or_renamed_users_are_queued(db_path):
+    registry = user_registry.UserRegistry(db_path)
+
+    assert registry.observe(1, "alice", "Alice")
+    assert not registry.observe(1, "alice", "Alice")
+    assert registry.observe(1, "alice", "Alice Smith")
+    assert registry.observe(2, None, None)
+
+    assert registry.pending == 2
+    assert registry.flush() == 2
+    assert registry.flush() == 0
+    assert _users(db_path) == [(1, "alice", "Alice Smith"), (2, "", "")]
+
+
+def test_known_users_are_loaded_from_database(db_path):
+    writer = user_registry.UserRegistry(db_path)
+    writer.observe(1, "alice", "Alice")
+    writer.flush()
+
+    registry = user_registry.UserRegistry(db_path)
+    assert registry.load() == 1
+
+    assert 1 in registry
+    assert not registry.observe(1, "alice", "Alice")
+    assert registry.pending == 0
+
+
+def test_users_seen_before_load_keep_fresh_profile(db_path):
+    writer = user_registry.UserRegistry(db_path)
+    writer.observe(1, "old", "Old name")
+    writer.flush()
+
+    registry = user_registry.UserRegistry(db_path)
+    registry.observe(1, "new", "New name")
+    registry.load()
+    registry.flush()
+
+    assert not registry.observe(1, "new", "New name")
+    assert _users(db_path) == [(1, "new", "New name")]
+
+
+def test_failed_flush_keeps_changes(db_path, tmp_path):
+    registry = user_registry.UserRegistry(str(tmp_path / "missing" / "bot.db"))
+    registry.observe(1, "alice", "Alice")
+
+    with pytest.raises(sqlite3.OperationalError):
+        registry.flush()
+
+    assert registry.pending == 1
+    registry.db_path = db_path
+    assert registry.flush() == 1
+    assert _users(db_path) == [(1, "alice", "Alice")]
+
+
+def _activity(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute("SELECT user_id, last_seen, clicks FROM users ORDER BY user_id").fetchall()
+    finally:
+        conn.close()
+
+
+def test_activity_is_accumulated_and_written_in_one_batch(db_path):
+    tracker = user_registry.ActivityTracker(db_path)
+    for ts in (100, 130, 120):
+        tracker.touch(1, ts)
+    tracker.touch(2, 50)
+
+    assert tracker.pending == 2
+    assert tracker.flush() == 2
+    assert tracker.pending == 0
+    # Последнее действие — по времени, а не по порядку вызовов записи
+    tracker.touch(1, 90)
+    tracker.flush()
+
+    assert _activity(db_path) == [(1, 130, 4), (2, 50, 1)]
+
+
+def test_activity_does_not_overwrite_profile(db_path):
+    registry = user_registry.UserRegistry(db_path)
+    registry.observe(1, "alice", "Alice")
+    registry.flush()
+    tracker = user_registry.ActivityTracker(db_path)
+    tracker.touch(1, 100)
+    tracker.flush()
+
+    assert _users(db_path) == [(1, "alice", "Alice")]
+
+
+def test_failed_activity_flush_is_merged_back(db_path, tmp_path):
+    tracker = user_registry.ActivityTracker(str(tmp_path / "missing" / "bot.db"))
+    tracker.touch(1, 100)
+
+    with pytest.raises(sqlite3.OperationalError):
+        tracker.flush()
+    tracker.touch(1, 90)
+
+    tracker.db_path = db_path
+    assert tracker.flush() == 1
+    assert _activity(db_path) == [(1, 100, 2)]
+
+
+def test_active_users_metric(db_path):
+    tracker = user_registry.ActivityTracker(db_path, shop="metrics-shop")
+    now = int(user_registry.time.time())
+    tracker.touch(1, now - 3600)
+    tracker.touch(2, now - 3 * 86400)
+    tracker.touch(3, now - 60 * 86400)
+    tracker.flush()
+
+    tracker.update_metrics()
+
+    values = {window: user_registry.ACTIVE_USERS._values[("metrics-shop", window)]
+              for window, _ in user_registry.ACTIVE_WINDOWS}
+    assert values == {"1d": 1, "7d": 2, "30d": 2}
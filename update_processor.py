@@ -0,0 +1,80 @@
+# update_processor.py - Параллельная обработка обновлений с очередью на пользователя
+#
+# Обновления разных пользователей обрабатываются одновременно (до
+# CONCURRENT_UPDATES штук), поэтому медленный запрос к ЮКассе одного
+# пользователя не задерживает остальных. Обновления одного пользователя
+# (двойное нажатие «оплатить», successful_payment вперемешку с кликом по меню)
+# выполняются строго по очереди, в порядке поступления: asyncio.Lock отдаёт
+# блокировку ожидающим в порядке FIFO.
+#
+# Процессор, созданный для магазина (tenants.Tenant), делает его текущим
+# в задаче обработки обновления.
+import asyncio
+import logging
+import os
+from typing import Any, Awaitable, Dict, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+import tenants
+
+logger = logging.getLogger(__name__)
+
+# Сколько обновлений обрабатывается одновременно (ожидающие своей очереди
+# обновления того же пользователя тоже занимают место)
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "64"))
+
+
+def update_key(update: object) -> Optional[int]:
+    """Ключ сериализации: пользователь, а для обновлений без пользователя — чат"""
+    if not isinstance(update, Update):
+        return None
+    if update.effective_user is not None:
+        return update.effective_user.id
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    return None
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Параллельно для разных пользователей, последовательно для одного"""
+
+    def __init__(self, max_concurrent_updates: int = CONCURRENT_UPDATES,
+                 tenant: Optional[tenants.Tenant] = None):
+        super().__init__(max_concurrent_updates)
+        self.tenant = tenant
+        # user_id -> [блокировка, число обновлений в работе и в очереди]
+        self._users: Dict[int, list] = {}
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        if self.tenant is not None:
+            # Каждое обновление обрабатывается в своей задаче: магазин задаётся на всю задачу
+            tenants.activate(self.tenant)
+        key = update_key(update)
+        if key is None:
+            await coroutine
+            return
+
+        entry = self._users.get(key)
+        if entry is None:
+            entry = self._users[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._users[key]
+
+    @property
+    def active_users(self) -> int:
+        """Сколько пользователей сейчас имеют обновления в работе"""
+        return len(self._users)
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
@@ -0,0 +1,233 @@
+# user_registry.py - Известные пользователи и пакетная запись в таблицу users
+#
+# При запуске из базы загружаются id всех пользователей с отпечатком
+# (username, full_name). /start и /myid сверяются с ним в памяти: запись
+# нужна только новым пользователям и тем, у кого сменилось имя. Такие
+# изменения копятся и раз в USER_FLUSH_INTERVAL секунд записываются одним
+# executemany (upsert), а не отдельным соединением на каждую команду.
+#
+# Так же копится активность: время последнего действия и число действий
+# пользователя. Раз в ACTIVITY_FLUSH_INTERVAL секунд она записывается в
+# колонки users.last_seen и users.clicks одним executemany, после чего
+# обновляются метрики активных пользователей.
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Dict, Tuple
+
+import tenants
+from metrics import ACTIVE_USERS, timed
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = "bot_database.db"
+USER_FLUSH_INTERVAL = float(os.getenv("USER_FLUSH_INTERVAL", "10"))
+ACTIVITY_FLUSH_INTERVAL = float(os.getenv("ACTIVITY_FLUSH_INTERVAL", "30"))
+# Окна для метрики bot_active_users
+ACTIVE_WINDOWS = (("1d", 86400), ("7d", 7 * 86400), ("30d", 30 * 86400))
+
+UPSERT_SQL = """
+    INSERT INTO users (user_id, username, full_name) VALUES (?, ?, ?)
+    ON CONFLICT(user_id) DO UPDATE SET username = excluded.username, full_name = excluded.full_name
+"""
+
+
+def _fingerprint(username: str, full_name: str) -> int:
+    # 32-битный отпечаток вместо строк: словарь id -> int заметно компактнее
+    return zlib.crc32(f"{username}\0{full_name}".encode("utf-8"))
+
+
+class UserRegistry:
+    """user_id -> отпечаток профиля и очередь изменений на запись"""
+
+    def __init__(self, db_path: str = DB_PATH):
+        self.db_path = db_path
+        self._known: Dict[int, int] = {}
+        self._pending: Dict[int, Tuple[str, str]] = {}
+        self._lock = threading.Lock()
+        self.loaded = False
+
+    @timed("sqlite")
+    def load(self) -> int:
+        """Загружает известных пользователей из базы. Возвращает их количество"""
+        started = time.perf_counter()
+        known: Dict[int, int] = {}
+        conn = sqlite3.connect(self.db_path)
+        try:
+            for user_id, username, full_name in conn.execute("SELECT user_id, username, full_name FROM users"):
+                known[user_id] = _fingerprint(username or "", full_name or "")
+        finally:
+            conn.close()
+        with self._lock:
+            # Пользователи, замеченные до окончания загрузки, уже стоят в очереди:
+            # их отпечатки свежее, чем в базе
+            known.update(self._known)
+            self._known = known
+            self.loaded = True
+        logger.info(f"Загружено известных пользователей: {len(known)} за {time.perf_counter() - started:.2f} с")
+        return len(known)
+
+    def observe(self, user_id: int, username: str = "", full_name: str = "") -> bool:
+        """
+        Отмечает пользователя. Возвращает True, если он новый или изменил
+        имя и поставлен в очередь на запись.
+        """
+        username = username or ""
+        full_name = full_name or ""
+        fingerprint = _fingerprint(username, full_name)
+        if self._known.get(user_id) == fingerprint:
+            return False
+        with self._lock:
+            self._known[user_id] = fingerprint
+            self._pending[user_id] = (username, full_name)
+        return True
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._known
+
+    def __len__(self) -> int:
+        return len(self._known)
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    @timed("sqlite")
+    def flush(self) -> int:
+        """Записывает накопленные изменения одной транзакцией. Возвращает число строк"""
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return 0
+        try:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            try:
+                with conn:
+                    conn.executemany(UPSERT_SQL, [(uid, u, f) for uid, (u, f) in batch.items()])
+            finally:
+                conn.close()
+        except Exception:
+            # Не потеряем изменения: вернём в очередь (более свежие данные не затираем)
+            with self._lock:
+                for user_id, profile in batch.items():
+                    self._pending.setdefault(user_id, profile)
+            raise
+        return len(batch)
+
+
+ACTIVITY_SQL = """
+    INSERT INTO users (user_id, last_seen, clicks) VALUES (?, ?, ?)
+    ON CONFLICT(user_id) DO UPDATE SET
+        last_seen = MAX(COALESCE(users.last_seen, 0), excluded.last_seen),
+        clicks = COALESCE(users.clicks, 0) + excluded.clicks
+"""
+
+
+class ActivityTracker:
+    """user_id -> [время последнего действия, число действий] с момента прошлой записи"""
+
+    def __init__(self, db_path: str = DB_PATH, shop: str = "default"):
+        self.db_path = db_path
+        # Магазин — метка метрики bot_active_users
+        self.shop = shop
+        self._pending: Dict[int, list] = {}
+        self._lock = threading.Lock()
+
+    def touch(self, user_id: int, ts: int = None) -> None:
+        ts = int(time.time()) if ts is None else ts
+        with self._lock:
+            entry = self._pending.get(user_id)
+            if entry is None:
+                self._pending[user_id] = [ts, 1]
+            else:
+                # Время могло отступить назад (коррекция часов, возврат пачки после ошибки записи)
+                entry[0] = max(entry[0], ts)
+                entry[1] += 1
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    @timed("sqlite")
+    def flush(self) -> int:
+        """Записывает накопленную активность одной транзакцией. Возвращает число пользователей"""
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return 0
+        try:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            try:
+                with conn:
+                    conn.executemany(ACTIVITY_SQL, [(uid, ts, clicks) for uid, (ts, clicks) in batch.items()])
+            finally:
+                conn.close()
+        except Exception:
+            # Возвращаем активность в очередь, складывая с накопленной за это время
+            with self._lock:
+                for user_id, (ts, clicks) in batch.items():
+                    entry = self._pending.setdefault(user_id, [ts, 0])
+                    entry[0] = max(entry[0], ts)
+                    entry[1] += clicks
+            raise
+        return len(batch)
+
+    @timed("sqlite")
+    def active_users(self, since: int) -> int:
+        """Сколько пользователей были активны начиная с момента since (unix time)"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            return conn.execute("SELECT COUNT(*) FROM users WHERE last_seen >= ?", (since,)).fetchone()[0]
+        finally:
+            conn.close()
+
+    def update_metrics(self) -> None:
+        now = int(time.time())
+        for window, seconds in ACTIVE_WINDOWS:
+            ACTIVE_USERS.set(self.shop, window, value=self.active_users(now - seconds))
+
+
+# У каждого магазина своя база и свои очереди записи
+REGISTRY = tenants.TenantScoped(lambda tenant: UserRegistry(tenant.path(DB_PATH)))
+ACTIVITY = tenants.TenantScoped(lambda tenant: ActivityTracker(tenant.path(DB_PATH), tenant.name))
+
+
+def register_user(user_id: int, username: str = "", full_name: str = "") -> bool:
+    return REGISTRY.observe(user_id, username, full_name)
+
+
+async def flush_job(context) -> None:
+    """Задача JobQueue: пакетная запись пользователей в отдельном потоке"""
+    try:
+        written = await asyncio.to_thread(REGISTRY.flush)
+        if written:
+            logger.info(f"Записано пользователей: {written}")
+    except Exception as e:
+        logger.error(f"Ошибка пакетной записи пользователей: {e}", exc_info=True)
+
+
+async def track_activity(update, context) -> None:
+    """Обработчик для всех обновлений: только отметка в памяти"""
+    user = update.effective_user
+    if user is not None:
+        ACTIVITY.touch(user.id)
+
+
+def _flush_activity() -> int:
+    # Сначала новые пользователи, чтобы имена записались вместе с активностью
+    REGISTRY.flush()
+    written = ACTIVITY.flush()
+    ACTIVITY.update_metrics()
+    return written
+
+
+async def activity_job(context) -> None:
+    """Задача JobQueue: запись активности и пересчёт метрики активных пользователей"""
+    try:
+        await asyncio.to_thread(_flush_activity)
+    except Exception as e:
+        logger.error(f"Ошибка записи активности пользователей: {e}", exc_info=True)